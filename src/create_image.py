@@ -3,17 +3,22 @@
 電子ペーパ表示用の画像を生成します。
 
 Usage:
-  create_image.py [-c CONFIG] [-S] [-o PNG_FILE] [-t] [-D] [-d]
+  create_image.py [-c CONFIG] [-S] [-o PNG_FILE] [-f FORMAT] [-z] [-T TIME] [-t] [-D] [-d]
 
 Options:
   -c CONFIG         : CONFIG を設定ファイルとして読み込んで実行します。[default: config.yaml]
   -S                : 小型ディスプレイモードで実行します。
   -o PNG_FILE       : 生成した画像を指定されたパスに保存します。
+  -f FORMAT         : 出力形式 (png / gray8 / gray4)。[default: png]
+  -z                : gray8 / gray4 の場合に、zlib で圧縮します。
+  -T TIME           : 画像が表示される時刻 (UNIX 時間)。時刻パネルに使います。
   -t                : テストモードで実行します。
   -d                : ダミーモードで実行します。
   -D                : デバッグモードで動作します。
 """
 
+import concurrent.futures
+import datetime
 import logging
 import multiprocessing
 import os
@@ -27,6 +32,8 @@ import my_lib.panel_util
 import my_lib.pil_util
 import PIL.Image
 
+import weather_display.framebuffer.frame_format
+import weather_display.framebuffer.quantize
 import weather_display.metrics.collector
 import weather_display.panel.power_graph
 import weather_display.panel.rain_cloud
@@ -35,6 +42,10 @@ import weather_display.panel.sensor_graph
 import weather_display.panel.time
 import weather_display.panel.wbgt
 import weather_display.panel.weather
+import weather_display.render.compositor
+import weather_display.render.frame_context
+import weather_display.render.log_relay
+import weather_display.render.pool
 
 SCHEMA_CONFIG = "config.schema"
 SCHEMA_CONFIG_SMALL = "config-small.schema"
@@ -44,35 +55,162 @@ ERROR_CODE_MINOR = 220
 # 描画全体がエラー
 ERROR_CODE_MAJOR = 222
 
+# NOTE: パネル描画の締め切り (panel.update.interval に対する割合)。
+# 締め切りに間に合わなかったパネルは、前回の画像を使って表示する。
+PANEL_DEADLINE_RATIO = 0.5
 
-def draw_wall(config, img):
-    if "wall" not in config:
-        return
-    for wall_config in config["wall"]["image"]:
-        my_lib.pil_util.alpha_paste(
-            img,
-            my_lib.pil_util.load_image(wall_config),
-            (wall_config["offset_x"], wall_config["offset_y"]),
+
+def get_layer_list(config, panel_map):
+    """合成する画像と位置のリストを、下になるものから順に返す"""
+    layer_list = [
+        (my_lib.pil_util.load_image(wall_config), (wall_config["offset_x"], wall_config["offset_y"]))
+        for wall_config in (config["wall"]["image"] if "wall" in config else [])
+    ]
+
+    for name in ["power", "weather", "sensor", "rain_cloud", "wbgt", "rain_fall", "time"]:
+        if name not in panel_map:
+            continue
+
+        layer_list.append(
+            (
+                panel_map[name],
+                (config[name]["panel"]["offset_x"], config[name]["panel"]["offset_y"]),
+            )
+        )
+
+    return layer_list
+
+
+def quantize_image(config, img):
+    """設定されていれば、電子ペーパが表示できる階調に減色する"""
+    quantize_config = config["panel"]["device"].get("quantize")
+    if quantize_config is None:
+        return img
+
+    start = time.perf_counter()
+    quantized = weather_display.framebuffer.quantize.apply(img, quantize_config)
+    logging.info(
+        "quantize time: %.3f sec (levels: %d, dither: %s)",
+        time.perf_counter() - start,
+        quantize_config.get("levels", 16),
+        quantize_config.get("dither", weather_display.framebuffer.quantize.DITHER_ORDERED),
+    )
+
+    # NOTE: 比較のためにエンコードを 2 回行うので、デバッグモードの場合だけ減色の効果を計測する
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        size, encode_time = weather_display.framebuffer.quantize.measure_encode(img)
+        quantized_size, quantized_encode_time = weather_display.framebuffer.quantize.measure_encode(quantized)
+        logging.debug(
+            "quantize effect: size = %s -> %s bytes (%.1f%%), encode = %.1f -> %.1f msec",
+            f"{size:,}",
+            f"{quantized_size:,}",
+            quantized_size / size * 100,
+            encode_time * 1000,
+            quantized_encode_time * 1000,
         )
 
+    return quantized
 
-def draw_panel(config, img, is_small_mode=False, is_test_mode=False, is_dummy_mode=False):
+
+def draw_stale_mark(config, panel_img, update_time):
+    """締め切りに間に合わず前回の画像を使ったことが分かるように、右上に更新時刻を描画する"""
+    panel_img = panel_img.copy()
+
+    update_text = "@ " + datetime.datetime.fromtimestamp(
+        update_time, datetime.timezone(datetime.timedelta(hours=9), "JST")
+    ).strftime("%H:%M")
+
+    my_lib.pil_util.draw_text(
+        panel_img,
+        update_text,
+        (panel_img.size[0] - 10, 10),
+        my_lib.pil_util.get_font(config["font"], "en_medium", 30),
+        "right",
+        "#666",
+        stroke_width=4,
+        stroke_fill=(255, 255, 255, 255),
+    )
+
+    return panel_img
+
+
+def wait_panel(worker_pool, panel, deadline):
+    """パネルの描画結果を待つ。締め切りに間に合わなかった場合は None を返す"""
+    # NOTE: 代わりに表示する画像が無い場合は、締め切りを過ぎても待つ
+    if (deadline is None) or (worker_pool.last_image(panel["name"]) is None):
+        return panel["task"].get()
+
+    try:
+        return panel["task"].get(max(deadline - time.perf_counter(), 0))
+    except multiprocessing.TimeoutError:
+        # NOTE: 遅れて届いた結果は次のフレームで使う
+        worker_pool.keep_pending(panel["name"], panel["task"])
+        return None
+
+
+def wait_context(context_future, deadline):
+    """パネルが使うデータ (context) を待つ。締め切りに間に合わなかった場合は空のデータを返す"""
+    try:
+        return context_future.result(None if deadline is None else max(deadline - time.perf_counter(), 0))
+    except concurrent.futures.TimeoutError:
+        # NOTE: 取得できなかったデータは、パネルの側で取得し直す
+        logging.warning("Prefetching context missed the deadline, submit panels without it")
+        return {}
+
+
+def draw_overlay(config, panel):
+    """表示する時刻に依存するパネルを、このプロセスでその場で描画する"""
+    return {
+        "result": panel["func"](config, *panel["arg"]),
+        "log": [],
+        "pid": os.getpid(),
+        "rss": 0,
+        "cache": {"hit": 0, "miss": 0},
+        "query": {"hit": 0, "miss": 0, "saved_time": 0.0},
+        "upsample": {"load_time": 0.0, "count": 0, "time": 0.0, "prepare_time": 0.0},
+    }
+
+
+def draw_panel(  # noqa: C901, PLR0912, PLR0915
+    config, is_small_mode=False, is_test_mode=False, is_dummy_mode=False, display_time=None
+):
+    """パネルを描画して合成し、グレースケールの画像と終了コードを返す"""
     if is_small_mode:
         panel_list = [
             {"name": "rain_cloud", "func": weather_display.panel.rain_cloud.create, "arg": (True,)},
-            {"name": "weather", "func": weather_display.panel.weather.create, "arg": (False,)},
-            {"name": "wbgt", "func": weather_display.panel.wbgt.create},
-            {"name": "time", "func": weather_display.panel.time.create},
+            {
+                "name": "weather",
+                "func": weather_display.panel.weather.create,
+                "arg": (False,),
+                "context": ["wbgt"],
+            },
+            {"name": "wbgt", "func": weather_display.panel.wbgt.create, "arg": (True,), "context": ["wbgt"]},
+            {
+                "name": "time",
+                "func": weather_display.panel.time.create,
+                "arg": (display_time,),
+                "is_overlay": True,
+            },
         ]
     else:
         panel_list = [
             {"name": "rain_cloud", "func": weather_display.panel.rain_cloud.create},
             {"name": "sensor", "func": weather_display.panel.sensor_graph.create},
             {"name": "power", "func": weather_display.panel.power_graph.create},
-            {"name": "weather", "func": weather_display.panel.weather.create},
-            {"name": "wbgt", "func": weather_display.panel.wbgt.create},
+            {
+                "name": "weather",
+                "func": weather_display.panel.weather.create,
+                "arg": (True,),
+                "context": ["wbgt"],
+            },
+            {"name": "wbgt", "func": weather_display.panel.wbgt.create, "arg": (True,), "context": ["wbgt"]},
             {"name": "rain_fall", "func": weather_display.panel.rain_fall.create},
-            {"name": "time", "func": weather_display.panel.time.create},
+            {
+                "name": "time",
+                "func": weather_display.panel.time.create,
+                "arg": (display_time,),
+                "is_overlay": True,
+            },
         ]
 
     panel_map = {}
@@ -80,19 +218,90 @@ def draw_panel(config, img, is_small_mode=False, is_test_mode=False, is_dummy_mo
 
     # NOTE: 並列処理 (matplotlib はマルチスレッド対応していないので、マルチプロセス処理する)
     start = time.perf_counter()
-    pool = multiprocessing.Pool(processes=len(panel_list))
-    for panel in panel_list:
-        arg = (config,)
-        if "arg" in panel:
-            arg += panel["arg"]
-        panel["task"] = pool.apply_async(panel["func"], arg)
 
-    pool.close()
-    pool.join()
+    # NOTE: 常駐プロセスではワーカーをフレーム間で使い回す。
+    # それ以外 (単発での実行) の場合は、このフレーム限りのワーカーを起動する。
+    worker_pool = weather_display.render.pool.get()
+    is_temporary_pool = worker_pool is None
+    if is_temporary_pool:
+        worker_pool = weather_display.render.pool.PanelWorkerPool()
+        deadline = None
+    else:
+        deadline = start + config["panel"]["update"]["interval"] * PANEL_DEADLINE_RATIO
+
+    # NOTE: 複数のパネルが使うデータ (context) は、他のパネルを描画している間に一度だけ取得し、
+    # 取得できてから、それを使うパネルを投入する
+    context_name_list = sorted({name for panel in panel_list for name in panel.get("context", [])})
+    context = None
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        context_future = executor.submit(
+            weather_display.render.log_relay.call,
+            weather_display.render.frame_context.prefetch,
+            config,
+            context_name_list,
+        )
+
+        for panel in sorted(panel_list, key=lambda panel: "context" in panel):
+            if panel.get("is_overlay", False):
+                continue
+
+            # NOTE: 前回のフレームで締め切りに間に合わなかったタスクがあれば、新たに投入せずにその結果を待つ
+            panel["task"] = worker_pool.pop_pending(panel["name"])
+            if panel["task"] is not None:
+                logging.info("Reuse pending task: %s panel", panel["name"])
+                continue
+
+            arg = (config,)
+            if "arg" in panel:
+                arg += panel["arg"]
+            if "context" in panel:
+                if context is None:
+                    context = wait_context(context_future, deadline)
+                arg += ({name: context[name] for name in panel["context"] if name in context},)
+            panel["task"] = worker_pool.submit(panel["name"], panel["func"], arg)
+    finally:
+        # NOTE: 締め切りに間に合わなかった取得は、終わるのを待たずに描画を進める
+        executor.shutdown(wait=False)
 
     ret = 0
     for panel in panel_list:
-        result = panel["task"].get()
+        # NOTE: 時刻パネル (is_overlay) はワーカーに投げず、他のパネルを全て待った後に最後に描画する。
+        # 描画に時間がかかっても、表示される時刻と食い違わないようにするため。
+        if panel.get("is_overlay", False):
+            task_info = draw_overlay(config, panel)
+        else:
+            task_info = wait_panel(worker_pool, panel, deadline)
+        if task_info is None:
+            last_image = worker_pool.last_image(panel["name"])
+            logging.warning("%s panel missed the deadline, use the last image", panel["name"])
+
+            panel_map[panel["name"]] = draw_stale_mark(config, last_image["image"], last_image["time"])
+            panel_metrics.append(
+                {
+                    "name": panel["name"],
+                    "elapsed_time": time.perf_counter() - start,
+                    "has_error": False,
+                    "error_message": None,
+                    "is_stale": True,
+                    "cache_hit": 0,
+                    "cache_miss": 0,
+                    "query_hit": 0,
+                    "query_miss": 0,
+                    "query_saved_time": 0.0,
+                    "upsample_load_time": 0.0,
+                    "upsample_count": 0,
+                    "upsample_time": 0.0,
+                    "icon_prepare_time": 0.0,
+                }
+            )
+            continue
+
+        if not (is_temporary_pool or panel.get("is_overlay", False)):
+            worker_pool.done(panel["name"], task_info)
+        weather_display.render.log_relay.forward(task_info["log"])
+
+        result = task_info["result"]
         panel_img = result[0]
         elapsed = result[1]
         has_error = len(result) > 2
@@ -112,12 +321,25 @@ def draw_panel(config, img, is_small_mode=False, is_test_mode=False, is_dummy_mo
             )
 
         panel_map[panel["name"]] = panel_img
+        if not has_error:
+            worker_pool.save_image(panel["name"], panel_img)
+
         panel_metrics.append(
             {
                 "name": panel["name"],
                 "elapsed_time": elapsed,
                 "has_error": has_error,
                 "error_message": error_message,
+                "is_stale": False,
+                "cache_hit": task_info["cache"]["hit"],
+                "cache_miss": task_info["cache"]["miss"],
+                "query_hit": task_info["query"]["hit"],
+                "query_miss": task_info["query"]["miss"],
+                "query_saved_time": task_info["query"]["saved_time"],
+                "upsample_load_time": task_info["upsample"]["load_time"],
+                "upsample_count": task_info["upsample"]["count"],
+                "upsample_time": task_info["upsample"]["time"],
+                "icon_prepare_time": task_info["upsample"]["prepare_time"],
             }
         )
 
@@ -126,6 +348,9 @@ def draw_panel(config, img, is_small_mode=False, is_test_mode=False, is_dummy_mo
     total_elapsed_time = time.perf_counter() - start
     logging.info("total elapsed time: %.3f sec", total_elapsed_time)
 
+    if is_temporary_pool:
+        worker_pool.term()
+
     # Log metrics to database
     try:
         db_path = (
@@ -145,25 +370,17 @@ def draw_panel(config, img, is_small_mode=False, is_test_mode=False, is_dummy_mo
     except Exception as e:
         logging.warning("Failed to log draw_panel metrics: %s", e)
 
-    draw_wall(config, img)
-
-    for name in ["power", "weather", "sensor", "rain_cloud", "wbgt", "rain_fall", "time"]:
-        if name not in panel_map:
-            continue
-
-        my_lib.pil_util.alpha_paste(
-            img,
-            panel_map[name],
-            (
-                config[name]["panel"]["offset_x"],
-                config[name]["panel"]["offset_y"],
-            ),
-        )
+    compose_start = time.perf_counter()
+    img = weather_display.render.compositor.compose(
+        (config["panel"]["device"]["width"], config["panel"]["device"]["height"]),
+        get_layer_list(config, panel_map),
+    )
+    logging.info("compose time: %.3f sec", time.perf_counter() - compose_start)
 
-    return ret
+    return (quantize_image(config, img), ret)
 
 
-def create_image(config, small_mode=False, dummy_mode=False, test_mode=False):
+def create_image(config, small_mode=False, dummy_mode=False, test_mode=False, display_time=None):
     # NOTE: オプションでダミーモードが指定された場合、環境変数もそれに揃えておく
     if dummy_mode:
         logging.warning("Set dummy mode")
@@ -174,28 +391,23 @@ def create_image(config, small_mode=False, dummy_mode=False, test_mode=False):
     logging.info("Start to create image")
     logging.info("Mode : %s", "small" if small_mode else "normal")
 
-    img = PIL.Image.new(
-        "RGBA",
-        (config["panel"]["device"]["width"], config["panel"]["device"]["height"]),
-        (255, 255, 255, 255),
-    )
     if test_mode:
-        return (img, 0)
+        return (
+            PIL.Image.new(
+                "RGBA",
+                (config["panel"]["device"]["width"], config["panel"]["device"]["height"]),
+                (255, 255, 255, 255),
+            ),
+            0,
+        )
 
     try:
-        ret = draw_panel(config, img, small_mode, test_mode, dummy_mode)
-
-        return (img, ret)
+        return draw_panel(config, small_mode, test_mode, dummy_mode, display_time)
     except Exception:
-        draw = PIL.ImageDraw.Draw(img)
-        draw.rectangle(
-            (
-                0,
-                0,
-                config["panel"]["device"]["width"],
-                config["panel"]["device"]["height"],
-            ),
-            fill=(255, 255, 255, 255),
+        img = PIL.Image.new(
+            "RGBA",
+            (config["panel"]["device"]["width"], config["panel"]["device"]["height"]),
+            (255, 255, 255, 255),
         )
 
         my_lib.pil_util.draw_text(
@@ -232,7 +444,10 @@ if __name__ == "__main__":
     dummy_mode = args["-d"]
     test_mode = args["-t"]
     debug_mode = args["-D"]
-    out_file = args["-o"] if args["-o"] is not None else sys.stdout.buffer
+    out_file = args["-o"]
+    output_format = args["-f"]
+    compress = args["-z"]
+    display_time = float(args["-T"]) if args["-T"] is not None else None
 
     my_lib.logger.init("panel.e-ink.weather", level=logging.DEBUG if debug_mode else logging.INFO)
 
@@ -240,10 +455,15 @@ if __name__ == "__main__":
         config_file, pathlib.Path(SCHEMA_CONFIG_SMALL if small_mode else SCHEMA_CONFIG)
     )
 
-    img, status = create_image(config, small_mode, dummy_mode, test_mode)
+    img, status = create_image(config, small_mode, dummy_mode, test_mode, display_time)
 
-    logging.info("Save %s.", out_file)
-    my_lib.pil_util.convert_to_gray(img).save(out_file, "PNG")
+    data = weather_display.framebuffer.frame_format.encode(img, output_format, compress)
+
+    if out_file is None:
+        sys.stdout.buffer.write(data)
+    else:
+        logging.info("Save %s.", out_file)
+        pathlib.Path(out_file).write_bytes(data)
 
     if status == 0:
         logging.info("create_image: Succeeded.")
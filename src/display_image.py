@@ -3,18 +3,26 @@
 電子ペーパ表示用の画像を表示します。
 
 Usage:
-  display_image.py [-c CONFIG] [-s HOST] [-p PORT] [-S] [-t] [-O] [-D]
+  display_image.py [-c CONFIG] [-C CONFIG] [-s HOST]... [-p PORT] [-R SOCKET] [-M MODE]
+                   [-A] [-S] [-t] [-O] [-D]
 
 Options:
   -c CONFIG         : CONFIG を設定ファイルとして読み込んで実行します。[default: config.yaml]
+  -C CONFIG         : 小型ディスプレイ (HOST:small) 向けの設定ファイル。[default: config-small.yaml]
   -S                : 小型ディスプレイモードで実行します。
   -t                : テストモードで実行します。
-  -s HOST           : 表示を行う Raspberry Pi のホスト名。
+  -s HOST           : 表示を行う Raspberry Pi のホスト名。複数指定すると、1 回生成した画像を
+                      全てに表示します。HOST:small とすると小型ディスプレイ向けの画像を表示します。
   -p PORT           : メトリクス表示用のサーバーを動かすポート番号。[default: 5000]
+  -R SOCKET         : 画像生成サーバの Unix ソケットのパス。[default: data/render.sock]
+  -M MODE           : 表示方式 (fbi: PNG を fbi で表示, damage: 変化した領域だけを書き込む,
+                      raw: 画面全体をグレースケールのまま書き込む)。[default: fbi]
+  -A                : 推定描画時間だけ前倒しして描画を始め、各分の 0 秒ちょうどに表示を切り替えます。
   -O                : 1回のみ表示
   -D                : デバッグモードで動作します。
 """
 
+import concurrent.futures
 import datetime
 import logging
 import os
@@ -31,6 +39,7 @@ import my_lib.proc_util
 import weather_display.display
 import weather_display.metrics.collector
 import weather_display.metrics.server
+import weather_display.render.client
 import weather_display.timing_filter
 
 TIMEZONE = zoneinfo.ZoneInfo("Asia/Tokyo")
@@ -44,6 +53,69 @@ NOTIFY_THRESHOLD = 2
 elapsed_list = []
 
 
+def connect(rasp_hostname, key_file_path, prev_ssh, connection, detail_metrics):
+    # NOTE: 接続を維持している場合はそれを使い、そうでなければ毎回接続し直す
+    connect_start = time.perf_counter()
+    if connection is None:
+        weather_display.display.ssh_kill_and_close(prev_ssh, "fbi")
+        ssh = weather_display.display.ssh_connect(rasp_hostname, key_file_path)
+    else:
+        ssh = connection.get()
+    detail_metrics["connect_time"] = time.perf_counter() - connect_start
+    logging.info("SSH connect time: %.3f sec (%s)", detail_metrics["connect_time"], rasp_hostname)
+
+    return ssh
+
+
+def update_detail_metrics(detail_metrics, result):
+    detail_metrics["render_time"] = result.get("latency")
+    for key in ["sent_bytes", "ttfb", "transfer_time"]:
+        detail_metrics[key] = result.get(key)
+
+
+def calc_sleep_time(config, start, timing_controller):
+    # NOTE: 更新されていることが直感的に理解しやすくなるように、
+    # 更新完了タイミングを各分の 0 秒に合わせる
+    elapsed = time.perf_counter() - start
+
+    # カルマンフィルタを使用したタイミング制御
+    if timing_controller is None:
+        timing_controller = weather_display.timing_filter.TimingController(
+            update_interval=config["panel"]["update"]["interval"], target_second=0
+        )
+
+    sleep_time, diff_sec = timing_controller.calculate_sleep_time(elapsed, datetime.datetime.now(TIMEZONE))
+
+    # タイミングのずれが大きい場合は警告
+    if abs(diff_sec) > 3:
+        logging.warning("Update timing gap is large: %d", diff_sec)
+
+    # 従来の統計ベース手法も維持（比較用）
+    if len(elapsed_list) >= 10:
+        elapsed_list.pop(0)
+    elapsed_list.append(elapsed)
+
+    return sleep_time, diff_sec, timing_controller
+
+
+def log_metrics(config, start_time, elapsed_time, detail_metrics, **kwargs):
+    try:
+        db_path = (
+            pathlib.Path(config["metrics"]["data"])
+            if "metrics" in config and "data" in config["metrics"]
+            else None
+        )
+        weather_display.metrics.collector.collect_display_image_metrics(
+            elapsed_time=elapsed_time,
+            timestamp=start_time,
+            db_path=db_path,
+            **kwargs,
+            **detail_metrics,
+        )
+    except Exception as e:
+        logging.warning("Failed to log execute metrics: %s", e)
+
+
 def execute(  # noqa: PLR0913
     config,
     rasp_hostname,
@@ -54,83 +126,218 @@ def execute(  # noqa: PLR0913
     is_one_time,
     prev_ssh=None,
     timing_controller=None,
+    render_client=None,
+    display_mode=weather_display.display.DISPLAY_MODE_FBI,
+    connection=None,
 ):
     start_time = datetime.datetime.now(TIMEZONE)
     start = time.perf_counter()
     success = True
     error_message = None
     sleep_time = 60
+    diff_sec = 0
+    # NOTE: 画像の生成や転送にかかった時間など、処理の内訳
+    detail_metrics = {}
 
     try:
-        weather_display.display.ssh_kill_and_close(prev_ssh, "fbi")
-
-        ssh = weather_display.display.ssh_connect(rasp_hostname, key_file_path)
-
-        weather_display.display.execute(ssh, config, config_file, small_mode, test_mode)
-
-        if is_one_time:
-            diff_sec = 0
-        else:
-            # diff_secはtiming_controllerで計算されるため、ここでは初期化のみ
-            diff_sec = 0
-
-            # NOTE: 更新されていることが直感的に理解しやすくなるように、
-            # 更新完了タイミングを各分の 0 秒に合わせる
-            elapsed = time.perf_counter() - start
-
-            # カルマンフィルタを使用したタイミング制御
-            if timing_controller is None:
-                timing_controller = weather_display.timing_filter.TimingController(
-                    update_interval=config["panel"]["update"]["interval"], target_second=0
-                )
-
-            sleep_time, diff_sec = timing_controller.calculate_sleep_time(
-                elapsed, datetime.datetime.now(TIMEZONE)
-            )
+        ssh = connect(rasp_hostname, key_file_path, prev_ssh, connection, detail_metrics)
 
-            # タイミングのずれが大きい場合は警告
-            if abs(diff_sec) > 3:
-                logging.warning("Update timing gap is large: %d", diff_sec)
+        result = weather_display.display.execute(
+            ssh, config, config_file, small_mode, test_mode, render_client, display_mode
+        )
+        update_detail_metrics(detail_metrics, result)
 
-            # 従来の統計ベース手法も維持（比較用）
-            if len(elapsed_list) >= 10:
-                elapsed_list.pop(0)
-            elapsed_list.append(elapsed)
+        if not is_one_time:
+            sleep_time, diff_sec, timing_controller = calc_sleep_time(config, start, timing_controller)
 
     except Exception as e:
         success = False
         error_message = str(e)
         logging.exception("execute failed")
         ssh = prev_ssh  # Return previous ssh connection on error
+        if connection is not None:
+            # NOTE: 接続に問題がある可能性があるので、次回は接続し直す
+            connection.close()
 
     finally:
         # Log metrics to database
-        elapsed_time = time.perf_counter() - start
-        try:
-            db_path = (
-                pathlib.Path(config["metrics"]["data"])
-                if "metrics" in config and "data" in config["metrics"]
-                else None
-            )
-            weather_display.metrics.collector.collect_display_image_metrics(
-                elapsed_time=elapsed_time,
-                is_small_mode=small_mode,
-                is_test_mode=test_mode,
-                is_one_time=is_one_time,
-                rasp_hostname=rasp_hostname,
-                success=success,
-                error_message=error_message,
-                timestamp=start_time,
-                sleep_time=sleep_time,
-                diff_sec=diff_sec,
-                db_path=db_path,
-            )
-        except Exception as e:
-            logging.warning("Failed to log execute metrics: %s", e)
+        log_metrics(
+            config,
+            start_time,
+            time.perf_counter() - start,
+            detail_metrics,
+            is_small_mode=small_mode,
+            is_test_mode=test_mode,
+            is_one_time=is_one_time,
+            rasp_hostname=rasp_hostname,
+            success=success,
+            error_message=error_message,
+            sleep_time=sleep_time,
+            diff_sec=diff_sec,
+        )
 
     return ssh, sleep_time, timing_controller
 
 
+def parse_target(host_list, small_mode, key_file_path):
+    """「HOST」または「HOST:small」の形式で指定された表示先を解釈する"""
+    target_list = []
+    for host in host_list:
+        hostname, _, variant = host.partition(":")
+        if variant not in ["", "normal", "small"]:
+            raise ValueError(f"Unknown display variant: {host}")  # noqa: TRY003, EM102
+
+        target_list.append(
+            {
+                "hostname": hostname,
+                "small_mode": small_mode or (variant == "small"),
+                "connection": weather_display.display.SSHConnection(hostname, key_file_path),
+            }
+        )
+
+    return target_list
+
+
+def display_target(target, config, config_file, test_mode, render_client, display_mode, rendered):  # noqa: PLR0913
+    """1 台の表示先に生成済みの画像を表示する。失敗しても他の表示先には影響させない"""
+    status = {"success": True, "error_message": None, "detail_metrics": {}}
+
+    try:
+        ssh = connect(target["hostname"], None, None, target["connection"], status["detail_metrics"])
+
+        result = weather_display.display.execute(
+            ssh,
+            config,
+            config_file,
+            target["small_mode"],
+            test_mode,
+            render_client,
+            display_mode,
+            rendered,
+        )
+        update_detail_metrics(status["detail_metrics"], result)
+    except Exception as e:
+        status["success"] = False
+        status["error_message"] = str(e)
+        logging.exception("Failed to display on %s", target["hostname"])
+        target["connection"].close()
+
+    return status
+
+
+def sleep_until(target_datetime):
+    wait_time = (target_datetime - datetime.datetime.now(TIMEZONE)).total_seconds()
+    if wait_time > 0:
+        time.sleep(wait_time)
+
+
+def render_variant(target_list, config_file_map, test_mode, render_client, display_mode, display_time):  # noqa: PLR0913
+    # NOTE: 表示先が何台あっても、画像の生成は 1 周期につきバリエーション (通常 / 小型) ごとに 1 回だけ
+    rendered_map = {}
+    for small_mode in sorted({target["small_mode"] for target in target_list}):
+        render_start = time.perf_counter()
+        rendered_map[small_mode] = weather_display.display.render_for_display(
+            config_file_map[small_mode], small_mode, test_mode, render_client, display_mode, display_time
+        )
+        rendered_map[small_mode].setdefault("latency", time.perf_counter() - render_start)
+
+    return rendered_map
+
+
+def execute_fanout(  # noqa: PLR0913
+    config_map,
+    config_file_map,
+    target_list,
+    test_mode,
+    is_one_time,
+    timing_controller=None,
+    render_client=None,
+    display_mode=weather_display.display.DISPLAY_MODE_FBI,
+    render_ahead=False,
+):
+    """1 回だけ生成した画像を、複数の表示先に並行して表示する.
+
+    render_ahead が指定された場合は、推定描画時間だけ前倒しして描画を始め、
+    次の更新時刻ちょうどに表示を切り替える。
+    """
+    config = config_map[target_list[0]["small_mode"]]
+    sleep_time = 60
+    diff_sec = 0
+    display_datetime = None
+
+    if timing_controller is None:
+        timing_controller = weather_display.timing_filter.TimingController(
+            update_interval=config["panel"]["update"]["interval"], target_second=0
+        )
+
+    if render_ahead:
+        start_delay, display_datetime = timing_controller.schedule_render(datetime.datetime.now(TIMEZONE))
+        logging.info("Start rendering in %.1f sec for %s", start_delay, display_datetime.strftime("%H:%M:%S"))
+        time.sleep(start_delay)
+
+    start_time = datetime.datetime.now(TIMEZONE)
+    start = time.perf_counter()
+
+    rendered_map = render_variant(
+        target_list,
+        config_file_map,
+        test_mode,
+        render_client,
+        display_mode,
+        None if display_datetime is None else display_datetime.timestamp(),
+    )
+
+    if render_ahead:
+        timing_controller.update_render_time(time.perf_counter() - start)
+        # NOTE: 描画し終えた画像は、更新時刻ちょうどになるまで送らずに待つ
+        sleep_until(display_datetime)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(target_list)) as executor:
+        future_list = [
+            executor.submit(
+                display_target,
+                target,
+                config_map[target["small_mode"]],
+                config_file_map[target["small_mode"]],
+                test_mode,
+                render_client,
+                display_mode,
+                rendered_map[target["small_mode"]],
+            )
+            for target in target_list
+        ]
+        status_list = [future.result() for future in future_list]
+
+    if render_ahead:
+        # NOTE: 次のフレームの描画開始までの待ち時間は、次回の schedule_render() で計算する
+        sleep_time = 0
+        diff_sec = timing_controller.calculate_diff_sec(datetime.datetime.now(TIMEZONE))
+    elif not is_one_time:
+        sleep_time, diff_sec, timing_controller = calc_sleep_time(config, start, timing_controller)
+
+    elapsed_time = time.perf_counter() - start
+    for target, status in zip(target_list, status_list, strict=True):
+        log_metrics(
+            config_map[target["small_mode"]],
+            start_time,
+            elapsed_time,
+            status["detail_metrics"],
+            is_small_mode=target["small_mode"],
+            is_test_mode=test_mode,
+            is_one_time=is_one_time,
+            rasp_hostname=target["hostname"],
+            success=status["success"],
+            error_message=status["error_message"],
+            sleep_time=sleep_time,
+            diff_sec=diff_sec,
+        )
+
+    if not any(status["success"] for status in status_list):
+        raise RuntimeError("Failed to display on all hosts")  # noqa: TRY003, EM101
+
+    return sleep_time, timing_controller
+
+
 if __name__ == "__main__":
     import docopt
     import my_lib.config
@@ -139,10 +346,16 @@ if __name__ == "__main__":
     args = docopt.docopt(__doc__)
 
     config_file = args["-c"]
+    config_small_file = args["-C"]
     is_one_time = args["-O"]
     small_mode = args["-S"]
-    rasp_hostname = os.environ.get("RASP_HOSTNAME", args["-s"])
+    host_list = args["-s"]
+    if "RASP_HOSTNAME" in os.environ:
+        host_list = os.environ["RASP_HOSTNAME"].split(",")
     metrics_port = int(args["-p"])
+    render_socket = args["-R"]
+    display_mode = args["-M"]
+    render_ahead = args["-A"]
     test_mode = args["-t"]
     debug_mode = args["-D"]
 
@@ -153,33 +366,65 @@ if __name__ == "__main__":
         pathlib.Path("key/panel.id_rsa"),
     )
 
-    if rasp_hostname is None:
+    if len(host_list) == 0:
         raise ValueError("HOSTNAME is required")  # noqa: TRY003, EM101
+    if display_mode not in weather_display.display.DISPLAY_MODE_LIST:
+        raise ValueError(f"Unknown display mode: {display_mode}")  # noqa: TRY003, EM102
 
-    config = my_lib.config.load(
-        config_file, pathlib.Path(SCHEMA_CONFIG_SMALL if small_mode else SCHEMA_CONFIG)
-    )
+    target_list = parse_target(host_list, small_mode, key_file_path)
+
+    # NOTE: 表示先の種類 (通常 / 小型) ごとに設定ファイルを読み込む
+    config_file_map = {False: config_file, True: config_file if small_mode else config_small_file}
+    config_map = {
+        variant: my_lib.config.load(
+            config_file_map[variant], pathlib.Path(SCHEMA_CONFIG_SMALL if variant else SCHEMA_CONFIG)
+        )
+        for variant in {target["small_mode"] for target in target_list}
+    }
+    config = config_map[target_list[0]["small_mode"]]
 
-    logging.info("Raspberry Pi hostname: %s", rasp_hostname)
+    logging.info("Raspberry Pi hostname: %s", ", ".join(target["hostname"] for target in target_list))
 
     handle = weather_display.metrics.server.start(config, metrics_port)
+    render_client = weather_display.render.client.RenderClient(render_socket)
+
+    def close_all():
+        render_client.close()
+        for target in target_list:
+            target["connection"].close()
 
     fail_count = 0
     prev_ssh = None
     timing_controller = None
     while True:
         try:
-            prev_ssh, sleep_time, timing_controller = execute(
-                config,
-                rasp_hostname,
-                key_file_path,
-                config_file,
-                small_mode,
-                test_mode,
-                is_one_time,
-                prev_ssh,
-                timing_controller,
-            )
+            if (len(target_list) == 1) and not render_ahead:
+                prev_ssh, sleep_time, timing_controller = execute(
+                    config,
+                    target_list[0]["hostname"],
+                    key_file_path,
+                    config_file_map[target_list[0]["small_mode"]],
+                    target_list[0]["small_mode"],
+                    test_mode,
+                    is_one_time,
+                    prev_ssh,
+                    timing_controller,
+                    render_client,
+                    display_mode,
+                    target_list[0]["connection"],
+                )
+            else:
+                sleep_time, timing_controller = execute_fanout(
+                    config_map,
+                    config_file_map,
+                    target_list,
+                    test_mode,
+                    is_one_time,
+                    timing_controller,
+                    render_client,
+                    display_mode,
+                    render_ahead,
+                )
             fail_count = 0
 
             if is_one_time:
@@ -195,8 +440,10 @@ if __name__ == "__main__":
                 logging.error("エラーが続いたので終了します。")  # noqa: TRY400
                 sys.stderr.flush()
                 time.sleep(1)
+                close_all()
                 raise
             else:
                 time.sleep(10)
 
+    close_all()
     weather_display.metrics.server.term(handle)
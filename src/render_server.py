@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+電子ペーパ表示用の画像を生成する常駐サーバです。
+
+Usage:
+  render_server.py [-s SOCKET] [-P] [-D]
+
+Options:
+  -s SOCKET         : 待ち受ける Unix ソケットのパスを指定します。[default: data/render.sock]
+  -P                : 標準入力がクローズされたら (親プロセスが終了したら) 終了します。
+  -D                : デバッグモードで動作します。
+"""
+
+import logging
+import sys
+import threading
+
+import weather_display.render.server
+
+
+def wait_parent_exit():
+    # NOTE: 親プロセスが終了すると標準入力が EOF になる
+    while sys.stdin.buffer.read(1024):
+        pass
+
+
+if __name__ == "__main__":
+    import docopt
+    import my_lib.logger
+
+    args = docopt.docopt(__doc__)
+
+    socket_path = args["-s"]
+    watch_parent = args["-P"]
+    debug_mode = args["-D"]
+
+    my_lib.logger.init("panel.e-ink.weather", level=logging.DEBUG if debug_mode else logging.INFO)
+
+    handle = weather_display.render.server.start(socket_path)
+
+    try:
+        if watch_parent:
+            wait_parent_exit()
+            logging.warning("Parent process exited")
+        else:
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        logging.info("Received KeyboardInterrupt, shutting down...")
+
+    weather_display.render.server.term(handle)
@@ -2,6 +2,7 @@ import logging
 import pathlib
 import subprocess
 import sys
+import threading
 import time
 import traceback
 
@@ -11,11 +12,46 @@ import my_lib.proc_util
 import paramiko
 
 import create_image
+import weather_display.framebuffer.damage
+import weather_display.framebuffer.frame_format
 
 RETRY_COUNT = 3
 RETRY_WAIT = 2
 CREATE_IMAGE = pathlib.Path(__file__).parent.parent / "create_image.py"
 
+# NOTE: create_image.py の出力を SSH に転送する単位
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# NOTE: 表示方式。fbi は PNG を送って fbi で表示し、damage は前回からの差分だけを、
+# raw は画面全体をグレースケールのままフレームバッファに書き込む
+DISPLAY_MODE_FBI = "fbi"
+DISPLAY_MODE_DAMAGE = "damage"
+DISPLAY_MODE_RAW = "raw"
+DISPLAY_MODE_LIST = [DISPLAY_MODE_FBI, DISPLAY_MODE_DAMAGE, DISPLAY_MODE_RAW]
+
+# NOTE: raw で送る画像の形式 (E-Ink は 16 階調なので 4bit で十分)
+RAW_FRAME_FORMAT = weather_display.framebuffer.frame_format.FORMAT_GRAY4
+RAW_FRAME_COMPRESS = True
+
+# NOTE: 表示方式ごとの、生成する画像の形式と圧縮の有無
+# (damage は差分を取るために復元するので、PNG ではなくグレースケールのまま受け取る)
+DISPLAY_FORMAT_MAP = {
+    DISPLAY_MODE_FBI: (weather_display.framebuffer.frame_format.FORMAT_PNG, False),
+    DISPLAY_MODE_DAMAGE: (weather_display.framebuffer.frame_format.FORMAT_GRAY8, False),
+    DISPLAY_MODE_RAW: (RAW_FRAME_FORMAT, RAW_FRAME_COMPRESS),
+}
+
+FB_RECEIVER = pathlib.Path(__file__).parent / "framebuffer" / "receiver.py"
+FB_RECEIVER_REMOTE = "/dev/shm/fb_receiver.py"  # noqa: S108
+# NOTE: 表示がずれたままにならないよう、定期的に画面全体を送り直す
+FULL_UPDATE_INTERVAL = 30
+
+# NOTE: 接続を維持している場合に、切断を検出するための keepalive の間隔
+KEEPALIVE_INTERVAL = 30
+
+# NOTE: フレームバッファに直接書き込む場合の状態 (表示先 -> 前回送った画像など)
+remote_state_map = {}
+
 
 def exec_patiently(func, args):
     for i in range(RETRY_COUNT):
@@ -72,53 +108,373 @@ def ssh_connect(hostname, key_file_path):
     return exec_patiently(ssh_connect_impl, (hostname, key_file_path))
 
 
-def execute(ssh, config, config_file, small_mode, test_mode):
-    ssh_stdin, ssh_stdout, ssh_stderr = exec_patiently(
-        ssh.exec_command,
-        (
-            "cat - > /dev/shm/display.png && "
-            "sudo fbi -1 -T 1 -d /dev/fb0 --noverbose /dev/shm/display.png; echo $?",
-        ),
-    )
+class SSHConnection:
+    """Raspberry Pi への SSH 接続を維持し、フレームごとに新しいチャンネルを開いて使う"""
+
+    def __init__(self, hostname, key_file_path):
+        """初期化.
+
+        Args:
+            hostname: 接続先のホスト名
+            key_file_path: 認証に使う秘密鍵のパス
+
+        """
+        self.hostname = hostname
+        self.key_file_path = key_file_path
+        self.ssh = None
+
+    def is_active(self):
+        if self.ssh is None:
+            return False
+
+        transport = self.ssh.get_transport()
+        if (transport is None) or (not transport.is_active()):
+            return False
+
+        try:
+            transport.send_ignore()
+        except Exception:
+            logging.warning("SSH connection to %s is broken", self.hostname)
+            return False
+
+        return True
+
+    def get(self):
+        """接続済みの SSHClient を返す。切断されていれば接続し直す"""
+        if not self.is_active():
+            self.close()
+
+            self.ssh = ssh_connect(self.hostname, self.key_file_path)
+            self.ssh.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+
+        return self.ssh
+
+    def close(self):
+        if self.ssh is None:
+            return
+
+        try:
+            self.ssh.close()
+        except Exception:
+            logging.warning("Failed to close SSH connection to %s", self.hostname)
+
+        self.ssh = None
 
-    logging.info("Start drawing.")
 
+def create_image_cmd(config_file, small_mode, test_mode, output_format, compress, display_time=None):  # noqa: PLR0913
     cmd = ["python3", CREATE_IMAGE, "-c", config_file]
     if small_mode:
         cmd.append("-S")
     if test_mode:
         cmd.append("-t")
+    if output_format != weather_display.framebuffer.frame_format.FORMAT_PNG:
+        cmd.extend(["-f", output_format])
+    if compress:
+        cmd.append("-z")
+    if display_time is not None:
+        cmd.extend(["-T", str(display_time)])
+
+    return cmd
+
+
+def create_image_subprocess(  # noqa: PLR0913
+    config_file,
+    small_mode,
+    test_mode,
+    output_format=weather_display.framebuffer.frame_format.FORMAT_PNG,
+    compress=False,
+    display_time=None,
+):
+    cmd = create_image_cmd(config_file, small_mode, test_mode, output_format, compress, display_time)
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)  # noqa: S603
+    image = proc.communicate()[0]
+    proc.wait()
+
+    logging.info(proc.communicate()[1].decode("utf-8"))
+
+    return {"image": image, "status": proc.returncode}
+
+
+def stream_image_subprocess(  # noqa: PLR0913
+    output,
+    config_file,
+    small_mode,
+    test_mode,
+    output_format=weather_display.framebuffer.frame_format.FORMAT_PNG,
+    compress=False,
+):
+    """create_image.py の出力を、生成されたそばから output に書き込む"""
+    cmd = create_image_cmd(config_file, small_mode, test_mode, output_format, compress)
 
     proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)  # noqa: S603
-    ssh_stdin.write(proc.communicate()[0])
+
+    # NOTE: 標準エラー出力のパイプが詰まって止まらないよう、並行して読み出しておく
+    stderr_buf = []
+    stderr_thread = threading.Thread(target=lambda: stderr_buf.append(proc.stderr.read()))
+    stderr_thread.start()
+
+    result = {"sent_bytes": 0, "first_byte": None}
+    while True:
+        chunk = proc.stdout.read1(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        if result["first_byte"] is None:
+            result["first_byte"] = time.perf_counter()
+
+        output.write(chunk)
+        result["sent_bytes"] += len(chunk)
+
     proc.wait()
+    stderr_thread.join()
+
+    logging.info(stderr_buf[0].decode("utf-8"))
+
+    result["status"] = proc.returncode
+
+    return result
+
+
+def send_image(  # noqa: PLR0913
+    output,
+    config_file,
+    small_mode,
+    test_mode,
+    render_client,
+    display_mode=DISPLAY_MODE_FBI,
+    rendered=None,
+):
+    """画像を生成して output に書き込む (rendered が指定された場合は、生成済みの画像を書き込む)"""
+    if rendered is not None:
+        result = dict(rendered)
+    elif render_client is None:
+        return stream_image_subprocess(
+            output, config_file, small_mode, test_mode, *DISPLAY_FORMAT_MAP[display_mode]
+        )
+    else:
+        # NOTE: 常駐サーバからはエンコードされたそばから画像が届くので、届いたそばから書き込む
+        output_format, compress = DISPLAY_FORMAT_MAP[display_mode]
+        return render_client.render(
+            config_file,
+            small_mode,
+            test_mode=test_mode,
+            output_format=output_format,
+            compress=compress,
+            output=output,
+        )
+
+    result["first_byte"] = time.perf_counter()
+    output.write(result["image"])
+    result["sent_bytes"] = len(result["image"])
+
+    return result
+
+
+def render(  # noqa: PLR0913
+    config_file,
+    small_mode,
+    test_mode,
+    render_client,
+    output_format=weather_display.framebuffer.frame_format.FORMAT_PNG,
+    compress=False,
+    display_time=None,
+):
+    # NOTE: 常駐している画像生成サーバが指定されていればそちらを使い、
+    # 指定されていなければ create_image.py をその都度起動する
+    if render_client is None:
+        return create_image_subprocess(
+            config_file, small_mode, test_mode, output_format, compress, display_time
+        )
+    else:
+        return render_client.render(
+            config_file,
+            small_mode,
+            test_mode=test_mode,
+            output_format=output_format,
+            compress=compress,
+            display_time=display_time,
+        )
+
+
+def render_for_display(config_file, small_mode, test_mode, render_client, display_mode, display_time=None):  # noqa: PLR0913
+    """表示方式に合わせた形式で画像を生成する (display_time は画像が表示される時刻の UNIX 時間)"""
+    return render(
+        config_file,
+        small_mode,
+        test_mode,
+        render_client,
+        *DISPLAY_FORMAT_MAP[display_mode],
+        display_time,
+    )
+
+
+def display_fbi(ssh, config_file, small_mode, test_mode, render_client, rendered=None):  # noqa: PLR0913
+    ssh_stdin, ssh_stdout, ssh_stderr = exec_patiently(
+        ssh.exec_command,
+        (
+            # NOTE: 接続を維持している場合は前回の fbi が残っているので、ここで終了させる
+            (
+                "sudo killall -q -9 fbi; "
+                "cat - > /dev/shm/display.png && "
+                "sudo fbi -1 -T 1 -d /dev/fb0 --noverbose /dev/shm/display.png; echo $?"
+            ),
+        ),
+    )
+
+    logging.info("Start drawing.")
+
+    result = send_image(
+        ssh_stdin, config_file, small_mode, test_mode, render_client, DISPLAY_MODE_FBI, rendered
+    )
+
+    return result, (ssh_stdin, ssh_stdout, ssh_stderr)
+
+
+def get_remote_state(ssh):
+    transport = ssh.get_transport()
+    key = transport.getpeername()[0] if transport is not None else None
+
+    return remote_state_map.setdefault(key, {"frame": None, "count": 0, "receiver": False})
+
+
+def exec_receiver(ssh, state):
+    if not state["receiver"]:
+        logging.info("Upload framebuffer receiver")
+        with ssh.open_sftp() as sftp:
+            sftp.put(str(FB_RECEIVER), FB_RECEIVER_REMOTE)
+        state["receiver"] = True
+
+    return exec_patiently(ssh.exec_command, (f"sudo python3 {FB_RECEIVER_REMOTE} -d /dev/fb0",))
+
+
+def update_remote_state(remote, status):
+    if status != 0:
+        # NOTE: 受信側のスクリプトが消えている可能性もあるので、次回は転送し直す
+        remote["state"]["receiver"] = False
+    elif "frame" in remote:
+        remote["state"].update({"frame": remote["frame"], "count": remote["count"] + 1})
+
+
+def display_raw(ssh, config_file, small_mode, test_mode, render_client, rendered=None):  # noqa: PLR0913
+    state = get_remote_state(ssh)
+
+    # NOTE: 受信側を先に起動しておき、画像生成と並行して準備させる
+    ssh_stdin, ssh_stdout, ssh_stderr = exec_receiver(ssh, state)
+
+    logging.info("Start drawing.")
+
+    result = send_image(
+        ssh_stdin, config_file, small_mode, test_mode, render_client, DISPLAY_MODE_RAW, rendered
+    )
+    result["remote"] = {"state": state}
+
+    return result, (ssh_stdin, ssh_stdout, ssh_stderr)
+
+
+def display_damage(ssh, config_file, small_mode, test_mode, render_client, rendered=None):  # noqa: PLR0913
+    state = get_remote_state(ssh)
+
+    logging.info("Start drawing.")
+
+    if rendered is not None:
+        result = dict(rendered)
+    else:
+        result = render_for_display(config_file, small_mode, test_mode, render_client, DISPLAY_MODE_DAMAGE)
+
+    frame = weather_display.framebuffer.frame_format.decode(result["image"])
+    prev_count = state["count"]
+    prev_frame = None if (prev_count % FULL_UPDATE_INTERVAL) == 0 else state["frame"]
+    rect_list = weather_display.framebuffer.damage.find_damage(prev_frame, frame)
+    payload = weather_display.framebuffer.damage.encode(frame, rect_list)
+
+    # NOTE: 途中で失敗した場合は表示内容が分からなくなるので、次回は画面全体を送る。
+    # 表示に成功したら execute() で今回の画像を記録する。
+    state["frame"] = None
+    state["count"] = 0
+
+    ssh_stdin, ssh_stdout, ssh_stderr = exec_receiver(ssh, state)
+    result["first_byte"] = time.perf_counter()
+    ssh_stdin.write(payload)
+
+    logging.info("Send %d rects (%s bytes)", len(rect_list), f"{len(payload):,}")
+
+    result["sent_bytes"] = len(payload)
+    result["remote"] = {"state": state, "frame": frame, "count": 0 if prev_frame is None else prev_count}
+
+    return result, (ssh_stdin, ssh_stdout, ssh_stderr)
+
+
+def execute(  # noqa: PLR0913
+    ssh,
+    config,
+    config_file,
+    small_mode,
+    test_mode,
+    render_client=None,
+    display_mode=DISPLAY_MODE_FBI,
+    rendered=None,
+):
+    start = time.perf_counter()
+
+    if display_mode == DISPLAY_MODE_DAMAGE:
+        display_func = display_damage
+    elif display_mode == DISPLAY_MODE_RAW:
+        display_func = display_raw
+    else:
+        display_func = display_fbi
+
+    result, (ssh_stdin, ssh_stdout, ssh_stderr) = display_func(
+        ssh, config_file, small_mode, test_mode, render_client, rendered
+    )
+    returncode = result["status"]
 
     ssh_stdin.flush()
     ssh_stdin.channel.shutdown_write()
 
-    logging.info(proc.communicate()[1].decode("utf-8"))
+    # NOTE: 最初のバイトを送り始めるまでの時間と、送り始めてから送り終えるまでの時間を分けて記録する
+    first_byte = result.pop("first_byte", None)
+    if first_byte is not None:
+        result["ttfb"] = first_byte - start
+        result["transfer_time"] = time.perf_counter() - first_byte
+        logging.info(
+            "Time to first byte: %.3f sec, transfer time: %.3f sec (%s bytes)",
+            result["ttfb"],
+            result["transfer_time"],
+            f"{result['sent_bytes']:,}",
+        )
 
     fbi_status = ssh_stdout.channel.recv_exit_status()
 
+    if "remote" in result:
+        update_remote_state(result.pop("remote"), fbi_status)
+
     # NOTE: -24 は create_image.py の異常時の終了コードに合わせる。
-    if (fbi_status == 0) and (proc.returncode == 0):
+    if (fbi_status == 0) and (returncode == 0):
         logging.info("Succeeded.")
         my_lib.footprint.update(pathlib.Path(config["liveness"]["file"]["display"]))
-    elif proc.returncode == create_image.ERROR_CODE_MAJOR:
-        logging.warning("Failed to create image at all. (code: %d)", proc.returncode)
-    elif proc.returncode == create_image.ERROR_CODE_MINOR:
-        logging.warning("Failed to create image partially. (code: %d)", proc.returncode)
+    elif returncode == create_image.ERROR_CODE_MAJOR:
+        logging.warning("Failed to create image at all. (code: %d)", returncode)
+    elif returncode == create_image.ERROR_CODE_MINOR:
+        logging.warning("Failed to create image partially. (code: %d)", returncode)
         my_lib.footprint.update(pathlib.Path(config["liveness"]["file"]["display"]))
     elif fbi_status != 0:
         logging.warning("Failed to display image. (code: %d)", fbi_status)
         logging.warning("[stdout] %s", ssh_stdout.read().decode("utf-8"))
         logging.warning("[stderr] %s", ssh_stderr.read().decode("utf-8"))
     else:
-        logging.error("Failed to create image. (code: %d)", proc.returncode)
-        sys.exit(proc.returncode)
+        logging.error("Failed to create image. (code: %d)", returncode)
+        if rendered is not None:
+            # NOTE: 複数の表示先に並行して表示するスレッドの中なので、プロセスは終了させずに
+            # 呼び出し元で表示先ごとの失敗として扱えるよう、例外を投げる
+            raise RuntimeError(f"Failed to create image (code: {returncode})")  # noqa: EM102, TRY003
+        sys.exit(returncode)
 
     ssh_stdin.close()
     ssh_stdout.close()
     ssh_stderr.close()
+    # NOTE: 接続は維持したまま、このフレームで使ったチャンネルだけを閉じる
+    ssh_stdout.channel.close()
 
     my_lib.proc_util.reap_zombie()
+
+    return result
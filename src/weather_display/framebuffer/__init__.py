@@ -0,0 +1,2 @@
+#!/usr/bin/env python3
+"""Frame transport to the Raspberry Pi framebuffer."""
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+前回送った画像との差分を取り、変化した矩形だけを送るためのデータを生成します。
+
+画像をタイルに分割して変化したタイルを求め、隣接するタイルを矩形にまとめた後、
+矩形ごとに実際に変化した画素の範囲まで縮めます。生成したデータは receiver.py で
+フレームバッファに書き込みます。
+"""
+
+import io
+
+import numpy as np
+
+from weather_display.framebuffer.receiver import HEADER, MAGIC, RECT
+
+TILE_SIZE = 32
+
+# NOTE: 変化した面積がこの割合を超える場合は、画面全体を 1 つの矩形として送る
+FULL_UPDATE_RATIO = 0.6
+
+
+def merge_tile(mask):
+    """変化したタイルのマスクを、タイル単位の矩形 (x, y, w, h) のリストにまとめる"""
+    rect_list = []
+    # NOTE: 直前の行から続いている矩形 (列の範囲 -> 矩形)
+    open_map = {}
+
+    for row in range(mask.shape[0]):
+        col_diff = np.diff(np.concatenate(([0], mask[row].astype(np.int8), [0])))
+        run_list = zip(np.flatnonzero(col_diff == 1), np.flatnonzero(col_diff == -1), strict=True)
+
+        next_map = {}
+        for begin, end in run_list:
+            span = (int(begin), int(end))
+            rect = open_map.pop(span, None)
+            if rect is None:
+                rect = [span[0], row, span[1] - span[0], 0]
+            rect[3] += 1
+            next_map[span] = rect
+
+        rect_list.extend(open_map.values())
+        open_map = next_map
+
+    rect_list.extend(open_map.values())
+
+    return [tuple(rect) for rect in rect_list]
+
+
+def find_damage(prev, cur, tile_size=TILE_SIZE):
+    """変化した矩形 (x, y, w, h) のリストを返す"""
+    height, width = cur.shape
+
+    if (prev is None) or (prev.shape != cur.shape):
+        return [(0, 0, width, height)]
+
+    diff = prev != cur
+
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:height, :width] = diff
+    mask = padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+    rect_list = []
+    for tx, ty, tw, th in merge_tile(mask):
+        x0 = tx * tile_size
+        y0 = ty * tile_size
+        x1 = min((tx + tw) * tile_size, width)
+        y1 = min((ty + th) * tile_size, height)
+
+        # NOTE: 矩形を実際に変化した画素の範囲まで縮める
+        sub = diff[y0:y1, x0:x1]
+        row_index = np.flatnonzero(sub.any(axis=1))
+        col_index = np.flatnonzero(sub.any(axis=0))
+
+        rect_list.append(
+            (
+                x0 + int(col_index[0]),
+                y0 + int(row_index[0]),
+                int(col_index[-1] - col_index[0]) + 1,
+                int(row_index[-1] - row_index[0]) + 1,
+            )
+        )
+
+    if sum(w * h for _, _, w, h in rect_list) > (width * height * FULL_UPDATE_RATIO):
+        return [(0, 0, width, height)]
+
+    return rect_list
+
+
+def encode(cur, rect_list):
+    """receiver.py に送るデータを生成する"""
+    height, width = cur.shape
+
+    buf = io.BytesIO()
+    buf.write(HEADER.pack(MAGIC, width, height, len(rect_list)))
+    for x, y, w, h in rect_list:
+        buf.write(RECT.pack(x, y, w, h))
+        buf.write(np.ascontiguousarray(cur[y : y + h, x : x + w]).tobytes())
+
+    return buf.getvalue()
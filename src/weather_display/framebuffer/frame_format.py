@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+表示用の画像をフレームバッファにそのまま書き込める形式に変換します。
+
+PNG の他に、8bit グレースケールと、16 階調の E-Ink 向けに 2 画素を 1 バイトに詰めた
+4bit グレースケールの形式に対応します。zlib (圧縮レベル 1) での圧縮も指定できます。
+実行すると、PNG と比較したエンコード時間、データサイズ、デコード時間を表示します。
+
+Usage:
+  frame_format.py [-i PNG_FILE] [-n COUNT] [-D]
+
+Options:
+  -i PNG_FILE       : ベンチマークに使う画像。[default: img/example.png]
+  -n COUNT          : 繰り返し回数。[default: 5]
+  -D                : デバッグモードで動作します。
+"""
+
+import io
+import logging
+import time
+import zlib
+
+import my_lib.pil_util
+import numpy as np
+import PIL.Image
+
+from weather_display.framebuffer.receiver import FRAME_HEADER, FRAME_MAGIC, decode_frame
+
+FORMAT_PNG = "png"
+FORMAT_GRAY8 = "gray8"
+FORMAT_GRAY4 = "gray4"
+FORMAT_LIST = [FORMAT_PNG, FORMAT_GRAY8, FORMAT_GRAY4]
+
+FORMAT_BITS = {FORMAT_GRAY8: 8, FORMAT_GRAY4: 4}
+
+# NOTE: 転送時間に比べて十分速く済むよう、最も速いレベルで圧縮する
+COMPRESS_LEVEL = 1
+
+PNG_MAGIC = b"\x89PNG"
+
+
+def pack_4bit(pixel):
+    """8bit グレースケールを 16 階調に丸め、2 画素を 1 バイトに詰める"""
+    level = ((pixel.astype(np.uint16) * 15 + 127) // 255).astype(np.uint8).ravel()
+    if level.size % 2 != 0:
+        level = np.append(level, np.uint8(0))
+
+    return ((level[0::2] << 4) | level[1::2]).tobytes()
+
+
+def write_gray(gray, output, output_format, compress=False):
+    """8bit グレースケールの画像を指定された形式に変換し、変換したそばから output に書き込む"""
+    if output_format == FORMAT_PNG:
+        # NOTE: PNG は圧縮したブロックごとに書き込まれるので、全体のエンコードを待たずに送り始められる
+        gray.save(output, "PNG")
+        return
+
+    pixel = np.asarray(gray)
+    height, width = pixel.shape
+
+    payload = pack_4bit(pixel) if output_format == FORMAT_GRAY4 else pixel.tobytes()
+
+    if compress:
+        payload = zlib.compress(payload, COMPRESS_LEVEL)
+
+    output.write(FRAME_HEADER.pack(FRAME_MAGIC, width, height, FORMAT_BITS[output_format], compress))
+    output.write(payload)
+
+
+def encode_gray(gray, output_format, compress=False):
+    """8bit グレースケールの画像を指定された形式に変換する"""
+    buf = io.BytesIO()
+    write_gray(gray, buf, output_format, compress)
+
+    return buf.getvalue()
+
+
+def check_format(output_format):
+    if output_format not in FORMAT_LIST:
+        raise ValueError(f"Unknown output format: {output_format}")  # noqa: EM102, TRY003
+
+
+def encode(img, output_format=FORMAT_PNG, compress=False):
+    """生成した画像を表示用の形式に変換する"""
+    check_format(output_format)
+
+    return encode_gray(my_lib.pil_util.convert_to_gray(img), output_format, compress)
+
+
+def write(img, output, output_format=FORMAT_PNG, compress=False):
+    """生成した画像を表示用の形式に変換し、変換したそばから output に書き込む"""
+    check_format(output_format)
+
+    write_gray(my_lib.pil_util.convert_to_gray(img), output, output_format, compress)
+
+
+def decode(data):
+    """encode() で変換したデータを 8bit グレースケールの配列に戻す"""
+    if data[: len(PNG_MAGIC)] == PNG_MAGIC:
+        return np.asarray(PIL.Image.open(io.BytesIO(data)).convert("L"))
+
+    header = FRAME_HEADER.unpack(data[: FRAME_HEADER.size])
+    if header[0] != FRAME_MAGIC:
+        raise ValueError("Unknown frame format")  # noqa: EM101, TRY003
+
+    _, width, height, _, _ = header
+    pixel = decode_frame(header, data[FRAME_HEADER.size :])
+
+    return np.frombuffer(pixel, dtype=np.uint8).reshape(height, width)
+
+
+def benchmark(img, count):
+    gray = img.convert("L")
+
+    def measure(func):
+        start = time.perf_counter()
+        for _ in range(count):
+            ret = func()
+        return ret, (time.perf_counter() - start) / count
+
+    result_list = []
+    for output_format in FORMAT_LIST:
+        for compress in [False, True]:
+            if (output_format == FORMAT_PNG) and compress:
+                continue
+
+            data, encode_time = measure(lambda f=output_format, c=compress: encode_gray(gray, f, c))
+            if output_format == FORMAT_PNG:
+                # NOTE: Raspberry Pi 側での fbi の処理に相当する、PNG のデコード
+                _, decode_time = measure(lambda d=data: PIL.Image.open(io.BytesIO(d)).load())
+            else:
+                # NOTE: Raspberry Pi 側の receiver.py と同じ処理
+                _, decode_time = measure(
+                    lambda d=data: decode_frame(
+                        FRAME_HEADER.unpack(d[: FRAME_HEADER.size]), d[FRAME_HEADER.size :]
+                    )
+                )
+
+            result_list.append(
+                {
+                    "format": output_format + ("+zlib" if compress else ""),
+                    "size": len(data),
+                    "encode": encode_time,
+                    "decode": decode_time,
+                }
+            )
+
+    return result_list
+
+
+if __name__ == "__main__":
+    # TEST Code
+    import docopt
+    import my_lib.logger
+
+    args = docopt.docopt(__doc__)
+
+    in_file = args["-i"]
+    count = int(args["-n"])
+    debug_mode = args["-D"]
+
+    my_lib.logger.init("test", level=logging.DEBUG if debug_mode else logging.INFO)
+
+    img = PIL.Image.open(in_file)
+    logging.info("Benchmark with %s (%dx%d, %d times)", in_file, img.size[0], img.size[1], count)
+
+    for result in benchmark(img, count):
+        logging.info(
+            "%-11s: size = %10s bytes, encode = %6.1f msec, decode = %6.1f msec",
+            result["format"],
+            f"{result['size']:,}",
+            result["encode"] * 1000,
+            result["decode"] * 1000,
+        )
+
+    logging.info("Finish.")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+グレースケールの画像を、電子ペーパが表示できる階調 (2 / 4 / 16) に減色します。
+
+ディザリングは、Bayer 行列による組織的ディザ (ordered) と、Floyd-Steinberg の誤差拡散
+(diffusion) から選べます。減色の前に、デバイスごとのガンマ補正のテーブルを適用できます。
+実行すると、減色しない場合と比較した PNG のサイズとエンコード時間を表示します。
+
+Usage:
+  quantize.py [-i PNG_FILE] [-n COUNT] [-g GAMMA] [-D]
+
+Options:
+  -i PNG_FILE       : ベンチマークに使う画像。[default: img/example.png]
+  -n COUNT          : 繰り返し回数。[default: 5]
+  -g GAMMA          : ガンマ補正の値。[default: 1.0]
+  -D                : デバッグモードで動作します。
+"""
+
+import io
+import logging
+import time
+
+import numpy as np
+import PIL.Image
+
+DITHER_NONE = "none"
+DITHER_ORDERED = "ordered"
+DITHER_DIFFUSION = "diffusion"
+DITHER_LIST = [DITHER_NONE, DITHER_ORDERED, DITHER_DIFFUSION]
+
+LEVELS_LIST = [2, 4, 16]
+
+
+def bayer_matrix(order=3):
+    """2^order x 2^order の Bayer 行列を 0 以上 1 未満に正規化して返す"""
+    matrix = np.zeros((1, 1), dtype=np.int32)
+    for _ in range(order):
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+
+    return (matrix + 0.5) / matrix.size
+
+
+BAYER_MATRIX = bayer_matrix()
+
+
+def gamma_lut(gamma):
+    """ガンマ補正のテーブル"""
+    return np.round(255 * (np.arange(256) / 255) ** gamma).astype(np.uint8)
+
+
+def level_value(levels):
+    """各階調の 8bit での値"""
+    return np.round(np.arange(levels) * 255 / (levels - 1)).astype(np.uint8)
+
+
+def ordered_table(levels):
+    """Bayer 行列の位置ごとの、8bit の値から減色後の値へのテーブル"""
+    index = np.floor(np.arange(256) * ((levels - 1) / 255) + BAYER_MATRIX.reshape(-1, 1))
+
+    return level_value(levels)[np.minimum(index, levels - 1).astype(np.int32)]
+
+
+def quantize_ordered(pixel, levels):
+    height, width = pixel.shape
+    size = BAYER_MATRIX.shape[0]
+
+    # NOTE: Bayer 行列の位置と画素の値を組み合わせた添字で、テーブルを 1 回引くだけで済ませる
+    position = np.arange(size * size, dtype=np.uint16).reshape(size, size) * 256
+    offset = np.tile(position, (-(-height // size), -(-width // size)))[:height, :width]
+
+    return np.take(ordered_table(levels).ravel(), offset + pixel)
+
+
+def quantize_diffusion(pixel, levels):
+    # NOTE: 誤差拡散は画素ごとに逐次処理する必要があるので、Pillow の実装を使う。
+    # Pillow はグレースケールの画像ではパレットを無視するので、RGB に変換してから減色する。
+    value = level_value(levels)
+
+    palette = PIL.Image.new("P", (1, 1))
+    palette.putpalette(np.repeat(value, 3).tolist())
+
+    index = (
+        PIL.Image.fromarray(pixel)
+        .convert("RGB")
+        .quantize(palette=palette, dither=PIL.Image.Dither.FLOYDSTEINBERG)
+    )
+
+    return value[np.asarray(index)]
+
+
+def quantize(img, levels=16, dither=DITHER_ORDERED, gamma=1.0):
+    """グレースケールの画像を、指定された階調に減色した画像を返す"""
+    if levels not in LEVELS_LIST:
+        raise ValueError(f"Unsupported levels: {levels}")  # noqa: EM102, TRY003
+    if dither not in DITHER_LIST:
+        raise ValueError(f"Unknown dither: {dither}")  # noqa: EM102, TRY003
+
+    pixel = np.asarray(img.convert("L"))
+    if gamma != 1.0:
+        pixel = np.take(gamma_lut(gamma), pixel)
+
+    if dither == DITHER_ORDERED:
+        pixel = quantize_ordered(pixel, levels)
+    elif dither == DITHER_DIFFUSION:
+        pixel = quantize_diffusion(pixel, levels)
+    else:
+        pixel = np.take(level_value(levels)[(np.arange(256) * (levels - 1) + 127) // 255], pixel)
+
+    return PIL.Image.fromarray(pixel)
+
+
+def apply(img, quantize_config):
+    """設定 (panel.device.quantize) に従って減色する"""
+    return quantize(
+        img,
+        quantize_config.get("levels", 16),
+        quantize_config.get("dither", DITHER_ORDERED),
+        quantize_config.get("gamma", 1.0),
+    )
+
+
+def encode_png(img):
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def measure_encode(img):
+    """PNG にエンコードしたサイズ (バイト) と、エンコードにかかった時間を返す"""
+    gray = img.convert("L")
+
+    start = time.perf_counter()
+    data = encode_png(gray)
+
+    return len(data), time.perf_counter() - start
+
+
+def benchmark(img, count, gamma=1.0):
+    gray = img.convert("L")
+
+    def measure(func):
+        start = time.perf_counter()
+        for _ in range(count):
+            ret = func()
+        return ret, (time.perf_counter() - start) / count
+
+    data, encode_time = measure(lambda: encode_png(gray))
+    result_list = [{"name": "original", "quantize": 0, "encode": encode_time, "size": len(data)}]
+
+    for levels in LEVELS_LIST:
+        for dither in DITHER_LIST:
+            quantized, quantize_time = measure(lambda lv=levels, d=dither: quantize(gray, lv, d, gamma))
+            data, encode_time = measure(lambda q=quantized: encode_png(q))
+
+            result_list.append(
+                {
+                    "name": f"{levels}/{dither}",
+                    "quantize": quantize_time,
+                    "encode": encode_time,
+                    "size": len(data),
+                }
+            )
+
+    return result_list
+
+
+if __name__ == "__main__":
+    # TEST Code
+    import docopt
+    import my_lib.logger
+
+    args = docopt.docopt(__doc__)
+
+    in_file = args["-i"]
+    count = int(args["-n"])
+    gamma = float(args["-g"])
+    debug_mode = args["-D"]
+
+    my_lib.logger.init("test", level=logging.DEBUG if debug_mode else logging.INFO)
+
+    img = PIL.Image.open(in_file)
+    logging.info("Benchmark with %s (%dx%d, %d times)", in_file, img.size[0], img.size[1], count)
+
+    result_list = benchmark(img, count, gamma)
+    original = result_list[0]
+    for result in result_list:
+        logging.info(
+            "%-12s: quantize = %6.1f msec, encode = %6.1f msec, size = %10s bytes (%5.1f%%)",
+            result["name"],
+            result["quantize"] * 1000,
+            result["encode"] * 1000,
+            f"{result['size']:,}",
+            result["size"] / original["size"] * 100,
+        )
+
+    logging.info("Finish.")
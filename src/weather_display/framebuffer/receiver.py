@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Raspberry Pi 側で画像を受け取り、フレームバッファに書き込みます。
+
+変化した矩形だけを送る差分画像と、画面全体をグレースケールのまま (4bit の場合は 2 画素を
+1 バイトに詰めて) 送るフレームの 2 種類を受け付けます。
+
+Raspberry Pi に転送して実行するので、標準ライブラリだけで動くようにしています。
+フレームバッファの表示中の解像度と位置は FBIOGET_VSCREENINFO で、1 行のバイト数は sysfs から
+取得しますが、-W / -H / -b を指定するとそれを使います (通常のファイルを擬似的なフレームバッファ
+としてテストする場合に使います)。
+
+Usage:
+  receiver.py [-d DEVICE] [-W WIDTH] [-H HEIGHT] [-b BPP]
+
+Options:
+  -d DEVICE         : 書き込むフレームバッファ。[default: /dev/fb0]
+  -W WIDTH          : フレームバッファの幅。
+  -H HEIGHT         : フレームバッファの高さ。
+  -b BPP            : 1 画素あたりのビット数 (8 / 16 / 24 / 32)。
+"""
+
+import argparse
+import fcntl
+import pathlib
+import struct
+import sys
+import zlib
+
+MAGIC = b"EIDM"
+
+# NOTE: マジック, 画像の幅, 画像の高さ, 矩形の数
+HEADER = struct.Struct(">4sHHH")
+# NOTE: 矩形の x, y, 幅, 高さ。続けて 8bit グレースケールの画素が 幅 x 高さ バイト続く
+RECT = struct.Struct(">HHHH")
+
+FRAME_MAGIC = b"EIRF"
+
+# NOTE: マジック, 画像の幅, 画像の高さ, 1 画素あたりのビット数 (8 / 4), zlib で圧縮しているか。
+# 続けて画素のデータが続く
+FRAME_HEADER = struct.Struct(">4sHHBB")
+
+# NOTE: 4bit の画素を 8bit に戻すテーブル (上位 4bit が左側の画素)
+HIGH_NIBBLE_TABLE = bytes(((b >> 4) * 17) for b in range(256))
+LOW_NIBBLE_TABLE = bytes(((b & 0x0F) * 17) for b in range(256))
+
+FBIOGET_VSCREENINFO = 0x4600
+# NOTE: struct fb_var_screeninfo の大きさと、先頭の xres, yres, xres_virtual, yres_virtual,
+# xoffset, yoffset, bits_per_pixel
+VSCREENINFO_SIZE = 160
+VSCREENINFO = struct.Struct("=7I")
+
+# NOTE: グレースケールを RGB565 (リトルエンディアン) に変換するテーブル
+RGB565_TABLE = [((g >> 3) << 11) | ((g >> 2) << 5) | (g >> 3) for g in range(256)]
+RGB565_LOW_TABLE = bytes((v & 0xFF) for v in RGB565_TABLE)
+RGB565_HIGH_TABLE = bytes((v >> 8) for v in RGB565_TABLE)
+
+
+def convert_line(line, bpp):
+    """8bit グレースケールの画素列をフレームバッファの形式に変換する"""
+    if bpp == 8:
+        return line
+
+    size = len(line)
+    if bpp == 16:
+        out = bytearray(size * 2)
+        out[0::2] = line.translate(RGB565_LOW_TABLE)
+        out[1::2] = line.translate(RGB565_HIGH_TABLE)
+        return out
+    elif bpp in (24, 32):
+        pixel_size = bpp // 8
+        out = bytearray(size * pixel_size)
+        for i in range(3):
+            out[i::pixel_size] = line
+        if bpp == 32:
+            out[3::4] = b"\xff" * size
+        return out
+
+    raise ValueError(f"Unsupported bits per pixel: {bpp}")  # noqa: EM102, TRY003
+
+
+def unpack_4bit(data, size):
+    """2 画素を 1 バイトに詰めたデータを 8bit グレースケールに戻す"""
+    out = bytearray(len(data) * 2)
+    out[0::2] = data.translate(HIGH_NIBBLE_TABLE)
+    out[1::2] = data.translate(LOW_NIBBLE_TABLE)
+
+    return bytes(out[:size])
+
+
+def decode_frame(header, payload):
+    """フレームの画素を 8bit グレースケールで返す"""
+    _, width, height, bits, compress = header
+
+    if compress:
+        payload = zlib.decompress(payload)
+    if bits == 4:
+        payload = unpack_4bit(payload, width * height)
+    elif bits != 8:
+        raise ValueError(f"Unsupported frame bits: {bits}")  # noqa: EM102, TRY003
+
+    if len(payload) != width * height:
+        raise ValueError("Frame size mismatch")  # noqa: EM101, TRY003
+
+    return payload
+
+
+def get_var_screen_info(device):
+    """表示中の画面の幅、高さ、仮想画面の幅、高さ、表示位置 (x, y)、1 画素あたりのビット数を返す"""
+    with open(device, "rb") as fb:  # noqa: PTH123
+        info = fcntl.ioctl(fb, FBIOGET_VSCREENINFO, bytes(VSCREENINFO_SIZE))
+
+    return VSCREENINFO.unpack_from(info)
+
+
+def get_fb_info(device, width=None, height=None, bpp=None):
+    sysfs = pathlib.Path("/sys/class/graphics") / pathlib.Path(device).name
+
+    x_offset = y_offset = 0
+    if (width is None) or (height is None):
+        # NOTE: パンニングやダブルバッファリングを使っている場合、仮想画面 (virtual_size) は
+        # 表示中の画面より大きいので、表示中の解像度と位置を使う
+        width, height, _, _, x_offset, y_offset, screen_bpp = get_var_screen_info(device)
+        if bpp is None:
+            bpp = screen_bpp
+    if bpp is None:
+        bpp = int((sysfs / "bits_per_pixel").read_text())
+
+    stride_file = sysfs / "stride"
+    stride = int(stride_file.read_text()) if stride_file.exists() else width * bpp // 8
+
+    return {
+        "width": width,
+        "height": height,
+        "bpp": bpp,
+        "stride": stride,
+        # NOTE: 表示中の画面の左上の、フレームバッファの先頭からの位置
+        "offset": y_offset * stride + x_offset * bpp // 8,
+    }
+
+
+def read_exact(stream, size):
+    buf = b""
+    while len(buf) < size:
+        chunk = stream.read(size - len(buf))
+        if not chunk:
+            raise EOFError("Unexpected end of stream")  # noqa: EM101, TRY003
+        buf += chunk
+    return buf
+
+
+def check_size(width, height, fb_info):
+    if (width, height) != (fb_info["width"], fb_info["height"]):
+        raise ValueError(  # noqa: TRY003
+            f"Frame size mismatch: {width}x{height} != {fb_info['width']}x{fb_info['height']}"  # noqa: EM102
+        )
+
+
+def write_rect(fb, fb_info, x, y, w, h, pixel):  # noqa: PLR0913
+    pixel_size = fb_info["bpp"] // 8
+
+    if (x == 0) and (w == fb_info["width"]) and (fb_info["stride"] == w * pixel_size):
+        # NOTE: 行の間に隙間が無ければまとめて書き込む
+        fb.seek(fb_info["offset"] + y * fb_info["stride"])
+        fb.write(convert_line(pixel, fb_info["bpp"]))
+        return
+
+    for row in range(h):
+        fb.seek(fb_info["offset"] + (y + row) * fb_info["stride"] + x * pixel_size)
+        fb.write(convert_line(pixel[row * w : (row + 1) * w], fb_info["bpp"]))
+
+
+def apply_damage(stream, fb, fb_info, magic):
+    _, width, height, count = HEADER.unpack(magic + read_exact(stream, HEADER.size - len(magic)))
+    check_size(width, height, fb_info)
+
+    for _ in range(count):
+        x, y, w, h = RECT.unpack(read_exact(stream, RECT.size))
+        if (x + w > width) or (y + h > height):
+            raise ValueError("Rectangle out of range")  # noqa: EM101, TRY003
+
+        write_rect(fb, fb_info, x, y, w, h, read_exact(stream, w * h))
+
+    return count
+
+
+def apply_frame(stream, fb, fb_info, magic):
+    header = FRAME_HEADER.unpack(magic + read_exact(stream, FRAME_HEADER.size - len(magic)))
+    _, width, height, _, _ = header
+    check_size(width, height, fb_info)
+
+    write_rect(fb, fb_info, 0, 0, width, height, decode_frame(header, stream.read()))
+
+    return 1
+
+
+def apply(stream, fb, fb_info):
+    """ストリームから画像を読み込んでフレームバッファに書き込み、書き込んだ矩形の数を返す"""
+    magic = read_exact(stream, len(MAGIC))
+
+    if magic == MAGIC:
+        count = apply_damage(stream, fb, fb_info, magic)
+    elif magic == FRAME_MAGIC:
+        count = apply_frame(stream, fb, fb_info, magic)
+    else:
+        raise ValueError("Invalid stream")  # noqa: EM101, TRY003
+
+    fb.flush()
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write received frames into the framebuffer.")
+    parser.add_argument("-d", dest="device", default="/dev/fb0")
+    parser.add_argument("-W", dest="width", type=int)
+    parser.add_argument("-H", dest="height", type=int)
+    parser.add_argument("-b", dest="bpp", type=int)
+    args = parser.parse_args()
+
+    fb_info = get_fb_info(args.device, args.width, args.height, args.bpp)
+
+    with open(args.device, "r+b", buffering=0) as fb:  # noqa: PTH123
+        count = apply(sys.stdin.buffer, fb, fb_info)
+
+    sys.stdout.write(f"{count} rects\n")
+
+
+if __name__ == "__main__":
+    main()
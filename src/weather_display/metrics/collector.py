@@ -64,6 +64,16 @@ class MetricsCollector:
                     elapsed_time REAL NOT NULL,
                     has_error BOOLEAN DEFAULT FALSE,
                     error_message TEXT,
+                    is_stale BOOLEAN DEFAULT FALSE,
+                    cache_hit INTEGER DEFAULT 0,
+                    cache_miss INTEGER DEFAULT 0,
+                    query_hit INTEGER DEFAULT 0,
+                    query_miss INTEGER DEFAULT 0,
+                    query_saved_time REAL DEFAULT 0,
+                    upsample_load_time REAL DEFAULT 0,
+                    upsample_count INTEGER DEFAULT 0,
+                    upsample_time REAL DEFAULT 0,
+                    icon_prepare_time REAL DEFAULT 0,
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (draw_panel_id) REFERENCES draw_panel_metrics (id)
                 )
@@ -85,10 +95,44 @@ class MetricsCollector:
                     error_message TEXT,
                     sleep_time REAL,
                     diff_sec INTEGER,
+                    render_time REAL,
+                    sent_bytes INTEGER,
+                    connect_time REAL,
+                    ttfb REAL,
+                    transfer_time REAL,
                     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             """)
 
+            # NOTE: 既存のデータベースには後から追加したカラムが無いので追加する
+            self._add_missing_columns(
+                cursor,
+                "panel_metrics",
+                {
+                    "is_stale": "BOOLEAN DEFAULT FALSE",
+                    "cache_hit": "INTEGER DEFAULT 0",
+                    "cache_miss": "INTEGER DEFAULT 0",
+                    "query_hit": "INTEGER DEFAULT 0",
+                    "query_miss": "INTEGER DEFAULT 0",
+                    "query_saved_time": "REAL DEFAULT 0",
+                    "upsample_load_time": "REAL DEFAULT 0",
+                    "upsample_count": "INTEGER DEFAULT 0",
+                    "upsample_time": "REAL DEFAULT 0",
+                    "icon_prepare_time": "REAL DEFAULT 0",
+                },
+            )
+            self._add_missing_columns(
+                cursor,
+                "display_image_metrics",
+                {
+                    "render_time": "REAL",
+                    "sent_bytes": "INTEGER",
+                    "connect_time": "REAL",
+                    "ttfb": "REAL",
+                    "transfer_time": "REAL",
+                },
+            )
+
             # Create indexes for better query performance
             cursor.execute(
                 "CREATE INDEX IF NOT EXISTS idx_draw_panel_timestamp ON draw_panel_metrics (timestamp)"
@@ -103,6 +147,16 @@ class MetricsCollector:
 
             conn.commit()
 
+    def _add_missing_columns(self, cursor, table: str, columns: dict[str, str]):
+        """Add columns which do not exist in the table yet."""
+        cursor.execute(f"PRAGMA table_info({table})")
+        exist_columns = {row["name"] for row in cursor.fetchall()}
+
+        for name, column_type in columns.items():
+            if name not in exist_columns:
+                logging.info("Add column %s to %s", name, table)
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
     @contextmanager
     def _get_connection(self):
         """Get database connection with proper error handling."""
@@ -135,7 +189,10 @@ class MetricsCollector:
 
         Args:
             total_elapsed_time: Total time taken for draw_panel operation
-            panel_metrics: List of dicts with panel metrics (name, elapsed_time, has_error, error_message)
+            panel_metrics: List of dicts with panel metrics
+                (name, elapsed_time, has_error, error_message, is_stale, cache_hit, cache_miss,
+                 query_hit, query_miss, query_saved_time, upsample_load_time, upsample_count,
+                 upsample_time, icon_prepare_time)
             is_small_mode: Whether small mode was used
             is_test_mode: Whether test mode was used
             is_dummy_mode: Whether dummy mode was used
@@ -185,8 +242,10 @@ class MetricsCollector:
                     cursor.execute(
                         """
                         INSERT INTO panel_metrics
-                        (draw_panel_id, panel_name, elapsed_time, has_error, error_message)
-                        VALUES (?, ?, ?, ?, ?)
+                        (draw_panel_id, panel_name, elapsed_time, has_error, error_message, is_stale,
+                         cache_hit, cache_miss, query_hit, query_miss, query_saved_time,
+                         upsample_load_time, upsample_count, upsample_time, icon_prepare_time)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                     """,
                         (
                             draw_panel_id,
@@ -194,6 +253,16 @@ class MetricsCollector:
                             panel["elapsed_time"],
                             panel.get("has_error", False),
                             panel.get("error_message"),
+                            panel.get("is_stale", False),
+                            panel.get("cache_hit", 0),
+                            panel.get("cache_miss", 0),
+                            panel.get("query_hit", 0),
+                            panel.get("query_miss", 0),
+                            panel.get("query_saved_time", 0.0),
+                            panel.get("upsample_load_time", 0.0),
+                            panel.get("upsample_count", 0),
+                            panel.get("upsample_time", 0.0),
+                            panel.get("icon_prepare_time", 0.0),
                         ),
                     )
 
@@ -219,6 +288,11 @@ class MetricsCollector:
         timestamp: datetime.datetime | None = None,
         sleep_time: float | None = None,
         diff_sec: int | None = None,
+        render_time: float | None = None,
+        sent_bytes: int | None = None,
+        connect_time: float | None = None,
+        ttfb: float | None = None,
+        transfer_time: float | None = None,
     ) -> int:
         """
         Log display_image operation metrics.
@@ -234,6 +308,11 @@ class MetricsCollector:
             timestamp: When the operation occurred (default: now)
             sleep_time: Sleep time after operation
             diff_sec: Timing difference in seconds
+            render_time: Latency of the image render request
+            sent_bytes: Bytes sent to the Raspberry Pi for the frame
+            connect_time: Time taken to get a usable SSH connection
+            ttfb: Time from the start of the frame to the first byte sent to the Raspberry Pi
+            transfer_time: Time from the first byte sent to the end of the transfer
 
         Returns:
             ID of the inserted record
@@ -253,8 +332,9 @@ class MetricsCollector:
                     """
                     INSERT INTO display_image_metrics
                     (timestamp, hour, day_of_week, elapsed_time, is_small_mode, is_test_mode,
-                     is_one_time, rasp_hostname, success, error_message, sleep_time, diff_sec)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                     is_one_time, rasp_hostname, success, error_message, sleep_time, diff_sec,
+                     render_time, sent_bytes, connect_time, ttfb, transfer_time)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                     (
                         timestamp,
@@ -269,6 +349,11 @@ class MetricsCollector:
                         error_message,
                         sleep_time,
                         diff_sec,
+                        render_time,
+                        sent_bytes,
+                        connect_time,
+                        ttfb,
+                        transfer_time,
                     ),
                 )
 
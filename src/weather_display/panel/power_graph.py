@@ -33,6 +33,9 @@ import my_lib.panel_util
 import pandas.plotting
 from my_lib.sensor_data import fetch_data
 
+import weather_display.render.bitmap_cache
+import weather_display.render.downsample
+
 pandas.plotting.register_matplotlib_converters()
 
 IMAGE_DPI = 100.0
@@ -176,12 +179,6 @@ def create_power_graph_impl(panel_config, font_config, db_config):
     width = panel_config["panel"]["width"]
     height = panel_config["panel"]["height"]
 
-    matplotlib.pyplot.style.use("grayscale")
-
-    fig = matplotlib.pyplot.figure(facecolor="azure", edgecolor="coral", linewidth=2)
-
-    fig.set_size_inches(width / IMAGE_DPI, height / IMAGE_DPI)
-
     if os.environ.get("DUMMY_MODE", "false") == "true":
         period_start = "-228h"
         period_stop = "-168h"
@@ -199,13 +196,18 @@ def create_power_graph_impl(panel_config, font_config, db_config):
         period_stop,
     )
 
-    data = fetch_data(
+    data = weather_display.render.downsample.fetch(
+        fetch_data,
         db_config,
-        panel_config["data"]["sensor"]["measure"],
-        panel_config["data"]["sensor"]["hostname"],
-        panel_config["data"]["param"]["field"],
-        period_start,
-        period_stop,
+        {
+            "measure": panel_config["data"]["sensor"]["measure"],
+            "hostname": panel_config["data"]["sensor"]["hostname"],
+            "field": panel_config["data"]["param"]["field"],
+            "start": period_start,
+            "stop": period_stop,
+        },
+        width,
+        panel_config.get("downsample"),
     )
 
     # デバッグログ: fetch_data結果
@@ -224,6 +226,18 @@ def create_power_graph_impl(panel_config, font_config, db_config):
         if not data.get("value", []):
             logging.warning("value data is empty")
 
+    # NOTE: データが前回と同じであれば、描画せずに前回の画像を返す
+    cache_key = weather_display.render.bitmap_cache.make_key(panel_config, font_config, data)
+    img = weather_display.render.bitmap_cache.get("power", cache_key)
+    if img is not None:
+        return img
+
+    matplotlib.pyplot.style.use("grayscale")
+
+    fig = matplotlib.pyplot.figure(facecolor="azure", edgecolor="coral", linewidth=2)
+
+    fig.set_size_inches(width / IMAGE_DPI, height / IMAGE_DPI)
+
     ax = fig.add_subplot()
     plot_item(
         ax,
@@ -249,7 +263,7 @@ def create_power_graph_impl(panel_config, font_config, db_config):
     matplotlib.pyplot.clf()
     matplotlib.pyplot.close(fig)
 
-    return img
+    return weather_display.render.bitmap_cache.put("power", cache_key, img)
 
 
 def create(config):
@@ -33,6 +33,8 @@ import selenium.webdriver.support
 import selenium.webdriver.support.wait
 from my_lib.selenium_util import click_xpath  # NOTE: テスト時に mock する
 
+import weather_display.render.text_metrics
+
 DATA_PATH = pathlib.Path("data")
 WINDOW_SIZE_CACHE_FILE = DATA_PATH / "window_size_cache.dat"
 
@@ -356,7 +358,7 @@ def draw_equidistant_circle(img):
 
 def draw_caption(img, title, face_map):
     logging.info("draw caption")
-    caption_size = my_lib.pil_util.text_size(img, face_map["title"], title)
+    caption_size = weather_display.render.text_metrics.text_size(img, face_map["title"], title)
     caption_size = (caption_size[0] + 5, caption_size[1])  # NOTE: 横方向を少し広げる
 
     # 定数を事前定義
@@ -476,10 +478,12 @@ def draw_legend(img, bar, panel_config, face_map):
             outline=(20, 20, 20),
         )
 
-    text_height = int(my_lib.pil_util.text_size(img, face_map["legend"], "0")[1])
+    text_height = int(weather_display.render.text_metrics.text_size(img, face_map["legend"], "0")[1])
     unit = "mm/h"
-    unit_width, unit_height = my_lib.pil_util.text_size(img, face_map["legend_unit"], unit)
-    unit_overlap = my_lib.pil_util.text_size(img, face_map["legend_unit"], unit[0])[0]
+    unit_width, unit_height = weather_display.render.text_metrics.text_size(
+        img, face_map["legend_unit"], unit
+    )
+    unit_overlap = weather_display.render.text_metrics.text_size(img, face_map["legend_unit"], unit[0])[0]
     legend = PIL.Image.new(
         "RGBA",
         (
@@ -506,7 +510,12 @@ def draw_legend(img, bar, panel_config, face_map):
         else:
             text = "mm/h"
             pos_x = PADDING + bar_size * (i + 1) - unit_overlap
-            pos_y = PADDING - 5 + my_lib.pil_util.text_size(img, face_map["legend"], "0")[1] - unit_height
+            pos_y = (
+                PADDING
+                - 5
+                + weather_display.render.text_metrics.text_size(img, face_map["legend"], "0")[1]
+                - unit_height
+            )
             align = "left"
             font = face_map["legend_unit"]
 
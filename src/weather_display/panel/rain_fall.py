@@ -11,9 +11,12 @@ Options:
   -D                : デバッグモードで動作します。
 """
 
+import asyncio
 import datetime
 import logging
 import pathlib
+import pickle
+import tempfile
 import time
 import traceback
 
@@ -25,32 +28,114 @@ import PIL.Image
 import PIL.ImageDraw
 import pytz
 
+import weather_display.render.query_cache
+import weather_display.render.text_metrics
+import weather_display.render.text_sprite
+
 DATA_PATH = pathlib.Path("data")
 WINDOW_SIZE_CACHE = DATA_PATH / "window_size.cache"
+# NOTE: パネルは複数のワーカーで描画されるので、降り始めの時刻はファイルで共有する
+RAINING_START_CACHE_FILE = DATA_PATH / "raining_start_cache.dat"
+# NOTE: 更新間隔に対するこの倍率の時間、雨の状態を見ていなければ、降り始めの時刻を問い合わせ直す
+RAINING_START_EXPIRE_RATIO = 1.5
 CACHE_EXPIRE_HOUR = 1
 
 CLOUD_IMAGE_XPATH = '//div[contains(@id, "jmatile_map_")]'
 
 
 def get_face_map(font_config):
+    # NOTE: 縁取り付きで描画するので、作成したマスクを使い回す
+    get_font = weather_display.render.text_sprite.get_font
+
     return {
-        "value": my_lib.pil_util.get_font(font_config, "en_bold", 80),
-        "unit": my_lib.pil_util.get_font(font_config, "en_bold", 30),
-        "start": my_lib.pil_util.get_font(font_config, "jp_medium", 40),
+        "value": get_font(my_lib.pil_util.get_font(font_config, "en_bold", 80)),
+        "unit": get_font(my_lib.pil_util.get_font(font_config, "en_bold", 30)),
+        "start": get_font(my_lib.pil_util.get_font(font_config, "jp_medium", 40)),
     }
 
 
-def get_rainfall_status(panel_config, db_config):
+def load_raining_start_cache():
+    """降り始めの時刻のキャッシュを読み込む"""
+    try:
+        if RAINING_START_CACHE_FILE.exists():
+            with RAINING_START_CACHE_FILE.open("rb") as f:
+                return pickle.load(f)  # noqa: S301
+    except Exception:
+        logging.warning("Failed to load raining start cache")
+    return {}
+
+
+def save_raining_start_cache(cache):
+    """降り始めの時刻のキャッシュを保存する"""
+    try:
+        RAINING_START_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        # NOTE: 他のワーカーが読み出し中でも壊れたファイルが見えないよう、書き終えてから置き換える
+        with tempfile.NamedTemporaryFile(dir=RAINING_START_CACHE_FILE.parent, delete=False) as f:
+            pickle.dump(cache, f)
+        pathlib.Path(f.name).replace(RAINING_START_CACHE_FILE)
+    except Exception:
+        logging.warning("Failed to save raining start cache")
+
+
+def get_raining_start(db_config, sensor_config, raining_status, update_interval):
+    key = (sensor_config["measure"], sensor_config["hostname"])
+    cache = load_raining_start_cache()
+    now = time.time()
+
+    if not raining_status:
+        # NOTE: どのワーカーが雨の止んだことを見ても、次に降り出した時は問い合わせ直すようにする
+        if key in cache:
+            del cache[key]
+            save_raining_start_cache(cache)
+        return None
+
+    # NOTE: 雨が降り続いている間は、降り始めの時刻を問い合わせ直さない。ただし、しばらく雨の状態を
+    # 見ていなかった場合は、その間に止んで降り直したかもしれないので問い合わせ直す
+    entry = cache.get(key)
+    if (not isinstance(entry, dict)) or (now - entry["seen"] > update_interval * RAINING_START_EXPIRE_RATIO):
+        raining_start = my_lib.sensor_data.get_last_event(
+            db_config, sensor_config["measure"], sensor_config["hostname"], "raining"
+        )
+        if raining_start is None:
+            return None
+        entry = {"start": raining_start}
+
+    entry["seen"] = now
+    cache[key] = entry
+    save_raining_start_cache(cache)
+
+    return entry["start"]
+
+
+def get_rainfall_status(panel_config, db_config, update_interval):
     START = "-3m"
 
-    data = my_lib.sensor_data.fetch_data(
-        db_config,
-        panel_config["sensor"]["measure"],
-        panel_config["sensor"]["hostname"],
-        "rain",
-        start=START,
-        window_min=1,
+    # NOTE: 降水量と降雨状態は互いに依存しないので、並列に問い合わせる
+    start = time.perf_counter()
+    data, raining_data = asyncio.run(
+        weather_display.render.query_cache.fetch_parallel(
+            my_lib.sensor_data.fetch_data_parallel,
+            db_config,
+            [
+                {
+                    "measure": panel_config["sensor"]["measure"],
+                    "hostname": panel_config["sensor"]["hostname"],
+                    "field": "rain",
+                    "start": START,
+                    "window_min": 1,
+                },
+                {
+                    "measure": panel_config["sensor"]["measure"],
+                    "hostname": panel_config["sensor"]["hostname"],
+                    "field": "raining",
+                    "start": START,
+                    "window_min": 0,
+                    "last": True,
+                },
+            ],
+        )
     )
+    logging.info("Fetched rainfall status in %.2f sec", time.perf_counter() - start)
 
     if not data["valid"]:
         return None
@@ -61,30 +146,13 @@ def get_rainfall_status(panel_config, db_config):
     # NOTE: 1分あたりの降水量なので、時間あたりに直す
     amount *= 60
 
-    data = my_lib.sensor_data.fetch_data(
-        db_config,
-        panel_config["sensor"]["measure"],
-        panel_config["sensor"]["hostname"],
-        "raining",
-        start=START,
-        window_min=0,
-        last=True,
-    )
-
-    raining_status = data["value"][0]
-
-    if raining_status:
-        raining_start = my_lib.sensor_data.get_last_event(
-            db_config, panel_config["sensor"]["measure"], panel_config["sensor"]["hostname"], "raining"
-        )
-    else:
-        raining_start = None
+    raining_status = raining_data["value"][0]
 
     return {
         "amount": amount,
         "raining": {
             "status": raining_status,
-            "start": raining_start,
+            "start": get_raining_start(db_config, panel_config["sensor"], raining_status, update_interval),
         },
     }
 
@@ -132,32 +200,42 @@ def draw_rainfall(img, rainfall_status, icon_config, face_map):
     amount_text = gen_amount_text(rainfall_status["amount"])
     start_text = gen_start_text(rainfall_status["raining"]["start"])
 
-    line_height = my_lib.pil_util.text_size(img, face_map["value"], "0")[1]
+    line_height = weather_display.render.text_metrics.text_size(img, face_map["value"], "0")[1]
 
     pos_y = pos_y + icon.size[1] + 10
 
     next_pos_x = my_lib.pil_util.draw_text(
         img,
         amount_text,
-        (pos_x, pos_y + line_height - my_lib.pil_util.text_size(img, face_map["value"], "0")[1]),
+        (
+            pos_x,
+            pos_y
+            + line_height
+            - weather_display.render.text_metrics.text_size(img, face_map["value"], "0")[1],
+        ),
         face_map["value"],
         "left",
         "#333",
         stroke_width=10,
         stroke_fill=(255, 255, 255, 200),
     )[0]
-    next_pos_x += my_lib.pil_util.text_size(img, face_map["unit"], " ")[0]
+    next_pos_x += weather_display.render.text_metrics.text_size(img, face_map["unit"], " ")[0]
     next_pos_x = my_lib.pil_util.draw_text(
         img,
         "mm/h",
-        (next_pos_x, pos_y + line_height - my_lib.pil_util.text_size(img, face_map["unit"], "h")[1]),
+        (
+            next_pos_x,
+            pos_y
+            + line_height
+            - weather_display.render.text_metrics.text_size(img, face_map["unit"], "h")[1],
+        ),
         face_map["unit"],
         "left",
         "#333",
         stroke_width=10,
         stroke_fill=(255, 255, 255, 200),
     )[0]
-    next_pos_x += my_lib.pil_util.text_size(img, face_map["start"], " ")[0]
+    next_pos_x += weather_display.render.text_metrics.text_size(img, face_map["start"], " ")[0]
 
     pos_y = int(pos_y + line_height * 1.2)
     next_pos_x = my_lib.pil_util.draw_text(
@@ -174,7 +252,7 @@ def draw_rainfall(img, rainfall_status, icon_config, face_map):
     return img
 
 
-def create_rain_fall_panel_impl(panel_config, font_config, db_config):
+def create_rain_fall_panel_impl(panel_config, font_config, db_config, update_interval):
     face_map = get_face_map(font_config)
 
     img = PIL.Image.new(
@@ -183,7 +261,7 @@ def create_rain_fall_panel_impl(panel_config, font_config, db_config):
         (255, 255, 255, 0),
     )
 
-    status = get_rainfall_status(panel_config, db_config)
+    status = get_rainfall_status(panel_config, db_config, update_interval)
 
     if status is None:
         logging.warning("Unable to fetch rainfall status")
@@ -202,10 +280,11 @@ def create(config):
     panel_config = config["rain_fall"]
     font_config = config["font"]
     db_config = config["influxdb"]
+    update_interval = config["panel"]["update"]["interval"]
 
     try:
         return (
-            create_rain_fall_panel_impl(panel_config, font_config, db_config),
+            create_rain_fall_panel_impl(panel_config, font_config, db_config, update_interval),
             time.perf_counter() - start,
         )
     except Exception:
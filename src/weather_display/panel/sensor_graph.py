@@ -31,6 +31,11 @@ import pandas.plotting
 import PIL.Image
 from my_lib.sensor_data import fetch_data, fetch_data_parallel
 
+import weather_display.render.batch_query
+import weather_display.render.bitmap_cache
+import weather_display.render.downsample
+import weather_display.render.series_buffer
+
 matplotlib.use("Agg")
 
 pandas.plotting.register_matplotlib_converters()
@@ -183,6 +188,37 @@ def plot_item(ax, title, unit, data, xbegin_numeric, ylim, fmt, scale, small, fa
     ax.label_outer()
 
 
+def get_sensor_requests(panel_config):
+    """センサーデータ取得用のリクエストリストを生成"""
+    fetch_requests = []
+    request_map = {}  # (param_name, col, measure, hostname) -> request_index のマッピング
+
+    if os.environ.get("DUMMY_MODE", "false") == "true":
+        period_start = "-228h"
+        period_stop = "-168h"
+    else:
+        period_start = "-60h"
+        period_stop = "now()"
+
+    for param in panel_config["param_list"]:
+        for col, room in enumerate(panel_config["room_list"]):
+            for host_specify in room["sensor"]:
+                request_map[(param["name"], col, host_specify["measure"], host_specify["hostname"])] = len(
+                    fetch_requests
+                )
+                fetch_requests.append(
+                    {
+                        "measure": host_specify["measure"],
+                        "hostname": host_specify["hostname"],
+                        "field": param["name"],
+                        "start": period_start,
+                        "stop": period_stop,
+                    }
+                )
+
+    return fetch_requests, request_map
+
+
 def get_aircon_power_requests(room_list):
     """エアコン電力取得用のリクエストリストを生成"""
     aircon_requests = []
@@ -246,13 +282,18 @@ def draw_aircon_icon(ax, power, icon_config):
     ax.add_artist(ab)
 
 
+def is_daytime():
+    now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=+9), "JST"))
+
+    return (now.hour > 7) and (now.hour < 17)
+
+
 def draw_light_icon(ax, lux_list, icon_config):
     # NOTE: 下記の next の記法だとカバレッジが正しく取れない
     lux = next((item for item in reversed(lux_list) if item is not None), None)  # pragma: no cover
 
-    now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=+9), "JST"))
     # NOTE: 昼間はアイコンを描画しない
-    if (now.hour > 7) and (now.hour < 17):
+    if is_daytime():
         return
 
     if lux == EMPTY_VALUE:
@@ -286,13 +327,16 @@ def sensor_data(db_config, host_specify_list, param):
         period_stop = "now()"
 
     for host_specify in host_specify_list:
-        data = fetch_data(
+        data = weather_display.render.series_buffer.fetch(
+            fetch_data,
             db_config,
-            host_specify["measure"],
-            host_specify["hostname"],
-            param,
-            period_start,
-            period_stop,
+            {
+                "measure": host_specify["measure"],
+                "hostname": host_specify["hostname"],
+                "field": param,
+                "start": period_start,
+                "stop": period_stop,
+            },
         )
         if data["valid"]:
             return data
@@ -306,12 +350,6 @@ def create_sensor_graph_impl(panel_config, font_config, db_config):  # noqa: C90
     width = panel_config["panel"]["width"]
     height = panel_config["panel"]["height"]
 
-    matplotlib.pyplot.style.use("grayscale")
-
-    fig = matplotlib.pyplot.figure(facecolor="azure", edgecolor="coral", linewidth=2)
-
-    fig.set_size_inches(width / IMAGE_DPI, height / IMAGE_DPI)
-
     # NOTE: 全データを並列で一度に取得してキャッシュ（最適化）
     data_cache = {}
     cache = {
@@ -323,35 +361,11 @@ def create_sensor_graph_impl(panel_config, font_config, db_config):  # noqa: C90
     range_map = {}
     time_begin = datetime.datetime.now(datetime.timezone.utc)
 
-    # 並列取得用のリクエストリストを準備
-    fetch_requests = []
-    request_map = {}  # (param_name, col) -> request_index のマッピング
-
     for param in panel_config["param_list"]:
         data_cache[param["name"]] = {}
-        for col in range(len(room_list)):
-            for host_specify in room_list[col]["sensor"]:
-                request_index = len(fetch_requests)
-                request_map[(param["name"], col, host_specify["measure"], host_specify["hostname"])] = (
-                    request_index
-                )
 
-                if os.environ.get("DUMMY_MODE", "false") == "true":
-                    period_start = "-228h"
-                    period_stop = "-168h"
-                else:
-                    period_start = "-60h"
-                    period_stop = "now()"
-
-                fetch_requests.append(
-                    {
-                        "measure": host_specify["measure"],
-                        "hostname": host_specify["hostname"],
-                        "field": param["name"],
-                        "start": period_start,
-                        "stop": period_stop,
-                    }
-                )
+    # 並列取得用のリクエストリストを準備
+    fetch_requests, request_map = get_sensor_requests(panel_config)
 
     # エアコン電力取得用のリクエストも追加
     aircon_requests, aircon_map = get_aircon_power_requests(room_list)
@@ -363,11 +377,39 @@ def create_sensor_graph_impl(panel_config, font_config, db_config):  # noqa: C90
     logging.info(
         "Fetching sensor data in parallel (%d requests, %d aircon)", len(fetch_requests), len(aircon_requests)
     )
+    # NOTE: batch_query が有効な場合は、ホストごとに全フィールドを 1 回の問い合わせで取得する
+    if panel_config.get("batch_query", False):
+        fetch_func = weather_display.render.batch_query.fetch_data_batch
+    else:
+        fetch_func = fetch_data_parallel
+
     parallel_start = time.perf_counter()
-    all_results = asyncio.run(fetch_data_parallel(db_config, all_requests))
+    # NOTE: グラフの列の幅に合わせて間引く (エアコンの最新値は間引かない)
+    col_width = width // len(room_list)
+    width_list = [col_width] * len(fetch_requests) + [None] * len(aircon_requests)
+    all_results = asyncio.run(
+        weather_display.render.downsample.fetch_parallel(
+            fetch_func, db_config, all_requests, width_list, panel_config.get("downsample")
+        )
+    )
     parallel_time = time.perf_counter() - parallel_start
     logging.info("Parallel fetch completed in %.2f seconds", parallel_time)
 
+    # NOTE: データが前回と同じであれば、描画せずに前回の画像を返す。照明のアイコンは昼夜で
+    # 描画するかが変わる (draw_light_icon) のでキーに含める
+    cache_key = weather_display.render.bitmap_cache.make_key(
+        panel_config, font_config, is_daytime(), all_results
+    )
+    img = weather_display.render.bitmap_cache.get("sensor", cache_key)
+    if img is not None:
+        return img
+
+    matplotlib.pyplot.style.use("grayscale")
+
+    fig = matplotlib.pyplot.figure(facecolor="azure", edgecolor="coral", linewidth=2)
+
+    fig.set_size_inches(width / IMAGE_DPI, height / IMAGE_DPI)
+
     # センサーデータとエアコンデータを分離
     results = all_results[: len(fetch_requests)]
     aircon_results = all_results[aircon_results_offset:] if aircon_requests else []
@@ -516,7 +558,7 @@ def create_sensor_graph_impl(panel_config, font_config, db_config):  # noqa: C90
     matplotlib.pyplot.clf()
     matplotlib.pyplot.close(fig)
 
-    return img
+    return weather_display.render.bitmap_cache.put("sensor", cache_key, img)
 
 
 def create(config):
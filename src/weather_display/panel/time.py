@@ -21,22 +21,36 @@ import PIL.ImageDraw
 import PIL.ImageEnhance
 import PIL.ImageFont
 
+import weather_display.render.text_metrics
+import weather_display.render.text_sprite
+
 
 def get_face_map(font_config):
+    # NOTE: 縁取り付きの大きな数字を毎分描画するので、文字ごとのマスクを使い回す
     return {
         "time": {
-            "value": my_lib.pil_util.get_font(font_config, "en_bold", 130),
+            "value": weather_display.render.text_sprite.get_font(
+                my_lib.pil_util.get_font(font_config, "en_bold", 130)
+            ),
         },
     }
 
 
-def draw_time(img, pos_x, pos_y, face):
-    time_text = (
-        datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9), "JST"))
-        + datetime.timedelta(minutes=1)
-    ).strftime("%H:%M")
+def get_display_datetime(display_time=None):
+    """表示される時刻を返す"""
+    timezone = datetime.timezone(datetime.timedelta(hours=9), "JST")
+
+    if display_time is not None:
+        return datetime.datetime.fromtimestamp(display_time, timezone)
+
+    # NOTE: 表示される時刻が分からない場合は、次の分の頭に表示されるものとする
+    return datetime.datetime.now(timezone) + datetime.timedelta(minutes=1)
+
+
+def draw_time(img, pos_x, pos_y, face, display_time=None):
+    time_text = get_display_datetime(display_time).strftime("%H:%M")
 
-    pos_y -= my_lib.pil_util.text_size(img, face["value"], time_text)[1]
+    pos_y -= weather_display.render.text_metrics.text_size(img, face["value"], time_text)[1]
     pos_x += 10
 
     my_lib.pil_util.draw_text(
@@ -51,7 +65,7 @@ def draw_time(img, pos_x, pos_y, face):
     )
 
 
-def draw_panel_time(img, config):
+def draw_panel_time(img, config, display_time=None):
     panel_config = config["time"]
     font_config = config["font"]
 
@@ -63,10 +77,12 @@ def draw_panel_time(img, config):
         panel_config["panel"]["width"] - 10,
         panel_config["panel"]["height"] - 10,
         face_map["time"],
+        display_time,
     )
 
 
-def create(config):
+def create(config, display_time=None):
+    """時刻の画像を生成する (display_time は表示される時刻の UNIX 時間)"""
     logging.info("draw time panel")
     start = time.perf_counter()
 
@@ -76,7 +92,7 @@ def create(config):
         (255, 255, 255, 0),
     )
 
-    draw_panel_time(img, config)
+    draw_panel_time(img, config, display_time)
 
     return (img, time.perf_counter() - start)
 
@@ -22,12 +22,21 @@ import PIL.ImageEnhance
 import PIL.ImageFont
 from my_lib.weather import get_wbgt
 
+import weather_display.render.bitmap_cache
+import weather_display.render.frame_context
+import weather_display.render.http_session
+import weather_display.render.source_cache
+import weather_display.render.text_sprite
+
 
 def get_face_map(font_config):
+    # NOTE: 縁取り付きで描画するので、作成したマスクを使い回す
+    get_font = weather_display.render.text_sprite.get_font
+
     return {
-        "wbgt": my_lib.pil_util.get_font(font_config, "en_bold", 80),
+        "wbgt": get_font(my_lib.pil_util.get_font(font_config, "en_bold", 80)),
         "wbgt_symbol": my_lib.pil_util.get_font(font_config, "jp_bold", 120),
-        "wbgt_title": my_lib.pil_util.get_font(font_config, "jp_medium", 30),
+        "wbgt_title": get_font(my_lib.pil_util.get_font(font_config, "jp_medium", 30)),
     }
 
 
@@ -85,6 +94,24 @@ def draw_wbgt(img, wbgt, panel_config, icon_config, face_map):
 
 
 def create_wbgt_panel_impl(panel_config, font_config, slack_config, is_side_by_side, trial, opt_config=None):  # noqa: PLR0913, ARG001
+    opt_config = {} if opt_config is None else opt_config
+    # NOTE: draw_panel が取得済みの値 (context) があれば、それを使う
+    wbgt = weather_display.render.frame_context.get(
+        opt_config.get("context"),
+        "wbgt",
+        weather_display.render.source_cache.get,
+        opt_config.get("source_cache"),
+        "wbgt",
+        get_wbgt,
+        panel_config,
+    )["current"]
+
+    # NOTE: 暑さ指数が前回と同じであれば、描画せずに前回の画像を返す
+    cache_key = weather_display.render.bitmap_cache.make_key(panel_config, font_config, wbgt)
+    img = weather_display.render.bitmap_cache.get("wbgt", cache_key)
+    if img is not None:
+        return img
+
     face_map = get_face_map(font_config)
 
     img = PIL.Image.new(
@@ -93,22 +120,26 @@ def create_wbgt_panel_impl(panel_config, font_config, slack_config, is_side_by_s
         (255, 255, 255, 0),
     )
 
-    wbgt = get_wbgt(panel_config)["current"]
+    if wbgt is not None:
+        draw_wbgt(img, wbgt, panel_config, panel_config["icon"], face_map)
 
-    if wbgt is None:
-        return img
+    return weather_display.render.bitmap_cache.put("wbgt", cache_key, img)
 
-    draw_wbgt(img, wbgt, panel_config, panel_config["icon"], face_map)
 
-    return img
-
-
-def create(config, is_side_by_side=True):
+def create(config, is_side_by_side=True, context=None):
     logging.info("draw WBGT panel")
 
-    return my_lib.panel_util.draw_panel_patiently(
-        create_wbgt_panel_impl, config["wbgt"], config["font"], None, is_side_by_side, error_image=False
-    )
+    # NOTE: 暑さ指数のページの取得で、接続を使い回し、変更が無ければ 304 で済ませる
+    with weather_display.render.http_session.session():
+        return my_lib.panel_util.draw_panel_patiently(
+            create_wbgt_panel_impl,
+            config["wbgt"],
+            config["font"],
+            None,
+            is_side_by_side,
+            {"source_cache": config.get("source_cache"), "context": context},
+            error_image=False,
+        )
 
 
 if __name__ == "__main__":
@@ -13,10 +13,12 @@ Options:
 
 import concurrent.futures
 import datetime
+import hashlib
 import locale
 import logging
 import math
 import pathlib
+import time
 import urllib
 import urllib.parse
 import zoneinfo
@@ -32,8 +34,28 @@ import PIL.ImageEnhance
 import PIL.ImageFont
 from my_lib.weather import get_clothing_yahoo, get_wbgt, get_weather_yahoo
 
+import weather_display.render.bitmap_cache
+import weather_display.render.frame_context
+import weather_display.render.http_session
+import weather_display.render.source_cache
+import weather_display.render.super_resolution
+import weather_display.render.text_metrics
+
 TIMEZONE = zoneinfo.ZoneInfo("Asia/Tokyo")
 
+# NOTE: 天気アイコンの加工のパラメータ (階調の幅、ガンマ、拡大率)
+ICON_TONE = 32
+ICON_GAMMA = 0.24
+ICON_SCALE = 1.9
+
+ICON_CACHE_DIR = pathlib.Path("data") / "icon_cache"
+# NOTE: キャッシュに無いアイコンを並列に取得する数
+ICON_WORKER_MAX = 4
+
+icon_cache = {}
+# NOTE: フォントの設定ごとの、フォントと表の固定の寸法
+layout_cache = {}
+
 # NOTE: 天気アイコンの周りにアイコンサイズの何倍の空きを確保するか
 ICON_MARGIN = 0.48
 
@@ -100,43 +122,62 @@ def get_face_map(font_config):
     }
 
 
-def get_image(weather_info):
-    tone = 32
-    gamma = 0.24
+def calc_layout(face_map):
+    """フォントだけで決まる、天気予報の表の固定の寸法を求める"""
+    img = PIL.Image.new("RGBA", (1, 1))
 
-    file_bytes = np.asarray(
-        bytearray(urllib.request.urlopen(weather_info["icon_url"]).read()),  # noqa: S310
-        dtype=np.uint8,
-    )
-    img = cv2.imdecode(file_bytes, cv2.IMREAD_UNCHANGED)
+    layout_map = {}
+    for name in ["temp", "temp_sens", "precip", "wind"]:
+        face = face_map[name]
+        layout_map[name] = {
+            "digit": weather_display.render.text_metrics.text_size(img, face["value"], "0"),
+            "value_width": weather_display.render.text_metrics.text_size(img, face["value"], "10")[0],
+            "unit_height": weather_display.render.text_metrics.text_size(img, face["unit"], "℃")[1],
+        }
+        if "zero" in face:
+            layout_map[name]["zero"] = weather_display.render.text_metrics.text_size(img, face["zero"], "0.")
 
-    # NOTE: 透過部分を白で塗りつぶす
-    img[img[..., -1] == 0] = [255, 255, 255, 0]
-    img = img[:, :, :3]
+    layout_map["wind"]["dir_height"] = weather_display.render.text_metrics.text_size(
+        img, face_map["wind"]["dir"], "南"
+    )[1]
+    layout_map["hour"] = {
+        "digit_height": weather_display.render.text_metrics.text_size(img, face_map["hour"]["value"], "0")[1],
+        "circle_height": weather_display.render.text_metrics.text_size(img, face_map["hour"]["value"], "21")[
+            1
+        ],
+    }
 
-    dump_path = str(
-        pathlib.Path(__file__).parent
-        / "img"
-        / (
-            weather_info["text"]
-            + "_"
-            + pathlib.Path(urllib.parse.urlparse(weather_info["icon_url"]).path).name
-        )
-    )
+    return layout_map
 
-    PIL.Image.fromarray(img).save(dump_path)
 
-    h, w = img.shape[:2]
+def get_layout_face_map(font_config):
+    """フォントと、表の固定の寸法 (face_map[名前]["layout"]) を、フォントの設定ごとに一度だけ求める"""
+    key = weather_display.render.bitmap_cache.make_key(font_config)
+
+    face_map = layout_cache.get(key)
+    if face_map is not None:
+        return face_map
+
+    face_map = get_face_map(font_config)
+    for name, layout in calc_layout(face_map).items():
+        face_map[name]["layout"] = layout
+
+    if key is not None:
+        layout_cache[key] = face_map
 
-    # NOTE: 一旦4倍の解像度に増やす
-    sr = cv2.dnn_superres.DnnSuperResImpl_create()
+    return face_map
 
-    model_path = str(pathlib.Path(__file__).parent / "data" / "ESPCN_x4.pb")
 
-    sr.readModel(model_path)
-    sr.setModel("espcn", 4)
-    img = sr.upsample(img)
+def decode_icon(file_bytes):
+    img = cv2.imdecode(file_bytes, cv2.IMREAD_UNCHANGED)
+
+    # NOTE: 透過部分を白で塗りつぶす
+    img[img[..., -1] == 0] = [255, 255, 255, 0]
 
+    return img[:, :, :3]
+
+
+def finish_icon(img, tone, gamma, scale, size):
     # NOTE: 階調を削減
     tone_table = np.zeros((256, 1), dtype=np.uint8)
     for i in range(256):
@@ -150,7 +191,8 @@ def get_image(weather_info):
     img = cv2.LUT(img, gamma_table)
 
     # NOTE: 最終的に欲しい解像度にする
-    img = cv2.resize(img, (int(w * 1.9), int(h * 1.9)), interpolation=cv2.INTER_CUBIC)
+    w, h = size
+    img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_CUBIC)
 
     # NOTE: 白色を透明にする
     img = cv2.cvtColor(img, cv2.COLOR_RGB2RGBA)
@@ -159,6 +201,108 @@ def get_image(weather_info):
     return PIL.Image.fromarray(img).convert("LA")
 
 
+def process_icon_list(img_list, tone, gamma, scale):
+    # NOTE: 一旦4倍の解像度に増やす (モデルの読み込みはプロセスで一度だけ)
+    upsampled_list = weather_display.render.super_resolution.upsample_list(img_list)
+
+    return [
+        finish_icon(upsampled, tone, gamma, scale, (img.shape[1], img.shape[0]))
+        for img, upsampled in zip(img_list, upsampled_list, strict=True)
+    ]
+
+
+def dump_icon(weather_info, img):
+    dump_path = str(
+        pathlib.Path(__file__).parent
+        / "img"
+        / (
+            weather_info["text"]
+            + "_"
+            + pathlib.Path(urllib.parse.urlparse(weather_info["icon_url"]).path).name
+        )
+    )
+
+    PIL.Image.fromarray(img).save(dump_path)
+
+
+def get_icon_key(weather_info):
+    return f"{weather_info['icon_url']}|{ICON_TONE}|{ICON_GAMMA}|{ICON_SCALE}"
+
+
+def get_icon_cache_path(key):
+    return ICON_CACHE_DIR / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.png"
+
+
+def load_icon(key):
+    path = get_icon_cache_path(key)
+    try:
+        img = PIL.Image.open(path)
+        img.load()
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logging.warning("Failed to load icon cache: %s", path, exc_info=True)
+        return None
+
+    return img
+
+
+def save_icon(key, img):
+    path = get_icon_cache_path(key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        img.save(path, "PNG")
+    except OSError:
+        logging.warning("Failed to save icon cache: %s", path, exc_info=True)
+
+
+def fetch_icon(weather_info):
+    logging.info("Fetch weather icon: %s", weather_info["icon_url"])
+
+    file_bytes = np.asarray(
+        bytearray(weather_display.render.http_session.opener.open(weather_info["icon_url"]).read()),
+        dtype=np.uint8,
+    )
+    img = decode_icon(file_bytes)
+    dump_icon(weather_info, img)
+
+    return img
+
+
+def prepare_icon(weather_info_list):
+    """キャッシュに無いアイコンをまとめて取得して加工し、キャッシュに格納する"""
+    # NOTE: Yahoo のアイコンは種類が限られているので、加工した結果をメモリとファイルにキャッシュし、
+    # 超解像などの重い処理は新しいアイコンが現れた時だけ行う
+    miss_map = {}
+    for weather_info in weather_info_list:
+        key = get_icon_key(weather_info)
+        if (key in icon_cache) or (key in miss_map):
+            continue
+
+        img = load_icon(key)
+        if img is not None:
+            icon_cache[key] = img
+        else:
+            miss_map[key] = weather_info
+
+    if len(miss_map) == 0:
+        return
+
+    # NOTE: 取得は並列に行い、超解像は読み込み済みのモデルでまとめて行う
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(ICON_WORKER_MAX, len(miss_map))) as executor:
+        img_list = list(executor.map(fetch_icon, miss_map.values()))
+        img_list = process_icon_list(img_list, ICON_TONE, ICON_GAMMA, ICON_SCALE)
+        list(executor.map(save_icon, miss_map.keys(), img_list))
+
+    icon_cache.update(zip(miss_map.keys(), img_list, strict=True))
+
+
+def get_image(weather_info):
+    prepare_icon([weather_info])
+
+    return icon_cache[get_icon_key(weather_info)]
+
+
 # NOTE: 体感温度の計算 (Gregorczuk, 1972)
 def calc_misnar_formula(temp, humi, wind):
     a = 1.76 + 1.4 * (wind**0.75)
@@ -198,24 +342,22 @@ def draw_text_info(  # noqa: PLR0913
     underline=False,
     margin_top_ratio=0.3,
 ):
-    pos_y += my_lib.pil_util.text_size(img, face["value"], "0")[1] * margin_top_ratio
+    layout = face["layout"]
+
+    pos_y += layout["digit"][1] * margin_top_ratio
 
     if is_first:
         my_lib.pil_util.alpha_paste(
             img,
             icon,
             (
-                int(pos_x - icon.size[0] / 2 - my_lib.pil_util.text_size(img, face["value"], "0")[0] * 0.4),
-                int(pos_y + (my_lib.pil_util.text_size(img, face["value"], "0")[1] - icon.size[1]) / 2.0),
+                int(pos_x - icon.size[0] / 2 - layout["digit"][0] * 0.4),
+                int(pos_y + (layout["digit"][1] - icon.size[1]) / 2.0),
             ),
         )
 
-    value_pos_x = pos_x + my_lib.pil_util.text_size(img, face["value"], "10")[0]
-    unit_pos_y = (
-        pos_y
-        + my_lib.pil_util.text_size(img, face["value"], "0")[1]
-        - my_lib.pil_util.text_size(img, face["unit"], "℃")[1]
-    )
+    value_pos_x = pos_x + layout["value_width"]
+    unit_pos_y = pos_y + layout["digit"][1] - layout["unit_height"]
     unit_pos_x = value_pos_x + 5
 
     if (value > 0.01) and (value < 1) and ("zero" in face):
@@ -229,10 +371,12 @@ def draw_text_info(  # noqa: PLR0913
             "right",
             color,
         )
-        int_pos_x = value_pos_x - my_lib.pil_util.text_size(img, face["value"], tenth_text)[0]
+        int_pos_x = (
+            value_pos_x - weather_display.render.text_metrics.text_size(img, face["value"], tenth_text)[0]
+        )
         int_pos_y = pos_y + (
-            my_lib.pil_util.text_size(img, face["value"], tenth_text)[1]
-            - my_lib.pil_util.text_size(img, face["zero"], "0.")[1]
+            weather_display.render.text_metrics.text_size(img, face["value"], tenth_text)[1]
+            - layout["zero"][1]
         )
         my_lib.pil_util.draw_text(
             img,
@@ -242,7 +386,7 @@ def draw_text_info(  # noqa: PLR0913
             "right",
             color,
         )
-        value_start_x = int_pos_x - my_lib.pil_util.text_size(img, face["zero"], "0.")[0]
+        value_start_x = int_pos_x - layout["zero"][0]
     else:
         if value < -0.5:
             value_text = f"{value:.0f}"
@@ -261,9 +405,11 @@ def draw_text_info(  # noqa: PLR0913
             "right",
             color,
         )
-        value_start_x = value_pos_x - my_lib.pil_util.text_size(img, face["value"], value_text)[0]
+        value_start_x = (
+            value_pos_x - weather_display.render.text_metrics.text_size(img, face["value"], value_text)[0]
+        )
 
-    next_pos_y = pos_y + my_lib.pil_util.text_size(img, face["value"], "0")[1]
+    next_pos_y = pos_y + layout["digit"][1]
 
     if underline:
         draw = PIL.ImageDraw.Draw(img)
@@ -338,7 +484,7 @@ def draw_precip(img, precip, is_first, pos_x, pos_y, precip_icon, face):  # noqa
 
 
 def draw_wind(img, wind, is_first, pos_x, pos_y, icon, face):  # noqa: PLR0913
-    pos_y += my_lib.pil_util.text_size(img, face["value"], "0")[1] * 0.2  # NOTE: 上にマージンを設ける
+    pos_y += face["layout"]["digit"][1] * 0.2  # NOTE: 上にマージンを設ける
 
     if wind["speed"] == 0:
         color = "#eee"
@@ -371,7 +517,7 @@ def draw_wind(img, wind, is_first, pos_x, pos_y, icon, face):  # noqa: PLR0913
             img,
             arrow_icon,
             (
-                int(pos_x + my_lib.pil_util.text_size(img, face["value"], "10")[0] - arrow_icon.size[0]),
+                int(pos_x + face["layout"]["value_width"] - arrow_icon.size[0]),
                 int(pos_y + (icon_orig_height - icon["arrow"].size[1]) / 2.0),
             ),
         )
@@ -391,20 +537,13 @@ def draw_wind(img, wind, is_first, pos_x, pos_y, icon, face):  # noqa: PLR0913
         margin_top_ratio=0,
     )
 
-    next_pos_y += (
-        my_lib.pil_util.text_size(
-            img,
-            face["dir"],
-            "南",
-        )[1]
-        * 0.2
-    )
+    next_pos_y += face["layout"]["dir_height"] * 0.2
 
     return my_lib.pil_util.draw_text(
         img,
         wind["dir"],
         [
-            pos_x + my_lib.pil_util.text_size(img, face["value"], "10")[0],
+            pos_x + face["layout"]["value_width"],
             next_pos_y,
         ],
         face["dir"],
@@ -425,7 +564,7 @@ def draw_hour(img, hour, is_today, pos_x, pos_y, face_map):  # noqa: PLR0913
         or (cur_hour >= 21 and hour == 21)
     ):
         draw = PIL.ImageDraw.Draw(img)
-        circle_height = my_lib.pil_util.text_size(img, face["value"], str(21))[1]
+        circle_height = face["layout"]["circle_height"]
 
         draw.ellipse(
             (
@@ -453,7 +592,7 @@ def draw_hour(img, hour, is_today, pos_x, pos_y, face_map):  # noqa: PLR0913
             "center",
         )
 
-    return pos_y + my_lib.pil_util.text_size(img, face["value"], "0")[1]
+    return pos_y + face["layout"]["digit_height"]
 
 
 def draw_weather_info(  # noqa: PLR0913
@@ -469,7 +608,7 @@ def draw_weather_info(  # noqa: PLR0913
     icon,
     face_map,
 ):
-    next_pos_y = pos_y + my_lib.pil_util.text_size(img, face_map["hour"]["value"], "0")[1] * HOUR_CIRCLE_RATIO
+    next_pos_y = pos_y + face_map["hour"]["layout"]["digit_height"] * HOUR_CIRCLE_RATIO
     next_pos_x, next_pos_y = draw_weather(
         img, info["weather"], overlay, pos_x, next_pos_y, ICON_MARGIN, face_map
     )
@@ -558,7 +697,7 @@ def draw_day_weather(img, info, wbgt_info, is_today, pos_x, pos_y, overlay, icon
 def draw_date(img, pos_x, pos_y, date, face_map):
     face = face_map["date"]
 
-    next_pos_x = pos_x + my_lib.pil_util.text_size(img, face["day"], "31")[0]
+    next_pos_x = pos_x + weather_display.render.text_metrics.text_size(img, face["day"], "31")[0]
     text_pos_x = (pos_x + next_pos_x) / 2.0
 
     locale.setlocale(locale.LC_TIME, "en_US.UTF-8")
@@ -584,7 +723,7 @@ def draw_date(img, pos_x, pos_y, date, face_map):
         date.strftime("(%a)"),
         [
             text_pos_x,
-            next_pos_y + my_lib.pil_util.text_size(img, face["wday"], "(土)")[1] * 0.2,
+            next_pos_y + weather_display.render.text_metrics.text_size(img, face["wday"], "(土)")[1] * 0.2,
         ],
         face["wday"],
         "center",
@@ -599,7 +738,7 @@ def draw_sunset(img, pos_x, pos_y, sunset_info, icon, face_map):  # noqa: PLR091
     face = face_map["sunset"]
 
     icon_width, icon_height = icon["sunset"].size
-    text_width, text_height = my_lib.pil_util.text_size(img, face["value"], sunset_info)
+    text_width, text_height = weather_display.render.text_metrics.text_size(img, face["value"], sunset_info)
 
     icon_pos = (
         int(pos_x - text_width / 2 - icon_width + OFFSET),
@@ -717,7 +856,17 @@ def draw_panel_weather(  # noqa: PLR0913
     ]:
         icon[name] = my_lib.pil_util.load_image(panel_config["icon"][name])
 
-    face_map = get_face_map(font_config)
+    # NOTE: フォントと表の固定の寸法は、フォントの設定が変わらない限り使い回す
+    face_map = get_layout_face_map(font_config)
+
+    # NOTE: レイアウトの前に、表示するアイコンを全て揃えておく
+    start = time.perf_counter()
+    prepare_icon(
+        [info["weather"] for day in ["today", "tomorrow"] for info in weather_info[day]["data"][2:8]]
+    )
+    prepare_time = time.perf_counter() - start
+    logging.info("Prepare weather icons in %.2f sec", prepare_time)
+    weather_display.render.super_resolution.add_prepare_time(prepare_time)
 
     pos_x = 10
     pos_y = 20
@@ -758,10 +907,30 @@ def draw_panel_weather(  # noqa: PLR0913
 def create_weather_panel_impl(panel_config, font_config, slack_config, is_side_by_side, trial, opt_config):  # noqa: ARG001, PLR0913
     # NOTE: APIコールを並列化して高速化
     with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        weather_future = executor.submit(get_weather_yahoo, panel_config["data"]["yahoo"])
-        clothing_future = executor.submit(get_clothing_yahoo, panel_config["data"]["yahoo"])
-        sunset_future = executor.submit(my_lib.weather.get_sunset_nao, opt_config["sunset"])
-        wbgt_future = executor.submit(get_wbgt, opt_config["wbgt"])
+        # NOTE: source_cache が有効な場合は、有効期限内であればキャッシュした値を使う
+        cache_dir = opt_config.get("source_cache")
+        get_source = weather_display.render.source_cache.get
+
+        weather_future = executor.submit(
+            get_source, cache_dir, "weather", get_weather_yahoo, panel_config["data"]["yahoo"]
+        )
+        clothing_future = executor.submit(
+            get_source, cache_dir, "clothing", get_clothing_yahoo, panel_config["data"]["yahoo"]
+        )
+        sunset_future = executor.submit(
+            get_source, cache_dir, "sunset", my_lib.weather.get_sunset_nao, opt_config["sunset"]
+        )
+        # NOTE: 暑さ指数は WBGT パネルも使うので、draw_panel が取得済みの値 (context) があれば、それを使う
+        wbgt_future = executor.submit(
+            weather_display.render.frame_context.get,
+            opt_config.get("context"),
+            "wbgt",
+            get_source,
+            cache_dir,
+            "wbgt",
+            get_wbgt,
+            opt_config["wbgt"],
+        )
 
         # すべての結果を取得
         weather_info = weather_future.result()
@@ -769,6 +938,22 @@ def create_weather_panel_impl(panel_config, font_config, slack_config, is_side_b
         sunset_info = sunset_future.result()
         wbgt_info = wbgt_future.result()
 
+    # NOTE: 日付と、現在の時間帯の強調表示 (draw_hour) は時刻に依存するのでキーに含める
+    now = datetime.datetime.now(TIMEZONE)
+    cache_key = weather_display.render.bitmap_cache.make_key(
+        panel_config,
+        font_config,
+        is_side_by_side,
+        (now.strftime("%Y-%m-%d %H"), now.minute // 30),
+        weather_info,
+        clothing_info,
+        sunset_info,
+        wbgt_info,
+    )
+    img = weather_display.render.bitmap_cache.get("weather", cache_key)
+    if img is not None:
+        return img
+
     img = PIL.Image.new(
         "RGBA",
         (panel_config["panel"]["width"], panel_config["panel"]["height"]),
@@ -786,20 +971,27 @@ def create_weather_panel_impl(panel_config, font_config, slack_config, is_side_b
         is_side_by_side,
     )
 
-    return img
+    return weather_display.render.bitmap_cache.put("weather", cache_key, img)
 
 
-def create(config, is_side_by_side=True):
+def create(config, is_side_by_side=True, context=None):
     logging.info("draw weather panel")
 
-    return my_lib.panel_util.draw_panel_patiently(
-        create_weather_panel_impl,
-        config["weather"],
-        config["font"],
-        None,
-        is_side_by_side,
-        {"sunset": config["sunset"], "wbgt": config["wbgt"]},
-    )
+    # NOTE: 天気予報のページやアイコンの取得で、接続を使い回し、変更が無ければ 304 で済ませる
+    with weather_display.render.http_session.session():
+        return my_lib.panel_util.draw_panel_patiently(
+            create_weather_panel_impl,
+            config["weather"],
+            config["font"],
+            None,
+            is_side_by_side,
+            {
+                "sunset": config["sunset"],
+                "wbgt": config["wbgt"],
+                "source_cache": config.get("source_cache"),
+                "context": context,
+            },
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+"""Resident image rendering service."""
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+同じホストの複数のフィールドを 1 回の Flux の問い合わせでまとめて取得します。
+
+fetch_data_parallel と同じ引数と戻り値を持つ fetch_data_batch() を提供します。問い合わせを
+ホスト (measure, hostname) と期間ごとにまとめ、pivot で列に展開した結果を、フィールドごとの
+fetch_data と同じ形式 (time, value, valid) に分け直します。最新値だけを取得する問い合わせ
+(last) は、ホストをまたいで 1 回にまとめます。
+実行すると、センサーグラフの問い合わせについて、従来の方法と問い合わせ回数と時間を比較します。
+
+Usage:
+  batch_query.py [-c CONFIG] [-D]
+
+Options:
+  -c CONFIG         : CONFIG を設定ファイルとして読み込んで実行します。[default: config.yaml]
+  -D                : デバッグモードで動作します。
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+
+import influxdb_client
+
+import weather_display.render.query_cache
+
+FLUX_PIVOT_QUERY = """
+from(bucket: "{bucket}")
+    |> range(start: {start}, stop: {stop})
+    |> filter(fn: (r) => r._measurement == "{measure}" and r.hostname == "{hostname}")
+    |> filter(fn: (r) => {field_filter})
+    |> aggregateWindow(every: {window}m, offset: -{window}m, fn: mean, createEmpty: {create_empty})
+    |> fill(usePrevious: true)
+    |> timedMovingAverage(every: {every}m, period: {window}m)
+    |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+"""
+
+# NOTE: fetch_data と同じく、時刻は 9 時間ずらして日本時間の時刻として扱う
+LOCALTIME_OFFSET = datetime.timedelta(hours=9)
+
+FLUX_LAST_QUERY = """
+from(bucket: "{bucket}")
+    |> range(start: {start}, stop: {stop})
+    |> filter(fn: (r) => {host_filter})
+    |> filter(fn: (r) => r._field == "{field}")
+    |> last()
+"""
+
+
+def get_group_key(request):
+    request = weather_display.render.query_cache.normalize(request)
+
+    if request["last"]:
+        # NOTE: 最新値はホストをまたいでまとめる
+        return ("last", request["field"], request["start"], request["stop"])
+
+    return (
+        "pivot",
+        request["measure"],
+        request["hostname"],
+        request["start"],
+        request["stop"],
+        request["every_min"],
+        request["window_min"],
+        request["create_empty"],
+    )
+
+
+def group_request(request_list):
+    """問い合わせをまとめられるものごとに分け、添字のリストを返す"""
+    group_map = {}
+    for i, request in enumerate(request_list):
+        group_map.setdefault(get_group_key(request), []).append(i)
+
+    return list(group_map.values())
+
+
+def build_pivot_query(db_config, request_list):
+    request = weather_display.render.query_cache.normalize(request_list[0])
+    field_list = list(dict.fromkeys(request["field"] for request in request_list))
+
+    return FLUX_PIVOT_QUERY.format(
+        bucket=db_config["bucket"],
+        start=request["start"],
+        stop=request["stop"],
+        measure=request["measure"],
+        hostname=request["hostname"],
+        field_filter=" or ".join(f'r._field == "{field}"' for field in field_list),
+        every=request["every_min"],
+        window=request["window_min"],
+        create_empty="true" if request["create_empty"] else "false",
+    )
+
+
+def build_last_query(db_config, request_list):
+    request = weather_display.render.query_cache.normalize(request_list[0])
+
+    return FLUX_LAST_QUERY.format(
+        bucket=db_config["bucket"],
+        start=request["start"],
+        stop=request["stop"],
+        host_filter=" or ".join(
+            f'(r._measurement == "{request["measure"]}" and r.hostname == "{request["hostname"]}")'
+            for request in request_list
+        ),
+        field=request["field"],
+    )
+
+
+def to_data(point_list, request):
+    """(時刻, 値) のリストに fetch_data と同じ後処理をして、同じ形式のデータにする"""
+    request = weather_display.render.query_cache.normalize(request)
+
+    # NOTE: fetch_data と同様、値が None の点 (fill の前の先頭など) は除く
+    point_list = [(time + LOCALTIME_OFFSET, value) for time, value in point_list if value is not None]
+
+    if request["create_empty"] and not request["last"] and (request["window_min"] > request["every_min"]):
+        # NOTE: fetch_data と同様、aggregateWindow と timedMovingAverage で末尾に入る余分な点を除く
+        point_list = point_list[: request["every_min"] - request["window_min"]]
+
+    return {
+        "time": [time for time, _ in point_list],
+        "value": [value for _, value in point_list],
+        "valid": len(point_list) != 0,
+    }
+
+
+def split_pivot(table_list, request_list):
+    """フィールドを列に展開した結果を、フィールドごとのデータに分け直す"""
+    record_list = [record for table in table_list for record in table.records]
+
+    return [
+        to_data([(record.get_time(), record.values.get(request["field"])) for record in record_list], request)
+        for request in request_list
+    ]
+
+
+def split_last(table_list, request_list):
+    """ホストをまとめて取得した最新値を、ホストごとのデータに分け直す"""
+    record_map = {}
+    for table in table_list:
+        for record in table.records:
+            record_map[(record.get_measurement(), record.values.get("hostname"))] = record
+
+    data_list = []
+    for request in request_list:
+        record = record_map.get((request["measure"], request["hostname"]))
+        if record is None:
+            data_list.append(to_data([], request))
+        else:
+            data_list.append(to_data([(record.get_time(), record.get_value())], request))
+
+    return data_list
+
+
+def query_group(client, db_config, request_list):
+    is_last = weather_display.render.query_cache.normalize(request_list[0])["last"]
+
+    if is_last:
+        query = build_last_query(db_config, request_list)
+    else:
+        query = build_pivot_query(db_config, request_list)
+
+    try:
+        table_list = client.query_api().query(query=query)
+    except Exception:
+        logging.warning("Failed to fetch data: %s", query, exc_info=True)
+        return [to_data([], request) for request in request_list]
+
+    if is_last:
+        return split_last(table_list, request_list)
+    else:
+        return split_pivot(table_list, request_list)
+
+
+async def fetch_data_batch(db_config, request_list):
+    """fetch_data_parallel と同じ結果を、ホストごとにまとめた問い合わせで取得する"""
+    group_list = group_request(request_list)
+    result_list = [None] * len(request_list)
+
+    start = time.perf_counter()
+    with influxdb_client.InfluxDBClient(
+        url=db_config["url"], token=db_config["token"], org=db_config["org"]
+    ) as client:
+        group_result_list = await asyncio.gather(
+            *[
+                asyncio.to_thread(query_group, client, db_config, [request_list[i] for i in index_list])
+                for index_list in group_list
+            ]
+        )
+
+    for index_list, group_result in zip(group_list, group_result_list, strict=True):
+        for i, data in zip(index_list, group_result, strict=True):
+            result_list[i] = data
+
+    logging.info(
+        "Fetched %d series with %d queries in %.2f sec (%d queries without batching)",
+        len(request_list),
+        len(group_list),
+        time.perf_counter() - start,
+        len(request_list),
+    )
+
+    return result_list
+
+
+if __name__ == "__main__":
+    # TEST Code
+    import docopt
+    import my_lib.config
+    import my_lib.logger
+    from my_lib.sensor_data import fetch_data_parallel
+
+    import weather_display.panel.sensor_graph
+
+    args = docopt.docopt(__doc__)
+
+    config_file = args["-c"]
+    debug_mode = args["-D"]
+
+    my_lib.logger.init("test", level=logging.DEBUG if debug_mode else logging.INFO)
+
+    config = my_lib.config.load(config_file)
+    db_config = config["influxdb"]
+    sensor_request_list, _ = weather_display.panel.sensor_graph.get_sensor_requests(config["sensor"])
+    aircon_request_list, _ = weather_display.panel.sensor_graph.get_aircon_power_requests(
+        config["sensor"]["room_list"]
+    )
+    request_list = sensor_request_list + aircon_request_list
+
+    for name, func in [("parallel", fetch_data_parallel), ("batch", fetch_data_batch)]:
+        start = time.perf_counter()
+        result_list = asyncio.run(func(db_config, request_list))
+        logging.info(
+            "%-8s: %d series (%d valid) in %.2f sec",
+            name,
+            len(result_list),
+            sum(1 for data in result_list if data["valid"]),
+            time.perf_counter() - start,
+        )
+
+    logging.info("Finish.")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+パネルの画像を、描画に使った入力のハッシュをキーにしてキャッシュします。
+
+取得したデータや設定が前回の描画から変わっていなければ、matplotlib や PIL での描画を省略して
+前回の画像を返します。キャッシュはプロセスごとに持つので、常駐しているワーカーの中で効果があります。
+"""
+
+import hashlib
+import logging
+import pickle
+
+# NOTE: パネルごとに直前の描画結果だけを保持する
+cache_map = {}
+stats = {"hit": 0, "miss": 0}
+
+
+def make_key(*data):
+    try:
+        return hashlib.sha256(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+    except Exception:
+        # NOTE: シリアライズできないデータが含まれている場合はキャッシュしない
+        logging.debug("Unable to make cache key", exc_info=True)
+        return None
+
+
+def get(name, key):
+    cache = cache_map.get(name)
+
+    if (key is not None) and (cache is not None) and (cache["key"] == key):
+        logging.info("Use cached %s image (input unchanged)", name)
+        stats["hit"] += 1
+        return cache["image"].copy()
+
+    stats["miss"] += 1
+    return None
+
+
+def put(name, key, img):
+    if key is not None:
+        cache_map[name] = {"key": key, "image": img.copy()}
+
+    return img
+
+
+def pop_stats():
+    """前回呼び出してからのヒット数とミス数を返す"""
+    global stats  # noqa: PLW0603
+
+    ret = stats
+    stats = {"hit": 0, "miss": 0}
+
+    return ret
+
+
+def clear():
+    cache_map.clear()
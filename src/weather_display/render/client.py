@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+常駐している画像生成サーバに画像をリクエストします。
+
+サーバが起動していない場合は、子プロセスとして起動します。
+"""
+
+import json
+import logging
+import pathlib
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import weather_display.framebuffer.frame_format
+import weather_display.render.server
+
+RENDER_SERVER = pathlib.Path(__file__).parent.parent.parent / "render_server.py"
+DEFAULT_SOCKET_PATH = pathlib.Path("data/render.sock")
+
+# NOTE: サーバの起動 (import 一式) を待つ時間
+START_TIMEOUT = 60
+# NOTE: 1 枚の画像生成を待つ時間
+RENDER_TIMEOUT = 300
+
+
+class RenderClient:
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, spawn=True):
+        """初期化.
+
+        Args:
+            socket_path: 画像生成サーバの Unix ソケットのパス
+            spawn: サーバが動いていない場合に子プロセスとして起動するか
+
+        """
+        self.socket_path = pathlib.Path(socket_path)
+        self.spawn = spawn
+        self.proc = None
+        # NOTE: Web UI から複数のスレッドで呼ばれるので、サーバの確認と起動を直列化する
+        self.lock = threading.Lock()
+
+    def ensure_server(self):
+        with self.lock:
+            self.ensure_server_impl()
+
+    def ensure_server_impl(self):
+        if weather_display.render.server.is_alive(self.socket_path):
+            return
+
+        if not self.spawn:
+            raise ConnectionError(f"Render server is not running: {self.socket_path}")  # noqa: EM102, TRY003
+
+        if (self.proc is not None) and (self.proc.poll() is None):
+            self.proc.kill()
+            self.proc.wait()
+
+        logging.info("Start render server process (%s)", self.socket_path)
+
+        # NOTE: 標準入力がクローズされたら (= このプロセスが終了したら) サーバも終了する
+        self.proc = subprocess.Popen(  # noqa: S603
+            [sys.executable, RENDER_SERVER, "-s", str(self.socket_path), "-P"],
+            stdin=subprocess.PIPE,
+        )
+
+        start = time.perf_counter()
+        while not weather_display.render.server.is_alive(self.socket_path):
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"Render server exited (code: {self.proc.returncode})")  # noqa: EM102, TRY003
+            if (time.perf_counter() - start) > START_TIMEOUT:
+                raise TimeoutError("Render server did not start in time")  # noqa: EM101, TRY003
+            time.sleep(0.2)
+
+        logging.info("Render server started in %.1f sec", time.perf_counter() - start)
+
+    def render(  # noqa: PLR0913
+        self,
+        config_file,
+        small_mode=False,
+        dummy_mode=False,
+        test_mode=False,
+        log_queue=None,
+        output_format=weather_display.framebuffer.frame_format.FORMAT_PNG,
+        compress=False,
+        display_time=None,
+        output=None,
+    ):
+        """画像を生成し、指定された形式 (デフォルトは PNG) のデータと終了コードを返す.
+
+        Args:
+            config_file: 設定ファイルのパス
+            small_mode: 小型ディスプレイモードで生成するか
+            dummy_mode: ダミーモードで生成するか
+            test_mode: テストモードで生成するか
+            log_queue: 指定された場合、描画中のログを bytes で積む
+            output_format: 画像の形式 (frame_format.FORMAT_LIST のいずれか)
+            compress: gray8 / gray4 の場合に zlib で圧縮するか
+            display_time: 画像が表示される時刻 (UNIX 時間)。時刻パネルに使う
+            output: 指定された場合、サーバから届いたそばから画像を書き込む
+
+        Returns:
+            dict: image (画像データ), status (終了コード), elapsed (サーバでの処理時間),
+                  latency (リクエストから応答までの時間)。output を指定した場合は、
+                  first_byte (最初に書き込んだ時刻) と sent_bytes (書き込んだバイト数) も含む
+
+        """
+        start = time.perf_counter()
+
+        self.ensure_server()
+
+        request = {
+            "config": str(pathlib.Path(config_file).resolve()),
+            "small_mode": small_mode,
+            "dummy_mode": dummy_mode,
+            "test_mode": test_mode,
+            "output_format": output_format,
+            "compress": compress,
+            "display_time": display_time,
+        }
+
+        result = {}
+        image_list = []
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(RENDER_TIMEOUT)
+            sock.connect(str(self.socket_path))
+
+            with sock.makefile("rwb") as stream:
+                stream.write(json.dumps(request).encode("utf-8") + b"\n")
+                stream.flush()
+
+                # NOTE: 画像はエンコードされたそばから分割して届き、最後に終了コードが届く
+                while "status" not in result:
+                    kind, payload = weather_display.render.server.recv_record(stream)
+
+                    if kind == weather_display.render.server.RECORD_LOG:
+                        if log_queue is not None:
+                            log_queue.put(payload)
+                    elif kind == weather_display.render.server.RECORD_IMAGE:
+                        if output is not None:
+                            result.setdefault("first_byte", time.perf_counter())
+                            output.write(payload)
+                        image_list.append(payload)
+                    elif kind == weather_display.render.server.RECORD_STATUS:
+                        result.update(json.loads(payload))
+                    elif kind == weather_display.render.server.RECORD_ERROR:
+                        raise RuntimeError(payload.decode("utf-8"))
+
+        result["image"] = b"".join(image_list)
+        if output is not None:
+            result["sent_bytes"] = len(result["image"])
+        result["latency"] = time.perf_counter() - start
+
+        logging.info(
+            "Render request finished: latency = %.3f sec, server = %.3f sec, status = %d",
+            result["latency"],
+            result["elapsed"],
+            result["status"],
+        )
+
+        return result
+
+    def close(self):
+        with self.lock:
+            if (self.proc is None) or (self.proc.poll() is not None):
+                return
+
+            logging.info("Stop render server process")
+
+            self.proc.stdin.close()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
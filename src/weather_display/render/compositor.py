@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+パネルの画像を輝度とアルファの 8bit 配列のまま合成し、グレースケールのフレームを生成します。
+
+RGBA のキャンバス (3200x1800 で約 23 MB) にパネルを順に貼り付けてから最後にグレースケールに
+変換する代わりに、確保済みの輝度のバッファに、各パネルの不透明な部分を囲む矩形だけを合成します。
+従来の処理は compose_reference() として比較用に残しています。
+実行すると、両者の合成時間と結果の差を表示します。
+
+Usage:
+  compositor.py [-W WIDTH] [-H HEIGHT] [-n COUNT] [-D]
+
+Options:
+  -W WIDTH          : キャンバスの幅。[default: 3200]
+  -H HEIGHT         : キャンバスの高さ。[default: 1800]
+  -n COUNT          : 繰り返し回数。[default: 5]
+  -D                : デバッグモードで動作します。
+"""
+
+import logging
+import time
+
+import my_lib.pil_util
+import numpy as np
+import PIL.Image
+
+BACKGROUND = 255
+
+
+def new_canvas(width, height):
+    return np.full((height, width), BACKGROUND, dtype=np.uint8)
+
+
+def blend(canvas, img, pos):
+    """RGBA の画像を輝度のキャンバスに合成する"""
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+
+    # NOTE: 完全に透明な部分は合成しても変わらないので、不透明な部分を囲む矩形だけを対象にする
+    bbox = img.getchannel("A").getbbox()
+    if bbox is None:
+        return
+
+    height, width = canvas.shape
+    x0 = max(pos[0] + bbox[0], 0)
+    y0 = max(pos[1] + bbox[1], 0)
+    x1 = min(pos[0] + bbox[2], width)
+    y1 = min(pos[1] + bbox[3], height)
+    if (x0 >= x1) or (y0 >= y1):
+        return
+
+    src = np.asarray(img.crop((x0 - pos[0], y0 - pos[1], x1 - pos[0], y1 - pos[1])).convert("LA"))
+    lum = src[..., 0]
+    alpha = src[..., 1]
+    dst = canvas[y0:y1, x0:x1]
+
+    if alpha.min() == 255:
+        dst[...] = lum
+        return
+
+    # NOTE: 255 x 255 + 127 は uint16 に収まる
+    alpha = alpha.astype(np.uint16)
+    dst[...] = (lum * alpha + dst * (255 - alpha) + 127) // 255
+
+
+def compose(size, layer_list):
+    """画像と位置のリストを下から順に合成し、グレースケールの画像を返す"""
+    canvas = new_canvas(*size)
+    for img, pos in layer_list:
+        blend(canvas, img, pos)
+
+    return PIL.Image.fromarray(canvas)
+
+
+def compose_reference(size, layer_list):
+    """compose() と同じ合成を、RGBA のキャンバスを使う従来の方法で行う"""
+    img = PIL.Image.new("RGBA", size, (BACKGROUND, BACKGROUND, BACKGROUND, 255))
+    for layer, pos in layer_list:
+        my_lib.pil_util.alpha_paste(img, layer, pos)
+
+    return my_lib.pil_util.convert_to_gray(img)
+
+
+def make_dummy_layer_list(width, height, count=7):
+    """ベンチマーク用に、半透明な部分と透明な余白を持つパネルを生成する"""
+    rng = np.random.default_rng(0)
+
+    layer_list = []
+    panel_width = width // 2
+    panel_height = height // 3
+    for i in range(count):
+        pixel = rng.integers(0, 256, (panel_height, panel_width, 4), dtype=np.uint8)
+        # NOTE: 余白は透明、内側は半透明と不透明を混ぜる
+        pixel[..., 3] = np.where(pixel[..., 3] < 128, 160, 255)
+        pixel[: panel_height // 10, :, 3] = 0
+        pixel[:, : panel_width // 10, 3] = 0
+
+        pos = ((i % 2) * panel_width, (i // 2) * panel_height % height)
+        layer_list.append((PIL.Image.fromarray(pixel, "RGBA"), pos))
+
+    return layer_list
+
+
+def benchmark(size, layer_list, count):
+    result = {}
+    for name, func in [("reference", compose_reference), ("numpy", compose)]:
+        start = time.perf_counter()
+        for _ in range(count):
+            img = func(size, layer_list)
+        result[name] = {"time": (time.perf_counter() - start) / count, "image": img}
+
+    diff = np.abs(
+        np.asarray(result["reference"]["image"], dtype=np.int16)
+        - np.asarray(result["numpy"]["image"], dtype=np.int16)
+    )
+
+    return {
+        "reference": result["reference"]["time"],
+        "numpy": result["numpy"]["time"],
+        "max_diff": int(diff.max()),
+    }
+
+
+if __name__ == "__main__":
+    # TEST Code
+    import docopt
+    import my_lib.logger
+
+    args = docopt.docopt(__doc__)
+
+    width = int(args["-W"])
+    height = int(args["-H"])
+    count = int(args["-n"])
+    debug_mode = args["-D"]
+
+    my_lib.logger.init("test", level=logging.DEBUG if debug_mode else logging.INFO)
+
+    layer_list = make_dummy_layer_list(width, height)
+    logging.info("Benchmark with %d layers on %dx%d (%d times)", len(layer_list), width, height, count)
+
+    result = benchmark((width, height), layer_list, count)
+
+    logging.info("reference: %6.1f msec", result["reference"] * 1000)
+    logging.info("numpy    : %6.1f msec", result["numpy"] * 1000)
+    logging.info("max diff : %d", result["max_diff"])
+
+    logging.info("Finish.")
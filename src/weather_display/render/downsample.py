@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+グラフの幅 (ピクセル数) に合わせて、センサーのデータを間引いて取得します。
+
+パネルの downsample を指定した場合だけ有効になります。期間とグラフの幅から集計の間隔を決めて
+InfluxDB 側で集計し、取得する点の数を減らします。method に lttb (Largest-Triangle-Three-Buckets)
+または minmax (区間ごとの最小値と最大値) を指定すると、1 ピクセルあたり数点を取得した上で、
+形を保つように 1 ピクセルあたり 1 点程度まで間引きます。
+最新の値は大きく数値で表示するので、直近の区間だけは従来どおりの間隔で取得して差し替えます。
+"""
+
+import itertools
+import logging
+import re
+
+import numpy as np
+
+import weather_display.render.query_cache
+import weather_display.render.series_buffer
+
+METHOD_MEAN = "mean"
+METHOD_LTTB = "lttb"
+METHOD_MINMAX = "minmax"
+METHOD_LIST = [METHOD_MEAN, METHOD_LTTB, METHOD_MINMAX]
+
+# NOTE: 手元で間引く場合は、間引く前に 1 ピクセルあたり何点取得するか
+POINT_PER_PIXEL = {METHOD_MEAN: 1, METHOD_LTTB: 4, METHOD_MINMAX: 4}
+
+RELATIVE_TIME_PATTERN = re.compile(r"^-(\d+)([mhd])$")
+UNIT_MIN = {"m": 1, "h": 60, "d": 24 * 60}
+
+
+def parse_relative_min(text):
+    """-60h や now() を、現在からの分数に変換する。変換できない場合は None を返す"""
+    if text == "now()":
+        return 0
+
+    match = RELATIVE_TIME_PATTERN.match(text)
+    if match is None:
+        return None
+
+    return int(match.group(1)) * UNIT_MIN[match.group(2)]
+
+
+def get_every_min(request, width, method):
+    """グラフの幅に合わせた集計の間隔 (分)"""
+    request = weather_display.render.query_cache.normalize(request)
+
+    start = parse_relative_min(request["start"])
+    stop = parse_relative_min(request["stop"])
+    if (start is None) or (stop is None) or (start <= stop) or request["last"]:
+        return request["every_min"]
+
+    return max(request["every_min"], (start - stop) // (width * POINT_PER_PIXEL[method]))
+
+
+def split_request(request, width, method):
+    """間引いて取得する期間全体と、従来どおりの間隔で取得する直近の区間の問い合わせに分ける"""
+    every_min = get_every_min(request, width, method)
+    option = weather_display.render.query_cache.normalize(request)
+
+    if every_min == option["every_min"]:
+        return request, None
+
+    history = dict(request, every_min=every_min, window_min=max(option["window_min"], every_min))
+    # NOTE: 間引いた期間の最後の点より前から取得し直す
+    tail = dict(request, start=f"-{parse_relative_min(option['stop']) + every_min + option['window_min']}m")
+
+    return history, tail
+
+
+def combine(history, tail):
+    """間引いたデータの末尾を、直近の区間のデータで差し替える"""
+    if (tail is None) or not tail.get("valid", False) or (len(tail["time"]) == 0):
+        return history
+    if not history.get("valid", False):
+        return tail
+
+    cut = tail["time"][0]
+    count = sum(1 for t in history["time"] if t < cut)
+
+    return {
+        "time": history["time"][:count] + tail["time"],
+        "value": history["value"][:count] + tail["value"],
+        "valid": True,
+    }
+
+
+def lttb_index(x, y, threshold):
+    """Largest-Triangle-Three-Buckets で残す点の添字を返す"""
+    n = len(x)
+    if (threshold >= n) or (threshold < 3):
+        return np.arange(n)
+
+    # NOTE: 最初と最後の点は必ず残し、残りを threshold - 2 個の区間に分ける
+    edge = (np.floor(np.arange(threshold - 1) * ((n - 2) / (threshold - 2))) + 1).astype(np.int64)
+    edge[-1] = n - 1
+
+    index = [0]
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edge[i], edge[i + 1]
+        next_lo, next_hi = (edge[i + 1], edge[i + 2]) if i + 2 < len(edge) else (n - 1, n)
+
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+
+        a = lo + int(np.argmax(area))
+        index.append(a)
+    index.append(n - 1)
+
+    return np.array(index)
+
+
+def minmax_index(y, bucket_count):
+    """区間ごとの最小値と最大値の点の添字を返す"""
+    n = len(y)
+    if bucket_count * 2 >= n:
+        return np.arange(n)
+
+    index = [0, n - 1]
+    edge = np.linspace(0, n, bucket_count + 1).astype(np.int64)
+    for lo, hi in itertools.pairwise(edge):
+        index.append(lo + int(np.argmin(y[lo:hi])))
+        index.append(lo + int(np.argmax(y[lo:hi])))
+
+    return np.unique(index)
+
+
+def reduce(data, width, method):
+    """形を保つように、グラフの幅に合わせて点を間引く"""
+    if (method == METHOD_MEAN) or not data.get("valid", False):
+        return data
+
+    time_array, value_array = weather_display.render.series_buffer.to_array(data)
+
+    # NOTE: 欠損した点は間引きの対象から外す
+    valid_index = np.flatnonzero(~np.isnan(value_array))
+    x = time_array[valid_index]
+    y = value_array[valid_index]
+
+    if method == METHOD_LTTB:
+        index = valid_index[lttb_index(x, y, width)]
+    else:
+        index = valid_index[minmax_index(y, width // 2)]
+
+    return {
+        "time": [data["time"][i] for i in index],
+        "value": [data["value"][i] for i in index],
+        "valid": True,
+        "time_array": time_array[index],
+        "value_array": value_array[index],
+    }
+
+
+def finish(request, data, tail, width, method):
+    result = reduce(combine(data, tail), width, method)
+
+    logging.debug(
+        "Downsample %s/%s: %d points (width = %d, method = %s)",
+        request["hostname"],
+        request["field"],
+        len(result.get("time", [])) if isinstance(result, dict) else 0,
+        width,
+        method,
+    )
+
+    return result
+
+
+def fetch(fetch_func, db_config, request, width, downsample_config):
+    """series_buffer.fetch() で、グラフの幅に合わせて間引いたデータを取得する"""
+    if downsample_config is None:
+        return weather_display.render.series_buffer.fetch(fetch_func, db_config, request)
+
+    method = downsample_config.get("method", METHOD_MEAN)
+    history, tail = split_request(request, width, method)
+
+    data = weather_display.render.series_buffer.fetch(fetch_func, db_config, history)
+    if tail is not None:
+        tail = weather_display.render.series_buffer.fetch(fetch_func, db_config, tail)
+
+    return finish(request, data, tail, width, method)
+
+
+async def fetch_parallel(fetch_parallel_func, db_config, request_list, width_list, downsample_config):
+    """fetch() の並列版。幅が None の問い合わせは間引かない"""
+    if downsample_config is None:
+        return await weather_display.render.series_buffer.fetch_parallel(
+            fetch_parallel_func, db_config, request_list
+        )
+
+    method = downsample_config.get("method", METHOD_MEAN)
+
+    split_list = [
+        (request, None) if width is None else split_request(request, width, method)
+        for request, width in zip(request_list, width_list, strict=True)
+    ]
+    actual_list = [history for history, _ in split_list]
+    actual_list += [tail for _, tail in split_list if tail is not None]
+
+    result_list = await weather_display.render.series_buffer.fetch_parallel(
+        fetch_parallel_func, db_config, actual_list
+    )
+
+    tail_iter = iter(result_list[len(request_list) :])
+    merged_list = []
+    for request, width, (_, tail), data in zip(
+        request_list, width_list, split_list, result_list[: len(request_list)], strict=True
+    ):
+        if width is None:
+            merged_list.append(data)
+            continue
+
+        merged_list.append(finish(request, data, None if tail is None else next(tail_iter), width, method))
+
+    return merged_list
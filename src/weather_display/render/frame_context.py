@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+複数のパネルが使う外部のデータを、フレームごとに一度だけ取得して各パネルに渡します。
+
+create_image.draw_panel が、パネルの "context" に記載された取得元をまとめて先に取得し、
+その結果 (コンテキスト) を引数としてパネルに渡します。パネルは get() で、コンテキストに
+取得済みの値があればそれを使い、無ければ (取得に失敗した場合や、パネル単体で動かす場合)
+自分で取得します。
+"""
+
+import logging
+import time
+
+import my_lib.weather
+
+import weather_display.render.source_cache
+
+
+def fetch_wbgt(config):
+    return weather_display.render.source_cache.get(
+        config.get("source_cache"), "wbgt", my_lib.weather.get_wbgt, config["wbgt"]
+    )
+
+
+# NOTE: 取得元の名前と、設定から値を取得する関数
+SOURCE_MAP = {
+    "wbgt": fetch_wbgt,
+}
+
+
+def prefetch(config, name_list):
+    """指定された取得元の値を取得し、コンテキストとして返す"""
+    context = {}
+    for name in name_list:
+        start = time.perf_counter()
+        try:
+            context[name] = SOURCE_MAP[name](config)
+        except Exception:
+            # NOTE: パネル側で取得し直し、エラーはパネルの描画結果として扱う
+            logging.warning("Failed to prefetch %s", name, exc_info=True)
+            continue
+        logging.info("Prefetch %s in %.2f sec", name, time.perf_counter() - start)
+
+    return context
+
+
+def get(context, name, func, *arg_list):
+    """コンテキストに取得済みの値があればそれを、無ければ func(*arg_list) の値を返す"""
+    if (context is not None) and (name in context):
+        return context[name]
+
+    return func(*arg_list)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+天気予報などの取得元への HTTP 接続を使い回し、変更の無いページは 304 で済ませます。
+
+opener は、スレッドごとに保持した http.client の接続 (keep-alive) を使います。プロセス全体の
+urlopen() は変えず、天気アイコンなどは opener.open() で取得します。my_lib.weather のページ取得の
+ように urlopen() を使うものは、session() の中で呼んだ場合だけ opener を使います。
+ETag か Last-Modified を返すページは、本文をディスクにキャッシュしておき、次回は
+If-None-Match / If-Modified-Since を付けて問い合わせます。304 が返った場合は、キャッシュした
+本文を 200 の応答として返します。
+"""
+
+import contextlib
+import email.message
+import gzip
+import hashlib
+import http.client
+import io
+import logging
+import os
+import pathlib
+import pickle
+import tempfile
+import threading
+import urllib.request
+import urllib.response
+
+CACHE_DIR = pathlib.Path("data") / "http_cache"
+# NOTE: 画像などの大きな応答はキャッシュしない
+CACHE_SIZE_MAX = 4 * 1024 * 1024
+TIMEOUT = 30
+
+connection_local = threading.local()
+
+stats = {"request": 0, "reuse": 0, "not_modified": 0}
+
+session_lock = threading.Lock()
+session_count = 0
+
+
+def get_connection_map():
+    # NOTE: fork されたワーカーに接続を引き継がないよう、プロセスごとに接続し直す
+    if getattr(connection_local, "pid", None) != os.getpid():
+        connection_local.pid = os.getpid()
+        connection_local.map = {}
+
+    return connection_local.map
+
+
+def get_cache_path(url):
+    return CACHE_DIR / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.pickle"
+
+
+def load_entry(url):
+    try:
+        with get_cache_path(url).open("rb") as f:
+            return pickle.load(f)  # noqa: S301
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logging.warning("Failed to load HTTP cache: %s", url, exc_info=True)
+        return None
+
+
+def save_entry(url, entry):
+    path = get_cache_path(url)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".pickle", delete=False) as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pathlib.Path(f.name).replace(path)
+    except OSError:
+        logging.warning("Failed to save HTTP cache: %s", url, exc_info=True)
+
+
+def send(connection_class, host, method, path, body, header_map):  # noqa: PLR0913
+    """保持している接続で要求を送り、ステータス、ヘッダ、本文を返す"""
+    connection_map = get_connection_map()
+    key = (connection_class.__name__, host)
+
+    for _ in range(2):
+        conn = connection_map.get(key)
+        is_reused = conn is not None
+        if conn is None:
+            conn = connection_class(host, timeout=TIMEOUT)
+            connection_map[key] = conn
+
+        try:
+            conn.request(method, path, body=body, headers=header_map)
+            res = conn.getresponse()
+            data = res.read()
+        except (http.client.HTTPException, OSError) as e:
+            # NOTE: タイムアウトなどで途中まで使った接続は、次の要求で使わないように捨てる
+            conn.close()
+            del connection_map[key]
+            # NOTE: サーバーが keep-alive の接続を閉じていた場合は、接続し直して一度だけ再送する。
+            # タイムアウトなどは再送しても時間がかかるだけなので、そのまま送出する
+            if not (is_reused and isinstance(e, (http.client.HTTPException, ConnectionError))):
+                raise
+            continue
+
+        stats["request"] += 1
+        stats["reuse"] += int(is_reused)
+
+        if res.will_close:
+            conn.close()
+            del connection_map[key]
+
+        return res.status, res.headers, data
+
+    raise http.client.HTTPException(f"Failed to request {host}{path}")  # noqa: EM102, TRY003
+
+
+def make_header(item_list):
+    header = email.message.Message()
+    for name, value in item_list:
+        # NOTE: 本文は読み出し済みなので、転送に関する情報は付けない
+        if name.lower() not in ["content-length", "transfer-encoding"]:
+            header[name] = value
+
+    return header
+
+
+def make_response(url, status, item_list, data):
+    res = urllib.response.addinfourl(io.BytesIO(data), make_header(item_list), url, status)
+    res.msg = http.client.responses.get(status, "")
+
+    return res
+
+
+def open_request(connection_class, req):
+    # NOTE: プロキシを経由する場合は、urllib 標準のハンドラに任せる
+    if req.has_proxy() or (getattr(req, "_tunnel_host", None) is not None):
+        return None
+
+    url = req.full_url
+    method = req.get_method()
+
+    header_map = {**req.headers, **req.unredirected_hdrs}
+    # NOTE: 呼び出し側が指定していなければ圧縮して転送してもらい、ここで展開する
+    is_gzip_requested = all(name.lower() != "accept-encoding" for name in header_map)
+    if is_gzip_requested:
+        header_map["Accept-Encoding"] = "gzip"
+
+    entry = load_entry(url) if method == "GET" else None
+    if entry is not None:
+        if entry["etag"] is not None:
+            header_map["If-None-Match"] = entry["etag"]
+        if entry["last_modified"] is not None:
+            header_map["If-Modified-Since"] = entry["last_modified"]
+
+    status, header, data = send(connection_class, req.host, method, req.selector, req.data, header_map)
+
+    if (status == http.client.NOT_MODIFIED) and (entry is not None):
+        logging.debug("Not modified: %s", url)
+        stats["not_modified"] += 1
+        return make_response(url, http.client.OK, entry["header"], entry["data"])
+
+    if is_gzip_requested and (header.get("Content-Encoding", "").lower() == "gzip"):
+        data = gzip.decompress(data)
+        item_list = [(name, value) for name, value in header.items() if name.lower() != "content-encoding"]
+    else:
+        item_list = list(header.items())
+    if (
+        (method == "GET")
+        and (status == http.client.OK)
+        and (("ETag" in header) or ("Last-Modified" in header))
+        and (len(data) <= CACHE_SIZE_MAX)
+    ):
+        save_entry(
+            url,
+            {
+                "etag": header.get("ETag"),
+                "last_modified": header.get("Last-Modified"),
+                "header": item_list,
+                "data": data,
+            },
+        )
+
+    return make_response(url, status, item_list, data)
+
+
+class SessionHandler(urllib.request.BaseHandler):
+    # NOTE: urllib 標準の HTTPHandler / HTTPSHandler (500) より先に使われるようにする
+    handler_order = 400
+
+    def http_open(self, req):
+        return open_request(http.client.HTTPConnection, req)
+
+    def https_open(self, req):
+        return open_request(http.client.HTTPSConnection, req)
+
+
+opener = urllib.request.build_opener(SessionHandler)
+
+
+@contextlib.contextmanager
+def session():
+    """この中で呼ばれた urllib.request.urlopen() が、このモジュールの接続とキャッシュを使うようにする"""
+    global session_count  # noqa: PLW0603
+
+    # NOTE: 複数のスレッドから同時に使われても、最後に抜けた時に元 (標準の opener) に戻す
+    with session_lock:
+        if session_count == 0:
+            urllib.request.install_opener(opener)
+        session_count += 1
+
+    try:
+        yield opener
+    finally:
+        with session_lock:
+            session_count -= 1
+            if session_count == 0:
+                urllib.request.install_opener(None)
+
+
+def pop_stats():
+    """前回呼び出してからの要求数、接続を使い回した数、304 で済んだ数を返す"""
+    global stats  # noqa: PLW0603
+
+    ret = stats
+    stats = {"request": 0, "reuse": 0, "not_modified": 0}
+
+    return ret
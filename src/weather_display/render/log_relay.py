@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+常駐プロセスでの描画中に出力されたログを、描画を依頼したリクエストに届けます。
+
+パネルはワーカープロセスで、パネルが使うデータの先読みは別スレッドで処理されるので、
+描画を依頼したスレッドのログだけを集めると、それらのログが漏れます。ワーカーでは collect() で
+タスク中のログを集めて結果と一緒に返し、依頼元で forward() に渡します。先読みのスレッドは
+call() を通して呼び出し、その間のログを集める対象に加えます。
+"""
+
+import contextlib
+import logging
+import threading
+
+# NOTE: 描画中のリクエストのログを集めるハンドラ (描画は同時に一つしか行わない)
+capture_handler = None
+
+
+class Collector(logging.Handler):
+    """タスク中のログを、プロセス間で受け渡せる形にして溜めるハンドラ"""
+
+    def __init__(self):
+        """初期化."""
+        super().__init__()
+
+        self.record_list = []
+
+    def emit(self, record):
+        try:
+            # NOTE: 引数や例外の情報は pickle できるとは限らないので、文字列にしておく
+            message = self.format(record)
+            record = logging.makeLogRecord(record.__dict__)
+            record.msg = message
+            record.args = None
+            record.exc_info = None
+            record.exc_text = None
+            record.stack_info = None
+
+            self.record_list.append(record)
+        except Exception:
+            self.handleError(record)
+
+
+def start(handler):
+    """描画中のリクエストのログを集めるハンドラとして、handler を登録する"""
+    global capture_handler  # noqa: PLW0603
+
+    capture_handler = handler
+
+
+def stop():
+    global capture_handler  # noqa: PLW0603
+
+    capture_handler = None
+
+
+def is_active():
+    return capture_handler is not None
+
+
+def call(func, *arg_list):
+    """func(*arg_list) を呼び出す間、このスレッドのログを描画中のリクエストに届ける"""
+    handler = capture_handler
+    if handler is None:
+        return func(*arg_list)
+
+    # NOTE: スレッドの ID は使い回されるので、終わったら対象から外す
+    thread_id = threading.get_ident()
+    handler.add_thread(thread_id)
+    try:
+        return func(*arg_list)
+    finally:
+        handler.remove_thread(thread_id)
+
+
+@contextlib.contextmanager
+def collect(enable=True):
+    """この中で出力されたログを集め、LogRecord のリストとして返す"""
+    record_list = []
+    if not enable:
+        yield record_list
+        return
+
+    collector = Collector()
+    logging.getLogger().addHandler(collector)
+    try:
+        yield record_list
+    finally:
+        logging.getLogger().removeHandler(collector)
+        record_list.extend(collector.record_list)
+
+
+def forward(record_list):
+    """ワーカーで集めたログを、描画中のリクエストに届ける"""
+    handler = capture_handler
+    if handler is None:
+        return
+
+    for record in record_list:
+        handler.forward(record)
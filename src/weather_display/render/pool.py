@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+パネル描画用のワーカープロセスを描画サイクルをまたいで維持します。
+
+matplotlib はマルチスレッド対応していないので、パネルはプロセス単位で並列に描画します。
+重いパネルは種類ごとに専用のワーカーを割り当て、フォントや OpenCV などの初期化結果を
+ワーカーの中に残したまま次のフレームで再利用します。
+"""
+
+import logging
+import multiprocessing
+import os
+import resource
+import threading
+import time
+
+import weather_display.render.bitmap_cache
+import weather_display.render.log_relay
+import weather_display.render.query_cache
+import weather_display.render.super_resolution
+
+# NOTE: 専用のワーカーを割り当てるパネル (create_image.draw_panel でのパネル名)
+HEAVY_PANEL_LIST = ["rain_cloud", "sensor", "power", "weather"]
+# NOTE: それ以外のパネルは共用のワーカーで描画する
+SHARED_WORKER = "shared"
+SHARED_WORKER_COUNT = 3
+
+# NOTE: ワーカーを作り直すまでのタスク数とメモリ使用量の上限
+MAX_TASKS_PER_WORKER = 100
+MAX_RSS_MB = 400
+
+worker_pool = None
+
+
+def get_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:  # noqa: PTH123
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        # NOTE: /proc が無い環境ではピーク値で代用する
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_task(func, arg, dummy_mode=None, capture_log=False):
+    # NOTE: ワーカーの環境変数は起動時のままなので、依頼元のダミーモードの指定に揃える
+    if dummy_mode is None:
+        os.environ.pop("DUMMY_MODE", None)
+    else:
+        os.environ["DUMMY_MODE"] = dummy_mode
+
+    # NOTE: このタスクでのキャッシュのヒット数を数えるため、集計をリセットしておく
+    weather_display.render.bitmap_cache.pop_stats()
+    weather_display.render.query_cache.pop_stats()
+    weather_display.render.super_resolution.pop_stats()
+
+    # NOTE: 描画を依頼したリクエストにログを届けるため、タスク中のログを結果と一緒に返す
+    with weather_display.render.log_relay.collect(capture_log) as record_list:
+        result = func(*arg)
+
+    return {
+        "result": result,
+        "log": record_list,
+        "pid": os.getpid(),
+        "rss": get_rss_mb(),
+        "cache": weather_display.render.bitmap_cache.pop_stats(),
+        "query": weather_display.render.query_cache.pop_stats(),
+        "upsample": weather_display.render.super_resolution.pop_stats(),
+    }
+
+
+class PanelWorkerPool:
+    def __init__(self, max_tasks=MAX_TASKS_PER_WORKER, max_rss=MAX_RSS_MB):
+        """初期化.
+
+        Args:
+            max_tasks: ワーカーを作り直すまでのタスク数
+            max_rss: ワーカーを作り直すメモリ使用量 (MB)
+
+        """
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+        self.lock = threading.Lock()
+        self.worker_map = {}
+        # NOTE: 締め切りに間に合わなかったタスクと、パネルごとの最後に成功した画像
+        self.pending_map = {}
+        self.last_image_map = {}
+
+    def worker_kind(self, name):
+        return name if name in HEAVY_PANEL_LIST else SHARED_WORKER
+
+    def create_worker(self, kind):
+        start = time.perf_counter()
+        processes = SHARED_WORKER_COUNT if kind == SHARED_WORKER else 1
+
+        worker = {
+            "pool": multiprocessing.Pool(processes=processes),
+            "task_count": 0,
+        }
+        logging.info("Start %s worker in %.3f sec", kind, time.perf_counter() - start)
+
+        return worker
+
+    def get_worker(self, kind):
+        with self.lock:
+            if kind not in self.worker_map:
+                self.worker_map[kind] = self.create_worker(kind)
+            return self.worker_map[kind]
+
+    def warmup(self):
+        for kind in [*HEAVY_PANEL_LIST, SHARED_WORKER]:
+            self.get_worker(kind)
+
+    def submit(self, name, func, arg):
+        worker = self.get_worker(self.worker_kind(name))
+        worker["task_count"] += 1
+
+        return worker["pool"].apply_async(
+            run_task,
+            (func, arg, os.environ.get("DUMMY_MODE"), weather_display.render.log_relay.is_active()),
+        )
+
+    def done(self, name, task_info):
+        """タスクの完了を記録し、必要であればワーカーを作り直す"""
+        kind = self.worker_kind(name)
+
+        with self.lock:
+            worker = self.worker_map.get(kind)
+            if worker is None:
+                return
+
+            if task_info["rss"] > self.max_rss:
+                reason = f"RSS {task_info['rss']:.0f} MB > {self.max_rss} MB"
+            elif worker["task_count"] >= self.max_tasks:
+                reason = f"{worker['task_count']} tasks"
+            else:
+                return
+
+            logging.info("Recycle %s worker (pid: %d, %s)", kind, task_info["pid"], reason)
+
+            # NOTE: 次のフレームまでに新しいワーカーを用意しておく
+            self.worker_map[kind] = self.create_worker(kind)
+
+        self.stop_worker(worker, wait=False)
+
+    def keep_pending(self, name, task):
+        """締め切りに間に合わなかったタスクを、次のフレームで結果を受け取れるように保持する"""
+        self.pending_map[name] = task
+
+    def pop_pending(self, name):
+        return self.pending_map.pop(name, None)
+
+    def save_image(self, name, img):
+        self.last_image_map[name] = {"image": img, "time": time.time()}
+
+    def last_image(self, name):
+        return self.last_image_map.get(name)
+
+    def stop_worker(self, worker, wait=True):
+        worker["pool"].close()
+        if wait:
+            worker["pool"].join()
+        else:
+            threading.Thread(target=worker["pool"].join).start()
+
+    def term(self):
+        with self.lock:
+            worker_list = list(self.worker_map.values())
+            self.worker_map = {}
+            self.pending_map = {}
+
+        for worker in worker_list:
+            self.stop_worker(worker)
+
+
+def init(max_tasks=MAX_TASKS_PER_WORKER, max_rss=MAX_RSS_MB):
+    """常駐プロセス用のワーカープールを起動する"""
+    global worker_pool  # noqa: PLW0603
+
+    if worker_pool is None:
+        worker_pool = PanelWorkerPool(max_tasks, max_rss)
+        worker_pool.warmup()
+
+    return worker_pool
+
+
+def get():
+    """常駐プロセス用のワーカープールを返す (起動していなければ None)"""
+    return worker_pool
+
+
+def term():
+    global worker_pool  # noqa: PLW0603
+
+    if worker_pool is not None:
+        worker_pool.term()
+        worker_pool = None
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+InfluxDB への問い合わせ結果を、パネルやプロセスをまたいで共有するキャッシュです。
+
+influxdb.cache に SQLite のファイルを指定した場合だけ有効になります。キーは問い合わせの内容
+(measure, hostname, field, 期間, 集計の幅と間隔) で、有効期限はデータの集計の幅に合わせます。
+WAL モードで開くので、複数のワーカープロセスから同時に読み出せます。
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+import pickle
+import sqlite3
+import threading
+import time
+
+# NOTE: fetch_data の引数のうち、問い合わせの内容を決めるもの (値は fetch_data のデフォルト)
+OPTION_DEFAULT = {
+    "start": "-30h",
+    "stop": "now()",
+    "every_min": 1,
+    "window_min": 3,
+    "create_empty": True,
+    "last": False,
+}
+
+connection_map = {}
+connection_lock = threading.Lock()
+
+stats = {"hit": 0, "miss": 0, "saved_time": 0.0}
+
+
+def get_connection(path):
+    # NOTE: fork されたワーカーに接続を引き継がないよう、プロセスごとに接続する
+    key = (os.getpid(), str(path))
+
+    with connection_lock:
+        conn = connection_map.get(key)
+        if conn is None:
+            path = pathlib.Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    key TEXT PRIMARY KEY,
+                    expire REAL NOT NULL,
+                    query_time REAL NOT NULL,
+                    data BLOB NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_query_cache_expire ON query_cache (expire)")
+            conn.commit()
+
+            connection_map[key] = conn
+
+    return conn
+
+
+def normalize(request):
+    return {
+        "measure": request["measure"],
+        "hostname": request["hostname"],
+        "field": request["field"],
+        **{name: request.get(name, default) for name, default in OPTION_DEFAULT.items()},
+    }
+
+
+def make_key(db_config, request):
+    return hashlib.sha256(
+        repr(
+            (db_config["url"], db_config["org"], db_config["bucket"], sorted(normalize(request).items()))
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def get_ttl(request):
+    """キャッシュの有効期限 (秒)"""
+    request = normalize(request)
+
+    # NOTE: 集計の幅や間隔より短い間隔で問い合わせても、データはほとんど変わらない
+    return max(request["every_min"], request["window_min"]) * 60
+
+
+def get(db_config, request):
+    if "cache" not in db_config:
+        return None
+
+    try:
+        conn = get_connection(db_config["cache"])
+        with connection_lock:
+            row = conn.execute(
+                "SELECT query_time, data FROM query_cache WHERE key = ? AND expire > ?",
+                (make_key(db_config, request), time.time()),
+            ).fetchone()
+    except sqlite3.Error:
+        logging.warning("Failed to read query cache", exc_info=True)
+        return None
+
+    if row is None:
+        stats["miss"] += 1
+        return None
+
+    stats["hit"] += 1
+    stats["saved_time"] += row[0]
+
+    return pickle.loads(row[1])  # noqa: S301
+
+
+def put(db_config, request, data, query_time):
+    # NOTE: 取得に失敗した結果はキャッシュしない
+    if ("cache" not in db_config) or not isinstance(data, dict) or not data.get("valid", False):
+        return
+
+    now = time.time()
+    try:
+        conn = get_connection(db_config["cache"])
+        with connection_lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO query_cache (key, expire, query_time, data) VALUES (?, ?, ?, ?)",
+                (
+                    make_key(db_config, request),
+                    now + get_ttl(request),
+                    query_time,
+                    pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL),
+                ),
+            )
+            conn.execute("DELETE FROM query_cache WHERE expire < ?", (now,))
+            conn.commit()
+    except sqlite3.Error:
+        logging.warning("Failed to write query cache", exc_info=True)
+
+
+def call(fetch_func, db_config, request):
+    option = {name: request[name] for name in OPTION_DEFAULT if name in request}
+
+    return fetch_func(db_config, request["measure"], request["hostname"], request["field"], **option)
+
+
+def fetch(fetch_func, db_config, request):
+    """キャッシュが有効であればキャッシュから、無ければ fetch_func (fetch_data) で取得する"""
+    data = get(db_config, request)
+    if data is not None:
+        return data
+
+    start = time.perf_counter()
+    data = call(fetch_func, db_config, request)
+    put(db_config, request, data, time.perf_counter() - start)
+
+    return data
+
+
+async def fetch_parallel(fetch_parallel_func, db_config, request_list):
+    """fetch() の並列版。キャッシュに無いものだけを fetch_parallel_func (fetch_data_parallel) で取得する"""
+    result_list = [get(db_config, request) for request in request_list]
+    miss_index_list = [i for i, result in enumerate(result_list) if result is None]
+
+    if len(miss_index_list) == 0:
+        return result_list
+
+    start = time.perf_counter()
+    miss_result_list = await fetch_parallel_func(db_config, [request_list[i] for i in miss_index_list])
+    # NOTE: 並列に取得しているので、1 件あたりの取得時間は全体を件数で割ったものとする
+    query_time = (time.perf_counter() - start) / len(miss_index_list)
+
+    for i, data in zip(miss_index_list, miss_result_list, strict=True):
+        put(db_config, request_list[i], data, query_time)
+        result_list[i] = data
+
+    return result_list
+
+
+def pop_stats():
+    """前回呼び出してからのヒット数、ミス数、キャッシュによって省略できた問い合わせ時間を返す"""
+    global stats  # noqa: PLW0603
+
+    ret = stats
+    stats = {"hit": 0, "miss": 0, "saved_time": 0.0}
+
+    return ret
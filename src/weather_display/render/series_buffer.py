@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+センサーの履歴 (直近 60 時間など) を系列ごとに保持し、増えた分だけを InfluxDB から取得します。
+
+influxdb.history にディレクトリを指定した場合だけ有効になります。系列ごとに時刻と値の配列を
+npz ファイルに保存しておき、次回は保存済みの最後の時刻以降 (集計の幅の分だけ重ねて) だけを
+問い合わせ、期間から外れた古い点を捨てます。問い合わせの先頭の点は集計の窓が欠けて値が
+変わるので、さらに窓の幅だけ前から問い合わせて、その分は捨てます。
+パネルには fetch_data と同じ形式のデータに加えて、numpy の配列 (time_array: UNIX 時間,
+value_array: 欠損は NaN) を渡します。
+"""
+
+import datetime
+import hashlib
+import logging
+import math
+import pathlib
+import re
+import tempfile
+import time
+
+import numpy as np
+
+import weather_display.render.query_cache
+
+RELATIVE_HOUR_PATTERN = re.compile(r"^-(\d+)h$")
+
+
+def get_window_hour(request):
+    """増分取得できる問い合わせであれば、その期間 (時間) を返す"""
+    match = RELATIVE_HOUR_PATTERN.match(request.get("start", ""))
+    if (match is None) or (request.get("stop", "now()") != "now()") or request.get("last", False):
+        return None
+
+    return int(match.group(1))
+
+
+def get_path(db_config, request):
+    request = weather_display.render.query_cache.normalize(request)
+    key = hashlib.sha256(
+        repr(
+            (
+                db_config["url"],
+                db_config["bucket"],
+                request["measure"],
+                request["hostname"],
+                request["field"],
+                request["every_min"],
+                request["window_min"],
+            )
+        ).encode("utf-8")
+    ).hexdigest()
+
+    return pathlib.Path(db_config["history"]) / f"{key}.npz"
+
+
+def load(path):
+    try:
+        with np.load(path) as npz:
+            return {"time": npz["time"], "value": npz["value"]}
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logging.warning("Failed to load series buffer: %s", path, exc_info=True)
+        return None
+
+
+def save(path, series):
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # NOTE: 他のプロセスが読み出し中でも壊れたファイルが見えないよう、書き終えてから置き換える
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".npz", delete=False) as f:
+        np.savez(f, time=series["time"], value=series["value"])
+    pathlib.Path(f.name).replace(path)
+
+
+def prepare(db_config, request, now):
+    """問い合わせる内容を決める。増分取得できない場合は None を返す"""
+    if "history" not in db_config:
+        return None
+
+    window_hour = get_window_hour(request)
+    if window_hour is None:
+        return None
+
+    path = get_path(db_config, request)
+    series = load(path)
+    begin = now - window_hour * 3600
+
+    state = {"path": path, "series": series, "begin": begin, "since": begin}
+
+    if (series is None) or (len(series["time"]) == 0) or (series["time"][-1] < begin):
+        return state, request
+
+    # NOTE: 最後の集計区間はまだ確定していない可能性があるので、集計の幅の分だけ重ねて取得し直す
+    option = weather_display.render.query_cache.normalize(request)
+    overlap = max(option["every_min"], option["window_min"]) * 60
+    since = max(series["time"][-1] - overlap, begin)
+    state["since"] = since
+
+    # NOTE: since 直後の点も窓全体で集計されるよう、窓の幅だけ前から問い合わせる
+    query_start = since - option["window_min"] * 60
+
+    return state, dict(request, start=f"-{math.ceil((now - query_start) / 60)}m")
+
+
+def to_array(data):
+    time_array = np.array([t.timestamp() for t in data["time"]], dtype=np.float64)
+    value_array = np.array([np.nan if v is None else v for v in data["value"]], dtype=np.float64)
+
+    return time_array, value_array
+
+
+def merge(state, data):
+    """取得したデータを保存済みの系列に追加し、期間から外れた点を捨てて返す"""
+    series = state["series"]
+    if isinstance(data, dict) and data.get("valid", False):
+        time_array, value_array = to_array(data)
+        tzinfo = data["time"][0].tzinfo if len(data["time"]) != 0 else datetime.timezone.utc
+        since = state["since"]
+
+        # NOTE: 窓が欠けた状態で集計された、since より前の点は捨てる
+        keep = time_array >= since
+        time_array = time_array[keep]
+        value_array = value_array[keep]
+    else:
+        # NOTE: 取得に失敗した場合は、保存済みの系列をそのまま使う
+        time_array = value_array = np.empty(0, dtype=np.float64)
+        tzinfo = datetime.timezone.utc
+        since = math.inf
+
+    if series is not None:
+        # NOTE: 取得し直した範囲は新しいデータで置き換える
+        keep = (series["time"] >= state["begin"]) & (series["time"] < since)
+        time_array = np.concatenate((series["time"][keep], time_array))
+        value_array = np.concatenate((series["value"][keep], value_array))
+
+    keep = time_array >= state["begin"]
+    series = {"time": time_array[keep], "value": value_array[keep]}
+
+    if len(series["time"]) == 0:
+        if not isinstance(data, dict):
+            return data
+        # NOTE: パネルは配列があることを前提にしているので、空でも付けて返す
+        return dict(data, time_array=series["time"], value_array=series["value"])
+
+    try:
+        save(state["path"], series)
+    except OSError:
+        logging.warning("Failed to save series buffer: %s", state["path"], exc_info=True)
+
+    return {
+        "time": [datetime.datetime.fromtimestamp(t, tzinfo) for t in series["time"]],
+        "value": [None if math.isnan(v) else v for v in series["value"].tolist()],
+        "valid": True,
+        "time_array": series["time"],
+        "value_array": series["value"],
+    }
+
+
+def fetch(fetch_func, db_config, request):
+    """保存済みの系列があれば増えた分だけを取得し、無ければ query_cache.fetch() で取得する"""
+    prepared = prepare(db_config, request, time.time())
+    if prepared is None:
+        return weather_display.render.query_cache.fetch(fetch_func, db_config, request)
+
+    state, actual_request = prepared
+    data = weather_display.render.query_cache.fetch(fetch_func, db_config, actual_request)
+    log_size(request, data, state)
+
+    return merge(state, data)
+
+
+async def fetch_parallel(fetch_parallel_func, db_config, request_list):
+    """fetch() の並列版"""
+    now = time.time()
+    prepared_list = [prepare(db_config, request, now) for request in request_list]
+
+    result_list = await weather_display.render.query_cache.fetch_parallel(
+        fetch_parallel_func,
+        db_config,
+        [
+            request if prepared is None else prepared[1]
+            for request, prepared in zip(request_list, prepared_list, strict=True)
+        ],
+    )
+
+    merged_list = []
+    for request, prepared, data in zip(request_list, prepared_list, result_list, strict=True):
+        if prepared is None:
+            merged_list.append(data)
+            continue
+
+        log_size(request, data, prepared[0])
+        merged_list.append(merge(prepared[0], data))
+
+    return merged_list
+
+
+def log_size(request, data, state):
+    logging.debug(
+        "Fetch %s/%s since %d min ago: %d points",
+        request["hostname"],
+        request["field"],
+        (time.time() - state["since"]) // 60,
+        len(data.get("time", [])) if isinstance(data, dict) else 0,
+    )
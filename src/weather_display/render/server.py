@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+画像生成サービスを Unix ソケット経由で提供します。
+
+プロトコルは、JSON 1行のリクエストに対して「種別 (1 byte) + 長さ (4 byte) + ペイロード」
+のレコードを順に返す形式です。描画中のログと、エンコードしたそばから分割した画像を逐次返し、
+最後に終了コードを返します。
+"""
+
+import json
+import logging
+import pathlib
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import traceback
+
+import weather_display.framebuffer.frame_format
+import weather_display.render.pool
+import weather_display.render.service
+
+RECORD_LOG = b"L"
+RECORD_STATUS = b"S"
+RECORD_IMAGE = b"I"
+RECORD_ERROR = b"E"
+
+RECORD_HEADER = struct.Struct(">cI")
+
+
+def send_record(stream, kind, payload):
+    stream.write(RECORD_HEADER.pack(kind, len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def recv_exact(stream, size):
+    buf = stream.read(size)
+    if len(buf) != size:
+        raise ConnectionError("Render server closed the connection")  # noqa: EM101, TRY003
+    return buf
+
+
+def recv_record(stream):
+    kind, size = RECORD_HEADER.unpack(recv_exact(stream, RECORD_HEADER.size))
+    return kind, recv_exact(stream, size)
+
+
+def is_alive(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+class RecordWriter:
+    """書き込まれたデータを、指定された種別のレコードとして送信キューに積む"""
+
+    def __init__(self, record_queue, kind):
+        """初期化.
+
+        Args:
+            record_queue: (種別, ペイロード) を積むキュー
+            kind: レコードの種別
+
+        """
+        self.record_queue = record_queue
+        self.kind = kind
+        self.size = 0
+
+    def put(self, payload):
+        self.record_queue.put((self.kind, payload))
+
+    def write(self, payload):
+        if len(payload) != 0:
+            self.put(bytes(payload))
+            self.size += len(payload)
+
+        return len(payload)
+
+    def flush(self):
+        pass
+
+    def tell(self):
+        return self.size
+
+
+class RenderRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # NOTE: is_alive() による死活確認の接続
+            return
+
+        request = json.loads(line)
+        logging.info("Receive render request: %s", request)
+
+        # NOTE: 描画中のログと画像を、生成された順にレコードとして送る
+        record_queue = queue.Queue()
+        result = {}
+
+        def worker():
+            try:
+                result.update(
+                    weather_display.render.service.render(
+                        request["config"],
+                        request.get("small_mode", False),
+                        request.get("dummy_mode", False),
+                        request.get("test_mode", False),
+                        RecordWriter(record_queue, RECORD_LOG),
+                        request.get("output_format", weather_display.framebuffer.frame_format.FORMAT_PNG),
+                        request.get("compress", False),
+                        request.get("display_time"),
+                        RecordWriter(record_queue, RECORD_IMAGE),
+                    )
+                )
+            except Exception:
+                logging.exception("Failed to render image")
+                result["error"] = traceback.format_exc()
+            finally:
+                # NOTE: None を積むことで、実行完了を通知
+                record_queue.put(None)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+
+        try:
+            while True:
+                record = record_queue.get()
+                if record is None:
+                    break
+                send_record(self.wfile, *record)
+        finally:
+            thread.join()
+
+        if "error" in result:
+            send_record(self.wfile, RECORD_ERROR, result["error"].encode("utf-8"))
+            return
+
+        send_record(
+            self.wfile,
+            RECORD_STATUS,
+            json.dumps({"status": result["status"], "elapsed": result["elapsed"]}).encode("utf-8"),
+        )
+
+
+class RenderServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def start(socket_path):
+    socket_path = pathlib.Path(socket_path)
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # NOTE: 前回異常終了した際のソケットファイルが残っていたら削除する
+    if socket_path.exists() and not is_alive(socket_path):
+        socket_path.unlink()
+
+    # NOTE: パネル描画用のワーカーを先に起動しておき、フレーム生成時の起動コストを無くす
+    weather_display.render.pool.init()
+
+    server = RenderServer(str(socket_path), RenderRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+
+    logging.info("Start render server (%s)", socket_path)
+
+    thread.start()
+
+    return {
+        "server": server,
+        "thread": thread,
+        "socket_path": socket_path,
+    }
+
+
+def term(handle):
+    logging.warning("Stop render server")
+
+    handle["server"].shutdown()
+    handle["server"].server_close()
+    handle["thread"].join()
+
+    weather_display.render.pool.term()
+
+    handle["socket_path"].unlink(missing_ok=True)
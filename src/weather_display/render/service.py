@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+画像生成をプロセス内で実行するサービスです。
+
+matplotlib や pandas などの import、設定ファイルの読み込みと検証を毎回やり直さずに済むよう、
+常駐プロセスの中から呼び出されることを想定しています。
+"""
+
+import logging
+import os
+import pathlib
+import threading
+import time
+
+import my_lib.config
+
+import create_image
+import weather_display.framebuffer.frame_format
+import weather_display.render.log_relay
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(filename)s:%(lineno)s %(funcName)s] %(message)s"
+
+config_cache = {}
+render_lock = threading.Lock()
+
+
+class LogCapture(logging.Handler):
+    """描画を行っているスレッド (と、そのために起動したスレッド) のログだけを収集するハンドラ"""
+
+    def __init__(self, log_queue):
+        """初期化.
+
+        Args:
+            log_queue: フォーマット済みのログを bytes で積むキュー
+
+        """
+        super().__init__()
+
+        self.log_queue = log_queue
+        self.pid = os.getpid()
+        self.thread_id_set = {threading.get_ident()}
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def add_thread(self, thread_id):
+        self.thread_id_set.add(thread_id)
+
+    def remove_thread(self, thread_id):
+        self.thread_id_set.discard(thread_id)
+
+    def emit(self, record):
+        # NOTE: fork されたパネル描画プロセスにもハンドラが引き継がれるので、自プロセスのみ対象にする。
+        # パネル描画プロセスのログは、weather_display.render.log_relay 経由で forward() に届く
+        if (record.process != self.pid) or (record.thread not in self.thread_id_set):
+            return
+
+        self.forward(record)
+
+    def forward(self, record):
+        try:
+            self.log_queue.put((self.format(record) + "\n").encode("utf-8"))
+        except Exception:
+            self.handleError(record)
+
+
+def load_config(config_file, small_mode):
+    path = pathlib.Path(config_file)
+    mtime = path.stat().st_mtime
+    key = (str(path.resolve()), small_mode)
+
+    cache = config_cache.get(key)
+    if (cache is None) or (cache["mtime"] != mtime):
+        logging.info("Load config: %s", path)
+        cache = {
+            "mtime": mtime,
+            "config": my_lib.config.load(
+                path,
+                pathlib.Path(create_image.SCHEMA_CONFIG_SMALL if small_mode else create_image.SCHEMA_CONFIG),
+            ),
+        }
+        config_cache[key] = cache
+
+    return cache["config"]
+
+
+def render(  # noqa: PLR0913
+    config_file,
+    small_mode=False,
+    dummy_mode=False,
+    test_mode=False,
+    log_queue=None,
+    output_format=weather_display.framebuffer.frame_format.FORMAT_PNG,
+    compress=False,
+    display_time=None,
+    output=None,
+):
+    """画像を生成し、指定された形式 (デフォルトは PNG) のデータと終了コードを返す
+
+    output が指定された場合、画像はエンコードしたそばから output に書き込み、データは返さない。
+    output は、書き込んだバイト数を返す tell() を持つこと。
+    """
+    start = time.perf_counter()
+
+    with render_lock:
+        wait_time = time.perf_counter() - start
+
+        handler = None
+        if log_queue is not None:
+            handler = LogCapture(log_queue)
+            logging.getLogger().addHandler(handler)
+            weather_display.render.log_relay.start(handler)
+
+        try:
+            # NOTE: 常駐プロセスなので、前回のリクエストのダミーモード指定を引き継がないようにする
+            if not dummy_mode:
+                os.environ.pop("DUMMY_MODE", None)
+
+            config = load_config(config_file, small_mode)
+            img, status = create_image.create_image(config, small_mode, dummy_mode, test_mode, display_time)
+
+            if output is None:
+                image = weather_display.framebuffer.frame_format.encode(img, output_format, compress)
+                size = len(image)
+            else:
+                image = None
+                weather_display.framebuffer.frame_format.write(img, output, output_format, compress)
+                size = output.tell()
+        finally:
+            if handler is not None:
+                weather_display.render.log_relay.stop()
+                logging.getLogger().removeHandler(handler)
+
+    elapsed = time.perf_counter() - start
+    logging.info("render latency: %.3f sec (wait: %.3f sec), size: %s bytes", elapsed, wait_time, f"{size:,}")
+
+    return {
+        "image": image,
+        "status": status,
+        "elapsed": elapsed,
+    }
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+天気予報、服装指数、日の入り、暑さ指数の取得結果を、更新される周期に合わせてキャッシュします。
+
+source_cache にディレクトリを指定した場合だけ有効になります。取得元ごとに、次に更新された
+内容が取得できるようになる時刻 (天気予報などは次の正時の少し後、日の入りは翌日の 0 時) を
+取得し直す時刻とし、パースした結果をファイルに保存します。取得し直す時刻を過ぎてからしばらくは、
+キャッシュした値を返しつつバックグラウンドで取得し直すので、有効期限内であれば描画が取得を
+待つことはありません。更新前のページを取得しないよう、取得し直すのは更新された後だけです。
+"""
+
+import datetime
+import hashlib
+import logging
+import pathlib
+import pickle
+import tempfile
+import threading
+import time
+import zoneinfo
+
+TIMEZONE = zoneinfo.ZoneInfo("Asia/Tokyo")
+
+PERIOD_HOUR = "hour"
+PERIOD_DAY = "day"
+
+# NOTE: 取得元ごとの更新の周期 (記載の無いものは PERIOD_HOUR)
+PERIOD_MAP = {
+    "weather": PERIOD_HOUR,
+    "clothing": PERIOD_HOUR,
+    "wbgt": PERIOD_HOUR,
+    "sunset": PERIOD_DAY,
+}
+
+# NOTE: 正時に更新されたページが取得できるようになるまでの余裕
+HOUR_DELAY_SEC = 10 * 60
+# NOTE: 取得し直す時刻を過ぎてからこの時間は、キャッシュした値を返しつつバックグラウンドで取得し直す
+REFRESH_MARGIN_SEC = 5 * 60
+
+refresh_lock = threading.Lock()
+refresh_set = set()
+
+
+def get_refresh(name, now):
+    """取得元の内容が次に更新され、取得できるようになる時刻 (UNIX 時間)"""
+    if PERIOD_MAP.get(name, PERIOD_HOUR) == PERIOD_DAY:
+        midnight = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return midnight.timestamp()
+
+    hour = (now + datetime.timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    return hour.timestamp() + HOUR_DELAY_SEC
+
+
+def get_path(cache_dir, name, arg_list):
+    key = hashlib.sha256(pickle.dumps(arg_list, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    return pathlib.Path(cache_dir) / f"{name}_{key[:16]}.pickle"
+
+
+def load(path):
+    try:
+        with path.open("rb") as f:
+            return pickle.load(f)  # noqa: S301
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logging.warning("Failed to load source cache: %s", path, exc_info=True)
+        return None
+
+
+def save(path, entry):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".pickle", delete=False) as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pathlib.Path(f.name).replace(path)
+    except OSError:
+        logging.warning("Failed to save source cache: %s", path, exc_info=True)
+
+
+def update(path, name, func, arg_list):
+    start = time.perf_counter()
+    value = func(*arg_list)
+    logging.info("Fetch %s in %.2f sec", name, time.perf_counter() - start)
+
+    refresh = get_refresh(name, datetime.datetime.now(TIMEZONE))
+    save(path, {"value": value, "refresh": refresh, "expire": refresh + REFRESH_MARGIN_SEC})
+
+    return value
+
+
+def refresh(path, name, func, arg_list):
+    try:
+        update(path, name, func, arg_list)
+    except Exception:
+        # NOTE: 有効期限が切れた時点で、もう一度取得を試みる
+        logging.warning("Failed to refresh %s", name, exc_info=True)
+    finally:
+        with refresh_lock:
+            refresh_set.discard(path)
+
+
+def get(cache_dir, name, func, *arg_list):
+    """有効期限内であればキャッシュした値を、そうでなければ func(*arg_list) で取得した値を返す"""
+    if cache_dir is None:
+        return func(*arg_list)
+
+    path = get_path(cache_dir, name, arg_list)
+    entry = load(path)
+    now = time.time()
+
+    # NOTE: 取得し直す時刻を持たない、以前の形式のキャッシュは使わない
+    if (entry is None) or ("refresh" not in entry) or (now >= entry["expire"]):
+        return update(path, name, func, arg_list)
+
+    # NOTE: 更新前のページを取得し直さないよう、内容が更新された後から取得し直す
+    if now >= entry["refresh"]:
+        with refresh_lock:
+            is_running = path in refresh_set
+            refresh_set.add(path)
+
+        if not is_running:
+            logging.info("Refresh %s in background", name)
+            threading.Thread(target=refresh, args=(path, name, func, arg_list), daemon=True).start()
+
+    return entry["value"]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+天気アイコンの超解像 (ESPCN) を行います。
+
+モデルはプロセスで最初に使う時に一度だけ読み込み、以降はワーカーの中で使い回します。
+キャッシュに無いアイコンは、upsample_list() でまとめて処理します。モデルの読み込み時間と
+推論時間、アイコンの準備 (取得から加工まで) 全体にかかった時間は pop_stats() で取得でき、
+パネルのメトリクスとして描画時間とは別に記録されます。
+"""
+
+import logging
+import pathlib
+import threading
+import time
+
+import cv2
+
+MODEL_PATH = pathlib.Path(__file__).parent.parent / "panel" / "data" / "ESPCN_x4.pb"
+MODEL_NAME = "espcn"
+MODEL_SCALE = 4
+
+upsampler = None
+# NOTE: モデルの読み込みと推論は、スレッド間で同時に行わない
+upsampler_lock = threading.Lock()
+
+stats = {"load_time": 0.0, "count": 0, "time": 0.0, "prepare_time": 0.0}
+
+
+def get_upsampler():
+    """モデルを読み込んだ超解像の処理系を返す。呼び出し元で upsampler_lock を取得しておくこと"""
+    global upsampler  # noqa: PLW0603
+
+    if upsampler is None:
+        start = time.perf_counter()
+
+        sr = cv2.dnn_superres.DnnSuperResImpl_create()
+        sr.readModel(str(MODEL_PATH))
+        sr.setModel(MODEL_NAME, MODEL_SCALE)
+
+        load_time = time.perf_counter() - start
+        stats["load_time"] += load_time
+        logging.info("Load super-resolution model in %.2f sec", load_time)
+
+        upsampler = sr
+
+    return upsampler
+
+
+def upsample_list(img_list):
+    """画像をまとめて MODEL_SCALE 倍の解像度にする"""
+    if len(img_list) == 0:
+        return []
+
+    with upsampler_lock:
+        sr = get_upsampler()
+
+        start = time.perf_counter()
+        result_list = [sr.upsample(img) for img in img_list]
+        infer_time = time.perf_counter() - start
+
+    stats["count"] += len(img_list)
+    stats["time"] += infer_time
+    logging.info(
+        "Upsample %d images in %.2f sec (%.3f sec/image)",
+        len(img_list),
+        infer_time,
+        infer_time / len(img_list),
+    )
+
+    return result_list
+
+
+def upsample(img):
+    return upsample_list([img])[0]
+
+
+def add_prepare_time(prepare_time):
+    """アイコンの準備にかかった時間を記録する"""
+    stats["prepare_time"] += prepare_time
+
+
+def pop_stats():
+    """前回呼び出してからのモデルの読み込み時間、超解像した画像の数、推論時間、アイコンの準備時間を返す"""
+    global stats  # noqa: PLW0603
+
+    ret = stats
+    stats = {"load_time": 0.0, "count": 0, "time": 0.0, "prepare_time": 0.0}
+
+    return ret
+
+
+def clear():
+    global upsampler  # noqa: PLW0603
+
+    with upsampler_lock:
+        upsampler = None
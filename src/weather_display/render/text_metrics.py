@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+PIL で描画するパネルの、テキストの寸法の計測結果をキャッシュします。
+
+レイアウトでは同じフォントと文字列 ("0" の高さなど) を何度も計測するので、フォントと文字列を
+キーにして my_lib.pil_util.text_size() の結果を保持します。フォントはパネルの描画ごとに
+読み込み直される場合があるので、オブジェクトではなくフォントファイルとサイズで区別します。
+キャッシュはプロセスごとに持つので、常駐しているワーカーの中で効果があります。
+"""
+
+import os
+
+import my_lib.pil_util
+
+# NOTE: 時刻などの文字列は種類が増え続けるので、この数を超えたら作り直す
+SIZE_CACHE_MAX = 4096
+
+size_cache = {}
+
+
+def get_font_key(font):
+    path = getattr(font, "path", None)
+    if not isinstance(path, str | os.PathLike):
+        # NOTE: ファイルから読み込んだフォントでなければ区別できないので、キャッシュしない
+        return None
+
+    return (os.fspath(path), font.size, font.index, font.layout_engine)
+
+
+def text_size(img, font, text):
+    """my_lib.pil_util.text_size() と同じく、テキストの幅と高さを返す"""
+    font_key = get_font_key(font)
+    if font_key is None:
+        return tuple(my_lib.pil_util.text_size(img, font, text))
+
+    # NOTE: 描画先のモードによってアンチエイリアスの有無が変わるので、キーに含める
+    key = (img.mode, *font_key, text)
+
+    size = size_cache.get(key)
+    if size is not None:
+        return size
+
+    if len(size_cache) >= SIZE_CACHE_MAX:
+        size_cache.clear()
+
+    size = tuple(my_lib.pil_util.text_size(img, font, text))
+    size_cache[key] = size
+
+    return size
+
+
+def clear():
+    size_cache.clear()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+縁取り (stroke) 付きで描画する数値などのテキストを、描画済みのマスクを使い回して描画します。
+
+PIL のテキスト描画は、フォントのマスク (FreeTypeFont.getmask2) を作ってから描画先に色を塗ります。
+縁取りを付けた大きな文字のマスクの作成は重いので、get_font() で包んだフォントでは、作成した
+マスクをフォント、サイズ、縁取りの幅、色、テキストをキーにして保持します。
+数字と記号だけのテキスト (時刻や測定値) は、文字ごとのマスク (スプライト) を文字送りとカーニングに
+従って並べて合成するので、初めて現れる組み合わせでも、文字ごとのマスクは一度だけ作成します。
+縁取りが隣の文字と重なる部分は、文字ごとのマスクの最大値とするので、テキスト全体から作成した
+マスクとはアンチエイリアスの画素値がわずかに異なる場合があります。
+"""
+
+import inspect
+import math
+
+import PIL.Image
+import PIL.ImageFont
+
+import weather_display.render.text_metrics
+
+# NOTE: 文字ごとのマスクを合成して描画する文字
+SPRITE_CHARS = frozenset("0123456789.:-")
+
+# NOTE: テキスト全体のマスクは種類が増え続けるので、この数を超えたら作り直す
+MASK_CACHE_MAX = 1024
+
+GETMASK2_SIGNATURE = inspect.signature(PIL.ImageFont.FreeTypeFont.getmask2)
+
+font_map = {}
+
+
+def to_hashable(value):
+    if isinstance(value, list | tuple):
+        return tuple(to_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((name, to_hashable(item)) for name, item in value.items()))
+
+    return value
+
+
+class SpriteFont(PIL.ImageFont.FreeTypeFont):
+    def __init__(self, font):
+        """初期化.
+
+        Args:
+            font: 包むフォント (読み込み済みのものをそのまま使う)
+
+        """
+        self.__dict__.update(font.__dict__)
+        self.mask_cache = {}
+        self.sprite_cache = {}
+
+    def getmask2(self, text, mode="", *args, **kwargs):
+        # NOTE: RGBA (カラー絵文字) の場合は、描画時にマスクが書き換えられるので使い回さない
+        if mode == "RGBA":
+            return super().getmask2(text, mode, *args, **kwargs)
+
+        # NOTE: 縁取りの幅や色 (ink) は、引数としてキーに含まれる
+        key = (text, mode, to_hashable(args), to_hashable(kwargs))
+        mask = self.mask_cache.get(key)
+        if mask is not None:
+            return mask
+
+        arg = GETMASK2_SIGNATURE.bind(self, text, mode, *args, **kwargs)
+        arg.apply_defaults()
+        option = dict(arg.arguments)
+        del option["self"]
+
+        mask = self.compose(option) if self.is_composable(option) else self.render(option)
+
+        if len(self.mask_cache) >= MASK_CACHE_MAX:
+            self.mask_cache.clear()
+        self.mask_cache[key] = mask
+
+        return mask
+
+    def is_composable(self, option):
+        return (
+            (option["mode"] == "L")
+            and (len(option["text"]) > 1)
+            and all(char in SPRITE_CHARS for char in option["text"])
+            and (option["direction"] is None)
+            and (option["features"] is None)
+            and (option["language"] is None)
+            and (option["anchor"] in [None, "la"])
+        )
+
+    def render(self, option):
+        return super().getmask2(
+            option["text"],
+            option["mode"],
+            option["direction"],
+            option["features"],
+            option["language"],
+            option["stroke_width"],
+            option["anchor"],
+            option["ink"],
+            option["start"],
+            *option["args"],
+            **option["kwargs"],
+        )
+
+    def get_sprite(self, option, char, start):
+        sprite_option = dict(option, text=char, start=start)
+
+        key = to_hashable(sprite_option)
+        sprite = self.sprite_cache.get(key)
+        if sprite is None:
+            sprite = self.render(sprite_option)
+            self.sprite_cache[key] = sprite
+
+        return sprite
+
+    def compose(self, option):
+        """文字ごとのマスクを、文字送りとカーニングに従って並べたマスクを返す"""
+        text = option["text"]
+        start_x, start_y = (0.0, 0.0) if option["start"] is None else option["start"]
+
+        part_list = []
+        for i, char in enumerate(text):
+            # NOTE: 先頭からこの文字までの文字送りからこの文字の分を引いて、直前の文字との
+            # カーニングも含めた位置を決める
+            advance = self.getlength(text[: i + 1], option["mode"]) - self.getlength(char, option["mode"])
+            frac_x, int_x = math.modf(start_x + advance)
+
+            mask, (offset_x, offset_y) = self.get_sprite(option, char, (frac_x, start_y))
+            part_list.append((mask, int(int_x) + offset_x, offset_y))
+
+        left = min(x for _, x, _ in part_list)
+        top = min(y for _, _, y in part_list)
+        right = max(x + mask.size[0] for mask, x, _ in part_list)
+        bottom = max(y + mask.size[1] for mask, _, y in part_list)
+        size = (right - left, bottom - top)
+
+        # NOTE: getmask2 と同じく、PIL の内部の画像 (ImagingCore) として合成する
+        canvas = PIL.Image.core.fill("L", size, 0)
+        for mask, x, y in part_list:
+            box = (x - left, y - top, x - left + mask.size[0], y - top + mask.size[1])
+            canvas.paste(canvas.crop(box).chop_lighter(mask), box)
+
+        return canvas, (left, top)
+
+
+def get_font(font):
+    """マスクを使い回すように包んだフォントを返す。同じフォントとサイズには同じものを返す"""
+    key = weather_display.render.text_metrics.get_font_key(font)
+    if (key is None) or not isinstance(font, PIL.ImageFont.FreeTypeFont):
+        return font
+
+    sprite_font = font_map.get(key)
+    if sprite_font is None:
+        sprite_font = SpriteFont(font)
+        font_map[key] = sprite_font
+
+    return sprite_font
+
+
+def clear():
+    font_map.clear()
@@ -1,10 +1,8 @@
 #!/usr/bin/env python3
 
 import concurrent.futures
-import io
 import logging
 import queue
-import subprocess
 import threading
 import time
 import traceback
@@ -14,20 +12,23 @@ import flask
 import my_lib.flask_util
 import my_lib.webapp.config
 
+import weather_display.render.client
+
 blueprint = flask.Blueprint("webapp-run", __name__, url_prefix=my_lib.webapp.config.URL_PREFIX)
 
 thread_pool = None
 panel_data_map = {}
-create_image_path = None
+render_client = None
 
 
-def init(create_image_path_):
+def init(render_socket_path=weather_display.render.client.DEFAULT_SOCKET_PATH):
     global thread_pool  # noqa: PLW0603
-    global create_image_path  # noqa: PLW0603
+    global render_client  # noqa: PLW0603
 
     # ThreadPoolExecutorに変更してより効率的な非同期処理を実現
     thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=3, thread_name_prefix="image_gen")
-    create_image_path = create_image_path_
+    # NOTE: 画像生成は常駐サーバに依頼し、import や設定ファイルの読み込みを毎回行わないようにする
+    render_client = weather_display.render.client.RenderClient(render_socket_path)
 
 
 def term():
@@ -36,95 +37,25 @@ def term():
     if thread_pool:
         thread_pool.shutdown(wait=True)
 
-
-def image_reader(proc, token):
-    global panel_data_map
-    panel_data = panel_data_map[token]
-    img_stream = io.BytesIO()
-
-    try:
-        while True:
-            state = proc.poll()
-            if state is not None:
-                # プロセス終了後の残りデータを読み取り
-                remaining = proc.stdout.read()
-                if remaining:
-                    img_stream.write(remaining)
-                break
-            try:
-                buf = proc.stdout.read(8192)
-                if buf:
-                    img_stream.write(buf)
-                else:
-                    time.sleep(0.1)
-            except OSError:
-                # パイプが閉じられた場合
-                break
-        panel_data["image"] = img_stream.getvalue()
-    except Exception:
-        logging.exception("Failed to generate image")
-
-
-def log_reader(proc, token):
-    global panel_data_map
-
-    panel_data = panel_data_map[token]
-
-    try:
-        while True:
-            line = proc.stderr.readline()
-            if not line:
-                break
-            panel_data["log"].put(line)
-    except Exception:
-        logging.exception("Failed to read log")
+    if render_client:
+        render_client.close()
 
 
 def generate_image_impl(config_file, is_small_mode, is_dummy_mode, is_test_mode, token):
     global panel_data_map
 
     panel_data = panel_data_map[token]
-    cmd = ["python3", create_image_path, "-c", config_file]
-    if is_small_mode:
-        cmd.append("-s")
-    if is_dummy_mode:
-        cmd.append("-d")
-    if is_test_mode:
-        cmd.append("-t")
 
     try:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)  # noqa: S603
-
-        # 非同期でstdoutとstderrを読み取り
-        stdout_thread = threading.Thread(target=image_reader, args=(proc, token))
-        stderr_thread = threading.Thread(target=log_reader, args=(proc, token))
-
-        stdout_thread.start()
-        stderr_thread.start()
-
-        # プロセス終了を非ブロッキングで監視
-        while proc.poll() is None:
-            time.sleep(0.1)
-
-        # プロセス終了を待機（タイムアウト付き）
-        try:
-            proc.wait(timeout=120)
-        except subprocess.TimeoutExpired:
-            logging.warning("Subprocess timed out, terminating")
-            proc.terminate()
-            try:
-                proc.wait(timeout=10)
-            except subprocess.TimeoutExpired:
-                proc.kill()
-
-        # スレッドの終了を待機（タイムアウト付き）
-        stdout_thread.join(timeout=30)
-        stderr_thread.join(timeout=30)
-
-        # NOTE: None を積むことで、実行完了を通知
-        panel_data["log"].put(None)
+        result = render_client.render(
+            config_file, is_small_mode, is_dummy_mode, is_test_mode, log_queue=panel_data["log"]
+        )
+        panel_data["image"] = result["image"]
     except Exception:
-        logging.exception("Failed to execute subprocess")
+        logging.exception("Failed to generate image")
+        panel_data["log"].put(traceback.format_exc().encode("utf-8"))
+    finally:
+        # NOTE: None を積むことで、実行完了を通知
         panel_data["log"].put(None)
 
 
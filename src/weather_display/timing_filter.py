@@ -1,5 +1,8 @@
 """実行時間の変動を平滑化するための簡易カルマンフィルタ実装"""
 
+import datetime
+import math
+
 
 class TimingKalmanFilter:
     """実行時間推定用の1次元カルマンフィルタ"""
@@ -51,18 +54,30 @@ class TimingKalmanFilter:
 class TimingController:
     """実行タイミング制御クラス"""
 
-    def __init__(self, update_interval=60, target_second=0):
+    def __init__(self, update_interval=60, target_second=0, render_margin=2.0):
         """初期化.
 
         Args:
             update_interval: 更新間隔（秒）
             target_second: 目標とする秒（0-59）
+            render_margin: 描画を前倒しする際に、推定描画時間に加える余裕（秒）
 
         """
         self.update_interval = update_interval
         self.target_second = target_second
+        self.render_margin = render_margin
         self.kalman_filter = TimingKalmanFilter()
 
+    def calculate_diff_sec(self, current_datetime):
+        """目標とする秒からのずれ（-30〜30秒）を計算"""
+        diff_sec = current_datetime.second - self.target_second
+        if diff_sec > 30:
+            diff_sec = diff_sec - 60
+        elif diff_sec < -30:
+            diff_sec = diff_sec + 60
+
+        return diff_sec
+
     def calculate_sleep_time(self, elapsed_time, current_datetime):
         """次の実行までのスリープ時間を計算.
 
@@ -81,11 +96,7 @@ class TimingController:
         current_second = current_datetime.second
 
         # 目標時刻からのずれを計算
-        diff_sec = current_second - self.target_second
-        if diff_sec > 30:
-            diff_sec = diff_sec - 60
-        elif diff_sec < -30:
-            diff_sec = diff_sec + 60
+        diff_sec = self.calculate_diff_sec(current_datetime)
 
         # 次の目標時刻までの時間を計算
         # 推定実行時間を考慮してスリープ時間を決定
@@ -100,3 +111,40 @@ class TimingController:
             sleep_time += self.update_interval
 
         return sleep_time, diff_sec
+
+    def schedule_render(self, current_datetime):
+        """描画を前倒しする場合の、描画開始までの待ち時間と表示時刻を計算.
+
+        推定描画時間（と余裕）だけ目標時刻より前に描画を始めることで、目標時刻の直前に描画を終え、
+        目標時刻ちょうどに表示を切り替えられるようにする。
+
+        Args:
+            current_datetime: 現在時刻（timezone aware）
+
+        Returns:
+            tuple: (start_delay, display_datetime)
+
+        """
+        lead_time = self.kalman_filter.get_estimate() + self.render_margin
+        now = current_datetime.timestamp()
+
+        # 今から描画を始めて間に合う、最も早い目標時刻
+        display_time = (
+            math.ceil((now + lead_time - self.target_second) / self.update_interval) * self.update_interval
+            + self.target_second
+        )
+        start_delay = max(display_time - lead_time - now, 0)
+
+        return start_delay, datetime.datetime.fromtimestamp(display_time, current_datetime.tzinfo)
+
+    def update_render_time(self, render_time):
+        """描画にかかった時間で推定描画時間を更新.
+
+        Args:
+            render_time: 実測された描画時間（秒）
+
+        Returns:
+            更新された推定値
+
+        """
+        return self.kalman_filter.update(render_time)
@@ -3,12 +3,13 @@
 電子ペーパ表示用の画像を表示する簡易的な Web サーバです。
 
 Usage:
-  webapp.py [-c CONFIG] [-s CONFIG] [-p PORT] [-d] [-D]
+  webapp.py [-c CONFIG] [-s CONFIG] [-p PORT] [-R SOCKET] [-d] [-D]
 
 Options:
   -c CONFIG         : 通常モードで使う設定ファイルを指定します。[default: config.yaml]
   -s CONFIG         : 小型ディスプレイモード使う設定ファイルを指定します。[default: config-small.yaml]
   -p PORT           : WEB サーバのポートを指定します。[default: 5000]
+  -R SOCKET         : 画像生成サーバの Unix ソケットのパスを指定します。[default: data/render.sock]
   -d                : ダミーモードで実行します。
   -D                : デバッグモードで動作します。
 """
@@ -26,6 +27,7 @@ import my_lib.logger
 import my_lib.webapp.base
 
 import weather_display.metrics.webapi.page
+import weather_display.render.client
 import weather_display.runner.webapi.run
 
 SCHEMA_CONFIG = "config.schema"
@@ -51,7 +53,12 @@ def sig_handler(num, frame):  # noqa: ARG001
         term()
 
 
-def create_app(config_file_normal, config_file_small, dummy_mode=False):
+def create_app(
+    config_file_normal,
+    config_file_small,
+    dummy_mode=False,
+    render_socket=weather_display.render.client.DEFAULT_SOCKET_PATH,
+):
     # # NOTE: アクセスログは無効にする
     # logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
@@ -68,7 +75,7 @@ def create_app(config_file_normal, config_file_small, dummy_mode=False):
         else:  # pragma: no cover
             pass
 
-        weather_display.runner.webapi.run.init(pathlib.Path(__file__).parent / "create_image.py")
+        weather_display.runner.webapi.run.init(render_socket)
 
         def notify_terminate():  # pragma: no cover
             weather_display.runner.webapi.run.term()
@@ -107,12 +114,13 @@ if __name__ == "__main__":
     config_file_normal = args["-c"]
     config_file_small = args["-s"]
     port = args["-p"]
+    render_socket = args["-R"]
     dummy_mode = args["-d"]
     debug_mode = args["-D"]
 
     my_lib.logger.init("panel.e-ink.weather", level=logging.DEBUG if debug_mode else logging.INFO)
 
-    app = create_app(config_file_normal, config_file_small, dummy_mode)
+    app = create_app(config_file_normal, config_file_small, dummy_mode, render_socket)
 
     signal.signal(signal.SIGTERM, sig_handler)
 
@@ -256,6 +256,113 @@ def test_create_image(request, mocker, config):
     check_notify_slack(None)
 
 
+def test_create_image_worker_pool(request, mocker, config):
+    import create_image
+    import weather_display.render.pool
+
+    mock_sensor_fetch_data(mocker)
+
+    # NOTE: 毎回ワーカーを作り直す設定にして、作り直しの処理も確認する
+    worker_pool = weather_display.render.pool.init(max_tasks=1)
+    try:
+        for i in range(2):
+            check_image(
+                request,
+                create_image.create_image(config)[0],
+                config["panel"]["device"],
+                i,
+            )
+    finally:
+        weather_display.render.pool.term()
+
+    assert worker_pool.worker_map == {}
+    assert weather_display.render.pool.get() is None
+
+    check_notify_slack(None)
+
+
+def test_render_pool_dummy_mode(monkeypatch):
+    import os
+
+    import weather_display.render.pool
+
+    worker_pool = weather_display.render.pool.PanelWorkerPool()
+    try:
+        worker_pool.warmup()
+
+        # NOTE: ワーカーを起動した後に切り替えたダミーモードが、ワーカーの中に反映される
+        for dummy_mode in ["true", None, "true"]:
+            if dummy_mode is None:
+                monkeypatch.delenv("DUMMY_MODE", raising=False)
+            else:
+                monkeypatch.setenv("DUMMY_MODE", dummy_mode)
+
+            task_info = worker_pool.submit("sensor", os.getenv, ("DUMMY_MODE",)).get(timeout=30)
+            assert task_info["result"] == dummy_mode
+    finally:
+        worker_pool.term()
+
+
+def test_render_log_relay():
+    import queue
+    import threading
+
+    import weather_display.render.log_relay
+    import weather_display.render.pool
+    import weather_display.render.service
+
+    log_queue = queue.Queue()
+    handler = weather_display.render.service.LogCapture(log_queue)
+    logging.getLogger().addHandler(handler)
+    weather_display.render.log_relay.start(handler)
+
+    def log_thread(is_added):
+        if is_added:
+            weather_display.render.log_relay.call(logging.warning, "thread: %s", is_added)
+        else:
+            logging.warning("thread: %s", is_added)
+
+    worker_pool = weather_display.render.pool.PanelWorkerPool()
+    try:
+        task_info = worker_pool.submit("sensor", logging.warning, ("panel worker: %s", "rain")).get(
+            timeout=30
+        )
+        weather_display.render.log_relay.forward(task_info["log"])
+
+        for is_added in [True, False]:
+            thread = threading.Thread(target=log_thread, args=(is_added,))
+            thread.start()
+            thread.join()
+    finally:
+        worker_pool.term()
+        weather_display.render.log_relay.stop()
+        logging.getLogger().removeHandler(handler)
+
+    # NOTE: パネル描画プロセスと、描画のために起動したスレッドのログだけが届く
+    log = b"".join(log_queue.queue).decode()
+    assert "panel worker: rain" in log
+    assert "thread: True" in log
+    assert "thread: False" not in log
+
+
+def test_create_image_wait_context():
+    import concurrent.futures
+    import threading
+    import time
+
+    import create_image
+
+    event = threading.Event()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(lambda: event.wait() and {"weather": "WEATHER"})
+
+        # NOTE: 締め切りを過ぎていれば、取得を待たずに空のデータを返す
+        assert create_image.wait_context(future, time.perf_counter() - 1) == {}
+
+        event.set()
+        assert create_image.wait_context(future, None) == {"weather": "WEATHER"}
+
+
 def test_create_image_small(request, config, mocker):
     import create_image
 
@@ -375,6 +482,99 @@ def test_weather_panel_dummy(mocker, request, config):
     check_notify_slack(None)
 
 
+def test_weather_icon_cache(mocker, tmp_path):
+    import io
+
+    import PIL.Image
+
+    import weather_display.panel.weather
+
+    buf = io.BytesIO()
+    PIL.Image.new("RGBA", (24, 24), (64, 128, 192, 255)).save(buf, "PNG")
+    mocker.patch("urllib.request.urlopen", side_effect=lambda url: io.BytesIO(buf.getvalue()))  # noqa: ARG005
+
+    mocker.patch("weather_display.panel.weather.ICON_CACHE_DIR", tmp_path)
+    mocker.patch("weather_display.panel.weather.dump_icon")
+    mocker.patch.dict("weather_display.panel.weather.icon_cache", clear=True)
+    process_icon_mock = mocker.patch(
+        "weather_display.panel.weather.process_icon_list",
+        wraps=weather_display.panel.weather.process_icon_list,
+    )
+
+    weather_info = {"icon_url": "https://example.com/icon/sunny.png", "text": "晴れ"}
+
+    # NOTE: 超解像などの加工は、新しいアイコンが現れた時だけ行う
+    icon = weather_display.panel.weather.get_image(weather_info)
+    assert weather_display.panel.weather.get_image(weather_info) is icon
+    assert process_icon_mock.call_count == 1
+
+    # NOTE: プロセスを起動し直しても、ファイルにキャッシュした結果を使う
+    weather_display.panel.weather.icon_cache.clear()
+    cached_icon = weather_display.panel.weather.get_image(weather_info)
+    assert process_icon_mock.call_count == 1
+    assert cached_icon.mode == "LA"
+    assert cached_icon.tobytes() == icon.tobytes()
+
+
+def test_weather_icon_upsample(mocker, tmp_path):
+    import io
+
+    import cv2
+    import PIL.Image
+
+    import weather_display.panel.weather
+    import weather_display.render.super_resolution
+
+    def urlopen(url):
+        # NOTE: URL ごとに異なる色のアイコンを返す
+        buf = io.BytesIO()
+        PIL.Image.new("RGBA", (24, 24), (len(url), 128, 192, 255)).save(buf, "PNG")
+        buf.seek(0)
+        return buf
+
+    mocker.patch("urllib.request.urlopen", side_effect=urlopen)
+    mocker.patch("weather_display.panel.weather.ICON_CACHE_DIR", tmp_path)
+    mocker.patch("weather_display.panel.weather.dump_icon")
+    mocker.patch.dict("weather_display.panel.weather.icon_cache", clear=True)
+
+    weather_display.render.super_resolution.clear()
+    weather_display.render.super_resolution.pop_stats()
+    create_mock = mocker.patch(
+        "cv2.dnn_superres.DnnSuperResImpl_create", wraps=cv2.dnn_superres.DnnSuperResImpl_create
+    )
+
+    weather_info_list = [
+        {"icon_url": f"https://example.com/icon/{name}.png", "text": name} for name in ["a", "bb", "a", "ccc"]
+    ]
+    weather_display.panel.weather.prepare_icon(weather_info_list)
+    weather_display.panel.weather.prepare_icon(weather_info_list)
+    weather_display.panel.weather.get_image({"icon_url": "https://example.com/icon/dddd.png", "text": "d"})
+
+    # NOTE: モデルの読み込みは一度だけで、キャッシュに無いアイコンだけをまとめて超解像する
+    assert create_mock.call_count == 1
+    stats = weather_display.render.super_resolution.pop_stats()
+    assert stats["count"] == 4
+    assert stats["load_time"] > 0
+    assert stats["time"] > 0
+    assert len(weather_display.panel.weather.icon_cache) == 4
+
+    # NOTE: 取得は並列に行うが、結果はアイコンごとに正しく対応付ける
+    for name in ["a", "bb", "ccc", "dddd"]:
+        weather_info = {"icon_url": f"https://example.com/icon/{name}.png", "text": name}
+        expected = weather_display.panel.weather.process_icon_list(
+            [weather_display.panel.weather.fetch_icon(weather_info)],
+            weather_display.panel.weather.ICON_TONE,
+            weather_display.panel.weather.ICON_GAMMA,
+            weather_display.panel.weather.ICON_SCALE,
+        )[0]
+        icon = weather_display.panel.weather.icon_cache[
+            weather_display.panel.weather.get_icon_key(weather_info)
+        ]
+        assert icon.tobytes() == expected.tobytes()
+
+    weather_display.render.super_resolution.clear()
+
+
 ######################################################################
 def test_wbgt_panel(request, config):
     import weather_display.panel.wbgt
@@ -405,6 +605,43 @@ def test_wbgt_panel_var(mocker, request, config):
     check_notify_slack(None)
 
 
+def test_wbgt_panel_cache(mocker, request, config):
+    import weather_display.panel.wbgt
+    import weather_display.render.bitmap_cache
+
+    mocker.patch("weather_display.panel.wbgt.get_wbgt", return_value=gen_wbgt_info())
+
+    weather_display.render.bitmap_cache.clear()
+    weather_display.render.bitmap_cache.pop_stats()
+
+    img_list = [weather_display.panel.wbgt.create(config)[0] for _ in range(2)]
+
+    # NOTE: 2 回目は入力が変わっていないので、キャッシュした画像が返る
+    assert weather_display.render.bitmap_cache.pop_stats() == {"hit": 1, "miss": 1}
+    assert img_list[0].tobytes() == img_list[1].tobytes()
+
+    check_image(request, img_list[1], config["wbgt"]["panel"])
+
+
+def test_wbgt_panel_context(mocker, request, config):
+    import weather_display.panel.wbgt
+    import weather_display.render.frame_context
+
+    get_wbgt_mock = mocker.patch("my_lib.weather.get_wbgt", return_value=gen_wbgt_info())
+    context = weather_display.render.frame_context.prefetch(config, ["wbgt"])
+    assert get_wbgt_mock.call_count == 1
+
+    # NOTE: 取得済みの値があれば、パネル側では取得しない
+    mocker.patch("weather_display.panel.wbgt.get_wbgt", side_effect=RuntimeError())
+    ret = weather_display.panel.wbgt.create(config, True, context)
+    check_image(request, ret[0], config["wbgt"]["panel"])
+    assert len(ret) == 2
+
+    # NOTE: 取得に失敗した場合は、コンテキストに含めない
+    mocker.patch("my_lib.weather.get_wbgt", side_effect=RuntimeError())
+    assert weather_display.render.frame_context.prefetch(config, ["wbgt"]) == {}
+
+
 def test_wbgt_panel_error_1(time_machine, mocker, request, config):
     import weather_display.panel.wbgt
 
@@ -442,9 +679,47 @@ def test_time_panel(request, config):
         config["time"]["panel"],
     )
 
+    # NOTE: 表示される時刻が指定された場合はそれを描画する
+    check_image(
+        request,
+        weather_display.panel.time.create(
+            config, datetime.datetime(2026, 1, 1, 12, 34, tzinfo=zoneinfo.ZoneInfo("Asia/Tokyo")).timestamp()
+        )[0],
+        config["time"]["panel"],
+        1,
+    )
+
     check_notify_slack(None)
 
 
+def test_timing_render_ahead():
+    import weather_display.timing_filter
+
+    timezone = zoneinfo.ZoneInfo("Asia/Tokyo")
+    timing_controller = weather_display.timing_filter.TimingController(update_interval=60, target_second=0)
+
+    for _ in range(20):
+        timing_controller.update_render_time(10)
+    estimate = timing_controller.kalman_filter.get_estimate()
+
+    # NOTE: 推定描画時間だけ前倒しして描画を始め、次の分の 0 秒に表示する
+    start_delay, display_datetime = timing_controller.schedule_render(
+        datetime.datetime(2026, 1, 1, 12, 0, 5, tzinfo=timezone)
+    )
+    assert display_datetime == datetime.datetime(2026, 1, 1, 12, 1, 0, tzinfo=timezone)
+    assert start_delay == pytest.approx(55 - estimate - timing_controller.render_margin)
+
+    # NOTE: 間に合わない場合は、その次の分に表示する
+    start_delay, display_datetime = timing_controller.schedule_render(
+        datetime.datetime(2026, 1, 1, 12, 0, 55, tzinfo=timezone)
+    )
+    assert display_datetime == datetime.datetime(2026, 1, 1, 12, 2, 0, tzinfo=timezone)
+    assert start_delay == pytest.approx(65 - estimate - timing_controller.render_margin)
+
+    diff_sec = timing_controller.calculate_diff_sec(datetime.datetime(2026, 1, 1, 12, 0, 58, tzinfo=timezone))
+    assert diff_sec == -2
+
+
 ######################################################################
 def test_create_power_graph(mocker, request, config):
     import weather_display.panel.power_graph
@@ -503,8 +778,12 @@ def test_create_power_graph_error(mocker, request, config):
 ######################################################################
 def test_create_sensor_graph_1(time_machine, mocker, request, config):
     import weather_display.panel.sensor_graph
+    import weather_display.render.bitmap_cache
 
     mock_sensor_fetch_data(mocker)
+    make_key_mock = mocker.patch(
+        "weather_display.render.bitmap_cache.make_key", wraps=weather_display.render.bitmap_cache.make_key
+    )
 
     time_machine.move_to(datetime.datetime.now(TIMEZONE).replace(hour=12))
 
@@ -524,6 +803,9 @@ def test_create_sensor_graph_1(time_machine, mocker, request, config):
         1,
     )
 
+    # NOTE: 照明のアイコンは夜だけ描画するので、昼と夜で画像のキャッシュのキーが変わる
+    assert [call.args[2] for call in make_key_mock.call_args_list] == [True, False]
+
     check_notify_slack(None)
 
 
@@ -776,6 +1058,56 @@ def test_create_rain_cloud_panel_xpath_error(mocker, request, config):
     check_notify_slack(None)
 
 
+def test_rain_fall_raining_start(time_machine, mocker, config, tmp_path):
+    import multiprocessing
+
+    import weather_display.panel.rain_fall
+
+    time_machine.move_to(datetime.datetime.now(TIMEZONE), tick=False)
+
+    start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=30)
+    get_last_event_mock = mocker.patch("my_lib.sensor_data.get_last_event", return_value=start)
+    mocker.patch(
+        "weather_display.panel.rain_fall.RAINING_START_CACHE_FILE", tmp_path / "raining_start_cache.dat"
+    )
+
+    db_config = config["influxdb"]
+    sensor_config = config["rain_fall"]["sensor"]
+    interval = config["panel"]["update"]["interval"]
+
+    def get_raining_start(raining_status):
+        return weather_display.panel.rain_fall.get_raining_start(
+            db_config, sensor_config, raining_status, interval
+        )
+
+    # NOTE: 降り続いている間は、降り始めの時刻を問い合わせ直さない
+    for _ in range(3):
+        assert get_raining_start(True) == start
+        time_machine.shift(interval)
+    assert get_last_event_mock.call_count == 1
+
+    # NOTE: 別のワーカーで雨が止んだことを見た場合も、次に降り出した時は問い合わせ直す
+    process = multiprocessing.get_context("fork").Process(target=get_raining_start, args=(False,))
+    process.start()
+    process.join()
+
+    new_start = start + datetime.timedelta(minutes=20)
+    get_last_event_mock.return_value = new_start
+    assert get_raining_start(True) == new_start
+    assert get_last_event_mock.call_count == 2
+
+    assert get_raining_start(False) is None
+    get_raining_start(True)
+    assert get_last_event_mock.call_count == 3
+
+    # NOTE: 誰も見ていない間に雨が止んで降り直した場合は、前の降り始めの時刻を使い続けない
+    time_machine.shift(interval * 3)
+    restart = new_start + datetime.timedelta(hours=2)
+    get_last_event_mock.return_value = restart
+    assert get_raining_start(True) == restart
+    assert get_last_event_mock.call_count == 4
+
+
 ######################################################################
 def test_slack_error(mocker, request, config):
     import slack_sdk
@@ -1041,6 +1373,778 @@ def test_api_run_normal(mocker):
     client.delete()
 
 
+######################################################################
+def test_render_server(mocker, tmp_path, config):
+    import io
+    import queue
+
+    import PIL.Image
+
+    import weather_display.render.client
+    import weather_display.render.server
+
+    socket_path = tmp_path / "render.sock"
+    handle = weather_display.render.server.start(socket_path)
+
+    try:
+        client = weather_display.render.client.RenderClient(socket_path, spawn=False)
+        log_queue = queue.Queue()
+
+        # NOTE: 2回目は設定ファイルの読み込みが省略される
+        for _ in range(2):
+            result = client.render(CONFIG_FILE, test_mode=True, log_queue=log_queue)
+
+            assert result["status"] == 0
+            assert result["latency"] >= result["elapsed"]
+            assert PIL.Image.open(io.BytesIO(result["image"])).size == (
+                config["panel"]["device"]["width"],
+                config["panel"]["device"]["height"],
+            )
+
+        # NOTE: パネル描画プロセスのログも届く
+        assert b"draw power graph" in b"".join(log_queue.queue)
+
+        # NOTE: 書き込み先を指定すると、画像は分割して届いたそばから書き込まれる
+        output = mocker.MagicMock()
+        result = client.render(CONFIG_FILE, test_mode=True, output=output)
+
+        assert output.write.call_count > 1
+        assert b"".join(call.args[0] for call in output.write.call_args_list) == result["image"]
+        assert result["sent_bytes"] == len(result["image"])
+        assert result["first_byte"] is not None
+    finally:
+        weather_display.render.server.term(handle)
+
+    assert not socket_path.exists()
+
+
+def test_render_client_spawn_once(mocker, tmp_path):
+    import concurrent.futures
+    import time
+
+    import weather_display.render.client
+
+    state = {"started": False}
+
+    def popen(*args, **kwargs):  # noqa: ARG001
+        time.sleep(0.2)
+        state["started"] = True
+        return mocker.MagicMock(poll=mocker.MagicMock(return_value=None))
+
+    popen_mock = mocker.patch("subprocess.Popen", side_effect=popen)
+    mocker.patch("weather_display.render.server.is_alive", side_effect=lambda path: state["started"])  # noqa: ARG005
+
+    client = weather_display.render.client.RenderClient(tmp_path / "render.sock")
+
+    # NOTE: 複数のスレッドから同時に呼ばれても、サーバは 1 つだけ起動する
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        for future in [executor.submit(client.ensure_server) for _ in range(3)]:
+            future.result()
+
+    assert popen_mock.call_count == 1
+
+
+def test_framebuffer_damage(tmp_path):
+    import io
+
+    import numpy as np
+    import PIL.Image
+    import PIL.ImageDraw
+
+    import weather_display.framebuffer.damage
+    import weather_display.framebuffer.receiver
+
+    width, height = 320, 180
+
+    img = PIL.Image.new("L", (width, height), 255)
+    prev_frame = np.asarray(img).copy()
+
+    PIL.ImageDraw.Draw(img).rectangle((10, 20, 40, 30), fill=0)
+    PIL.ImageDraw.Draw(img).rectangle((200, 150, 210, 170), fill=128)
+    frame = np.asarray(img).copy()
+
+    rect_list = weather_display.framebuffer.damage.find_damage(prev_frame, frame)
+    assert rect_list == [(10, 20, 31, 11), (200, 150, 11, 21)]
+    assert weather_display.framebuffer.damage.find_damage(None, frame) == [(0, 0, width, height)]
+
+    # NOTE: 通常のファイルを擬似的なフレームバッファとして書き込む
+    fb_path = tmp_path / "fb"
+    fb_info = weather_display.framebuffer.receiver.get_fb_info(fb_path, width, height, 32)
+    fb_path.write_bytes(b"\xff" * (width * height * 4))
+
+    payload = weather_display.framebuffer.damage.encode(frame, rect_list)
+    with fb_path.open("r+b") as fb:
+        assert weather_display.framebuffer.receiver.apply(io.BytesIO(payload), fb, fb_info) == 2
+
+    fb_data = np.frombuffer(fb_path.read_bytes(), dtype=np.uint8).reshape(height, width, 4)
+    assert (fb_data[:, :, 0] == frame).all()
+    assert len(payload) < (width * height) / 10
+
+
+def test_framebuffer_receiver_geometry(mocker, tmp_path):
+    import io
+
+    import numpy as np
+    import PIL.Image
+
+    import weather_display.framebuffer.frame_format
+    import weather_display.framebuffer.receiver
+
+    width, height = 320, 180
+    frame = np.arange(width * height, dtype=np.uint32).astype(np.uint8).reshape(height, width)
+
+    # NOTE: ダブルバッファリングで仮想画面の下半分を表示している場合は、表示中の解像度と位置に書き込む
+    mocker.patch(
+        "weather_display.framebuffer.receiver.get_var_screen_info",
+        return_value=(width, height, width, height * 2, 0, height, 8),
+    )
+    fb_path = tmp_path / "fb"
+    fb_path.write_bytes(b"\x00" * (width * height * 2))
+    fb_info = weather_display.framebuffer.receiver.get_fb_info(fb_path)
+    assert fb_info == {"width": width, "height": height, "bpp": 8, "stride": width, "offset": width * height}
+
+    convert_mock = mocker.spy(weather_display.framebuffer.receiver, "convert_line")
+    data = weather_display.framebuffer.frame_format.encode_gray(
+        PIL.Image.fromarray(frame), weather_display.framebuffer.frame_format.FORMAT_GRAY8
+    )
+    with fb_path.open("r+b") as fb:
+        weather_display.framebuffer.receiver.apply(io.BytesIO(data), fb, fb_info)
+
+    # NOTE: 行の間に隙間が無いので、まとめて 1 回で書き込む
+    assert convert_mock.call_count == 1
+    fb_data = np.frombuffer(fb_path.read_bytes(), dtype=np.uint8).reshape(height * 2, width)
+    assert (fb_data[:height] == 0).all()
+    assert (fb_data[height:] == frame).all()
+
+
+def test_framebuffer_frame_format(tmp_path):
+    import io
+
+    import numpy as np
+    import PIL.Image
+    import PIL.ImageDraw
+
+    import weather_display.framebuffer.frame_format
+    import weather_display.framebuffer.receiver
+
+    width, height = 321, 180
+
+    img = PIL.Image.new("RGBA", (width, height), (255, 255, 255, 255))
+    PIL.ImageDraw.Draw(img).rectangle((10, 20, 40, 30), fill=(0, 0, 0, 255))
+    gray = np.asarray(img.convert("L"))
+
+    for output_format in weather_display.framebuffer.frame_format.FORMAT_LIST:
+        for compress in [False, True]:
+            data = weather_display.framebuffer.frame_format.encode(img, output_format, compress)
+            frame = weather_display.framebuffer.frame_format.decode(data)
+
+            assert frame.shape == (height, width)
+            # NOTE: 4bit の場合は 16 階調に丸められる
+            assert np.abs(frame.astype(int) - gray).max() <= 8
+
+            if output_format == weather_display.framebuffer.frame_format.FORMAT_PNG:
+                continue
+
+            # NOTE: 通常のファイルを擬似的な 16bit のフレームバッファとして書き込む
+            fb_path = tmp_path / "fb"
+            fb_path.write_bytes(b"\x00" * (width * height * 2))
+            fb_info = weather_display.framebuffer.receiver.get_fb_info(fb_path, width, height, 16)
+
+            with fb_path.open("r+b") as fb:
+                weather_display.framebuffer.receiver.apply(io.BytesIO(data), fb, fb_info)
+
+            fb_data = np.frombuffer(fb_path.read_bytes(), dtype="<u2").reshape(height, width)
+            assert ((fb_data >> 11) == (frame >> 3)).all()
+
+    assert len(weather_display.framebuffer.frame_format.benchmark(img, 1)) == 5
+
+
+def test_render_query_cache(tmp_path):
+    import asyncio
+
+    import weather_display.render.query_cache
+
+    db_config = {"url": "URL", "org": "ORG", "bucket": "BUCKET", "cache": str(tmp_path / "query.db")}
+    request = {"measure": "MEASURE", "hostname": "HOST", "field": "temp", "start": "-60h", "stop": "now()"}
+
+    def fetch_data_mock(db_config, measure, hostname, field, **option):  # noqa: ARG001
+        fetch_data_mock.count += 1
+        return gen_sensor_data(valid=(field != "invalid"))
+
+    fetch_data_mock.count = 0
+
+    async def fetch_data_parallel_mock(db_config, request_list):
+        return [
+            weather_display.render.query_cache.call(fetch_data_mock, db_config, request)
+            for request in request_list
+        ]
+
+    weather_display.render.query_cache.pop_stats()
+
+    data = weather_display.render.query_cache.fetch(fetch_data_mock, db_config, request)
+    assert weather_display.render.query_cache.fetch(fetch_data_mock, db_config, request) == data
+    assert fetch_data_mock.count == 1
+
+    # NOTE: 取得に失敗した結果はキャッシュしない
+    invalid_request = dict(request, field="invalid")
+    for _ in range(2):
+        weather_display.render.query_cache.fetch(fetch_data_mock, db_config, invalid_request)
+    assert fetch_data_mock.count == 3
+
+    # NOTE: 並列取得では、キャッシュに無いものだけを取得する
+    result_list = asyncio.run(
+        weather_display.render.query_cache.fetch_parallel(
+            fetch_data_parallel_mock, db_config, [request, dict(request, field="humi")]
+        )
+    )
+    assert result_list[0] == data
+    assert fetch_data_mock.count == 4
+
+    stats = weather_display.render.query_cache.pop_stats()
+    assert stats["hit"] == 2
+    assert stats["miss"] == 4
+
+    # NOTE: キャッシュの設定が無い場合は毎回取得する
+    del db_config["cache"]
+    weather_display.render.query_cache.fetch(fetch_data_mock, db_config, request)
+    assert fetch_data_mock.count == 5
+    assert weather_display.render.query_cache.pop_stats()["miss"] == 0
+
+    assert weather_display.render.query_cache.get_ttl(request) == 180
+    assert weather_display.render.query_cache.get_ttl(dict(request, window_min=0, last=True)) == 60
+
+
+def test_render_series_buffer(tmp_path):
+    import weather_display.render.series_buffer
+
+    db_config = {"url": "URL", "org": "ORG", "bucket": "BUCKET", "history": str(tmp_path / "history")}
+    request = {"measure": "MEASURE", "hostname": "HOST", "field": "temp", "start": "-60h", "stop": "now()"}
+
+    start_list = []
+
+    def fetch_data_mock(db_config, measure, hostname, field, **option):  # noqa: ARG001
+        start_list.append(option["start"])
+        if field == "humi":
+            return {"value": [], "time": [], "valid": True}
+        if option["start"] == "-60h":
+            return gen_sensor_data()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return {"value": [99, 40], "time": [now - datetime.timedelta(minutes=66), now], "valid": True}
+
+    data = weather_display.render.series_buffer.fetch(fetch_data_mock, db_config, request)
+    assert data["value"] == [30, 34, 25, 20]
+
+    # NOTE: 2 回目は、最後の点の少し前から増えた分だけを、集計の窓の幅だけさらに前から取得する
+    data = weather_display.render.series_buffer.fetch(fetch_data_mock, db_config, request)
+    assert start_list[0] == "-60h"
+    assert start_list[1] == "-67m"
+    assert data["valid"]
+    # NOTE: 窓が欠けた状態で集計された先頭の点 (99) は使わない
+    assert data["value"] == [30, 34, 25, 40]
+    assert data["time_array"].tolist() == [t.timestamp() for t in data["time"]]
+
+    # NOTE: 系列が空の場合も、配列を付けて返す
+    data = weather_display.render.series_buffer.fetch(fetch_data_mock, db_config, dict(request, field="humi"))
+    assert data["time_array"].size == 0
+    assert data["value_array"].size == 0
+
+    # NOTE: 期間が相対指定でない問い合わせは、そのまま取得する
+    weather_display.render.series_buffer.fetch(
+        fetch_data_mock, db_config, dict(request, start="-228h", stop="-168h")
+    )
+    assert start_list[3] == "-228h"
+
+
+def test_render_batch_query():
+    import weather_display.render.batch_query
+
+    db_config = {"url": "URL", "org": "ORG", "bucket": "BUCKET"}
+    request_list = [
+        {"measure": "sensor.rasp", "hostname": host, "field": field, "start": "-60h", "stop": "now()"}
+        for field in ["temp", "humi", "lux"]
+        for host in ["HOST-1", "HOST-2"]
+    ]
+    request_list += [
+        {"measure": "hems.sharp", "hostname": host, "field": "power", "start": "-1h", "last": True}
+        for host in ["AIRCON-1", "AIRCON-2"]
+    ]
+
+    # NOTE: ホストごとに 1 回、最新値はまとめて 1 回
+    group_list = weather_display.render.batch_query.group_request(request_list)
+    assert group_list == [[0, 2, 4], [1, 3, 5], [6, 7]]
+
+    query = weather_display.render.batch_query.build_pivot_query(
+        db_config, [request_list[i] for i in [0, 2, 4]]
+    )
+    assert 'r._field == "temp" or r._field == "humi" or r._field == "lux"' in query
+    assert "pivot(" in query
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    offset = weather_display.render.batch_query.LOCALTIME_OFFSET
+    record_list = [
+        mock.MagicMock(values={"temp": temp, "humi": None}, get_time=mock.MagicMock(return_value=now))
+        for temp in [None, 20.0, 21.0, 22.0, 23.0]
+    ]
+    data_list = weather_display.render.batch_query.split_pivot(
+        [mock.MagicMock(records=record_list)], [request_list[0], request_list[2], request_list[4]]
+    )
+    # NOTE: fetch_data と同じく、None の点と末尾の余分な点 (窓の幅 - 間隔) を除く
+    assert data_list[0] == {"time": [now + offset, now + offset], "value": [20.0, 21.0], "valid": True}
+    assert not data_list[1]["valid"]
+    assert not data_list[2]["valid"]
+
+    record = mock.MagicMock(values={"hostname": "AIRCON-2"})
+    record.get_measurement.return_value = "hems.sharp"
+    record.get_time.return_value = now
+    record.get_value.return_value = 500
+    data_list = weather_display.render.batch_query.split_last(
+        [mock.MagicMock(records=[record])], request_list[6:]
+    )
+    assert not data_list[0]["valid"]
+    assert data_list[1]["value"] == [500]
+
+
+def test_render_batch_query_parity(mocker):
+    import my_lib.sensor_data
+
+    import weather_display.render.batch_query
+
+    db_config = {"url": "URL", "token": "TOKEN", "org": "ORG", "bucket": "BUCKET"}
+    request_list = [
+        {"measure": "sensor.rasp", "hostname": "HOST", "field": field, "start": "-1h", "stop": "now()"}
+        for field in ["temp", "humi", "lux"]
+    ]
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    time_list = [now + datetime.timedelta(minutes=i) for i in range(6)]
+    value_map = {
+        "temp": [None, 20.0, 21.0, 22.0, 23.0, 24.0],
+        "humi": [None, None, 50.0, 51.0, 52.0, 53.0],
+        "lux": [None] * 6,
+    }
+
+    def make_record(time, value):
+        return mock.MagicMock(
+            get_time=mock.MagicMock(return_value=time), get_value=mock.MagicMock(return_value=value)
+        )
+
+    # NOTE: 同じ点を、フィールドごとに取得した場合 (fetch_data) と pivot で取得した場合とで比べる
+    client_mock = mocker.patch("influxdb_client.InfluxDBClient")
+    client = client_mock.return_value
+    client.__enter__.return_value = client
+
+    expected_list = []
+    for request in request_list:
+        record_list = [make_record(t, v) for t, v in zip(time_list, value_map[request["field"]], strict=True)]
+        client.query_api.return_value.query.return_value = [mock.MagicMock(records=record_list)]
+        expected_list.append(
+            my_lib.sensor_data.fetch_data(
+                db_config,
+                request["measure"],
+                request["hostname"],
+                request["field"],
+                start=request["start"],
+                stop=request["stop"],
+            )
+        )
+
+    pivot_record_list = [
+        mock.MagicMock(
+            values={field: value_list[i] for field, value_list in value_map.items()},
+            get_time=mock.MagicMock(return_value=t),
+        )
+        for i, t in enumerate(time_list)
+    ]
+    data_list = weather_display.render.batch_query.split_pivot(
+        [mock.MagicMock(records=pivot_record_list)], request_list
+    )
+
+    assert data_list == expected_list
+
+
+def test_render_downsample():
+    import numpy as np
+
+    import weather_display.render.downsample
+
+    request = {"measure": "MEASURE", "hostname": "HOST", "field": "temp", "start": "-60h", "stop": "now()"}
+
+    # NOTE: 60 時間を 533 ピクセルに描く場合は 6 分間隔、1 ピクセルに 4 点取得する場合は 1 分間隔
+    assert weather_display.render.downsample.get_every_min(request, 533, "mean") == 6
+    assert weather_display.render.downsample.get_every_min(request, 533, "lttb") == 1
+    assert weather_display.render.downsample.get_every_min(dict(request, start="-168h"), 100, "mean") == 100
+
+    history, tail = weather_display.render.downsample.split_request(request, 533, "mean")
+    assert history["every_min"] == 6
+    assert history["window_min"] == 6
+    assert tail["start"] == "-9m"
+    assert "every_min" not in tail
+
+    history = gen_sensor_data([10, 20, 30, 40])
+    tail = {"time": history["time"][2:], "value": [35, 45], "valid": True}
+    assert weather_display.render.downsample.combine(history, tail)["value"] == [10, 20, 35, 45]
+
+    y = np.sin(np.linspace(0, 20, 2000))
+    y[1000] = 5
+    index = weather_display.render.downsample.lttb_index(np.arange(2000, dtype=np.float64), y, 100)
+    assert len(index) == 100
+    assert index[0] == 0
+    assert index[-1] == 1999
+    assert 1000 in index
+
+    index = weather_display.render.downsample.minmax_index(y, 50)
+    assert 1000 in index
+    assert int(np.argmin(y)) in index
+    assert index[-1] == 1999
+
+    # NOTE: 最新の値は間引かない
+    data = gen_sensor_data(list(range(100)))
+    data["value"][50] = None
+    reduced = weather_display.render.downsample.reduce(data, 20, "lttb")
+    assert len(reduced["value"]) == 20
+    assert reduced["value"][-1] == 99
+    assert None not in reduced["value"]
+
+
+def test_render_http_session(mocker, tmp_path):
+    import gzip
+    import http.server
+    import threading
+    import urllib.request
+
+    import weather_display.render.http_session
+
+    body = "<html><body>天気</body></html>".encode()
+    log_list = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            log_list.append((self.client_address[1], self.headers.get("If-None-Match")))
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            is_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+            data = gzip.compress(body) if is_gzip else body
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            if is_gzip:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    mocker.patch("weather_display.render.http_session.CACHE_DIR", tmp_path)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        weather_display.render.http_session.pop_stats()
+
+        url = f"http://127.0.0.1:{server.server_address[1]}/page"
+        assert weather_display.render.http_session.opener.open(url).read() == body
+        with weather_display.render.http_session.session():
+            assert [urllib.request.urlopen(url).read() for _ in range(2)] == [body] * 2
+
+        # NOTE: session() の外では、urlopen() はこのモジュールの接続とキャッシュを使わない
+        assert urllib.request.urlopen(url).read() == body
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # NOTE: 2 回目以降は同じ接続を使い、変更が無いので 304 で済む
+    assert len({port for port, _ in log_list[:3]}) == 1
+    assert [etag for _, etag in log_list] == [None, '"v1"', '"v1"', None]
+    assert weather_display.render.http_session.pop_stats() == {"request": 3, "reuse": 2, "not_modified": 2}
+
+
+def test_render_http_session_timeout(mocker):
+    import http.client
+
+    import weather_display.render.http_session
+
+    conn = mocker.MagicMock()
+    conn.getresponse.side_effect = TimeoutError("timed out")
+    connection_class = mocker.MagicMock(return_value=conn, __name__="HTTPConnection")
+
+    # NOTE: 保持していた接続でタイムアウトした場合も、再送せずに接続を捨てる
+    connection_map = weather_display.render.http_session.get_connection_map()
+    connection_map[("HTTPConnection", "example.com")] = conn
+
+    with pytest.raises(TimeoutError):
+        weather_display.render.http_session.send(connection_class, "example.com", "GET", "/", None, {})
+
+    conn.close.assert_called_once()
+    connection_class.assert_not_called()
+    assert ("HTTPConnection", "example.com") not in connection_map
+
+    # NOTE: 新しい接続での通信エラーも、接続を捨ててから送出する
+    conn.reset_mock()
+    conn.getresponse.side_effect = OSError("unreachable")
+
+    with pytest.raises(OSError, match="unreachable"):
+        weather_display.render.http_session.send(connection_class, "example.com", "GET", "/", None, {})
+
+    conn.close.assert_called_once()
+    assert ("HTTPConnection", "example.com") not in connection_map
+
+    conn.reset_mock()
+    conn.getresponse.side_effect = http.client.RemoteDisconnected("closed")
+
+    with pytest.raises(http.client.RemoteDisconnected):
+        weather_display.render.http_session.send(connection_class, "example.com", "GET", "/", None, {})
+
+    assert ("HTTPConnection", "example.com") not in connection_map
+
+
+def test_render_source_cache(mocker, tmp_path):
+    import time
+
+    import weather_display.render.source_cache
+
+    now = datetime.datetime(2026, 8, 1, 23, 20, tzinfo=TIMEZONE)
+    assert weather_display.render.source_cache.get_refresh("weather", now) == (
+        datetime.datetime(2026, 8, 2, 0, 10, tzinfo=TIMEZONE).timestamp()
+    )
+    assert weather_display.render.source_cache.get_refresh("sunset", now) == (
+        datetime.datetime(2026, 8, 2, 0, 0, tzinfo=TIMEZONE).timestamp()
+    )
+
+    func = mocker.MagicMock(side_effect=lambda config: {"current": config["value"]})
+    config = {"value": 30}
+
+    def get():
+        return weather_display.render.source_cache.get(tmp_path, "wbgt", func, config)
+
+    # NOTE: 有効期限内であれば取得しない
+    assert get() == {"current": 30}
+    assert get() == {"current": 30}
+    assert func.call_count == 1
+
+    # NOTE: 内容が更新される前は、有効期限が近くても取得し直さない
+    path = weather_display.render.source_cache.get_path(tmp_path, "wbgt", (config,))
+    weather_display.render.source_cache.save(
+        path, {"value": {"current": 28}, "refresh": time.time() + 60, "expire": time.time() + 120}
+    )
+    assert get() == {"current": 28}
+    assert func.call_count == 1
+
+    # NOTE: 内容が更新された後は、キャッシュした値を返しつつバックグラウンドで取得し直す
+    weather_display.render.source_cache.save(
+        path, {"value": {"current": 28}, "refresh": time.time() - 1, "expire": time.time() + 60}
+    )
+    assert get() == {"current": 28}
+    for _ in range(50):
+        if func.call_count == 2 and len(weather_display.render.source_cache.refresh_set) == 0:
+            break
+        time.sleep(0.1)
+    assert func.call_count == 2
+    assert get() == {"current": 30}
+
+    # NOTE: 有効期限が切れていれば、取得を待つ
+    weather_display.render.source_cache.save(
+        path, {"value": {"current": 28}, "refresh": time.time() - 61, "expire": time.time() - 1}
+    )
+    assert get() == {"current": 30}
+    assert func.call_count == 3
+
+    # NOTE: キャッシュの設定が無い場合は毎回取得する
+    weather_display.render.source_cache.get(None, "wbgt", func, config)
+    assert func.call_count == 4
+
+
+def test_render_text_metrics(mocker, config):
+    import my_lib.pil_util
+    import PIL.Image
+
+    import weather_display.panel.weather
+    import weather_display.render.text_metrics
+
+    weather_display.render.text_metrics.clear()
+    text_size_mock = mocker.patch("my_lib.pil_util.text_size", wraps=my_lib.pil_util.text_size)
+
+    img = PIL.Image.new("RGBA", (10, 10))
+    expected = tuple(
+        my_lib.pil_util.text_size(img, my_lib.pil_util.get_font(config["font"], "en_bold", 120), "0")
+    )
+    text_size_mock.reset_mock()
+
+    # NOTE: フォントを読み込み直しても、同じフォントとサイズであれば計測し直さない
+    for _ in range(3):
+        font = my_lib.pil_util.get_font(config["font"], "en_bold", 120)
+        assert weather_display.render.text_metrics.text_size(img, font, "0") == expected
+    assert text_size_mock.call_count == 1
+
+    weather_display.render.text_metrics.text_size(
+        img, my_lib.pil_util.get_font(config["font"], "en_bold", 80), "0"
+    )
+    assert text_size_mock.call_count == 2
+
+    # NOTE: 天気予報の表の固定の寸法は、フォントの設定ごとに一度だけ求める
+    mocker.patch.dict("weather_display.panel.weather.layout_cache", clear=True)
+    face_map = weather_display.panel.weather.get_layout_face_map(config["font"])
+    assert weather_display.panel.weather.get_layout_face_map(config["font"]) is face_map
+    assert face_map["temp"]["layout"]["digit"] == tuple(
+        my_lib.pil_util.text_size(img, face_map["temp"]["value"], "0")
+    )
+
+    weather_display.render.text_metrics.clear()
+
+
+def test_render_text_sprite(config):
+    import my_lib.pil_util
+    import numpy as np
+    import PIL.Image
+
+    import weather_display.render.text_sprite
+
+    weather_display.render.text_sprite.clear()
+
+    font = my_lib.pil_util.get_font(config["font"], "en_bold", 130)
+    sprite_font = weather_display.render.text_sprite.get_font(font)
+    assert (
+        weather_display.render.text_sprite.get_font(my_lib.pil_util.get_font(config["font"], "en_bold", 130))
+        is sprite_font
+    )
+
+    def draw(face, text):
+        img = PIL.Image.new("RGBA", (600, 200), (255, 255, 255, 0))
+        my_lib.pil_util.draw_text(
+            img, text, (580, 20), face, "right", "#333333", stroke_width=20, stroke_fill=(255, 255, 255, 200)
+        )
+        return np.asarray(img).astype(np.int32)
+
+    for text in ["12:34", "21:43", "0.5", "mm/h"]:
+        expected = draw(font, text)
+        actual = draw(sprite_font, text)
+
+        # NOTE: 縁取りが重なる部分のアンチエイリアス以外は、フォントで直接描画した結果と一致する
+        diff = np.abs(expected - actual)
+        assert diff.max() <= 64
+        assert diff.mean() < 0.01
+
+        assert (draw(sprite_font, text) == actual).all()
+
+    # NOTE: 数字と記号は文字ごとのマスクを使い回し、それ以外はテキスト全体のマスクを使い回す
+    assert {key[0] for key in sprite_font.mask_cache} == {"12:34", "21:43", "0.5", "mm/h"}
+    assert {dict(key)["text"] for key in sprite_font.sprite_cache} == set("1234:0.5")
+
+    # NOTE: 直前の文字とのカーニングも、文字の位置に反映する
+    getlength = sprite_font.getlength
+    width = sprite_font.getmask2("21", "L")[0].size[0]
+    sprite_font.mask_cache.clear()
+    with mock.patch.object(
+        sprite_font,
+        "getlength",
+        side_effect=lambda text, *args, **kwargs: (
+            getlength(text, *args, **kwargs) - (10 if "21" in text else 0)
+        ),
+    ):
+        assert sprite_font.getmask2("21", "L")[0].size[0] == width - 10
+
+    weather_display.render.text_sprite.clear()
+
+
+def test_render_compositor():
+    import numpy as np
+    import PIL.Image
+
+    import weather_display.render.compositor
+
+    width, height = 320, 180
+    layer_list = weather_display.render.compositor.make_dummy_layer_list(width, height)
+    # NOTE: キャンバスからはみ出すもの、アルファを持たないもの、完全に透明なものも合成できる
+    layer_list += [
+        (PIL.Image.new("RGB", (40, 40), (0, 0, 0)), (-20, -20)),
+        (PIL.Image.new("RGBA", (40, 40), (0, 0, 0, 0)), (10, 10)),
+        (PIL.Image.new("RGBA", (40, 40), (0, 0, 0, 100)), (300, 160)),
+    ]
+
+    img = weather_display.render.compositor.compose((width, height), layer_list)
+    reference = weather_display.render.compositor.compose_reference((width, height), layer_list)
+
+    assert img.mode == "L"
+    assert img.size == (width, height)
+    assert np.abs(np.asarray(img, dtype=int) - np.asarray(reference.convert("L"), dtype=int)).max() <= 2
+
+    result = weather_display.render.compositor.benchmark((width, height), layer_list, 1)
+    assert result["max_diff"] <= 2
+
+
+def test_framebuffer_quantize():
+    import numpy as np
+    import PIL.Image
+
+    import weather_display.framebuffer.frame_format
+    import weather_display.framebuffer.quantize
+
+    width, height = 67, 45
+    img = PIL.Image.fromarray(np.tile(np.linspace(0, 255, width).astype(np.uint8), (height, 1)))
+
+    for levels in weather_display.framebuffer.quantize.LEVELS_LIST:
+        for dither in weather_display.framebuffer.quantize.DITHER_LIST:
+            for gamma in [1.0, 2.2]:
+                quantized = weather_display.framebuffer.quantize.quantize(img, levels, dither, gamma)
+                pixel = np.asarray(quantized)
+
+                assert quantized.size == (width, height)
+                assert set(np.unique(pixel)) <= set(weather_display.framebuffer.quantize.level_value(levels))
+
+                # NOTE: 16 階調以下に減色していれば、4bit に詰めても値は変わらない
+                data = weather_display.framebuffer.frame_format.encode(
+                    quantized, weather_display.framebuffer.frame_format.FORMAT_GRAY4
+                )
+                assert (weather_display.framebuffer.frame_format.decode(data) == pixel).all()
+
+    # NOTE: ディザリングすると、面積あたりの平均の明るさは元の画像に近くなる
+    gray = PIL.Image.new("L", (64, 64), 100)
+    for dither in [
+        weather_display.framebuffer.quantize.DITHER_ORDERED,
+        weather_display.framebuffer.quantize.DITHER_DIFFUSION,
+    ]:
+        pixel = np.asarray(weather_display.framebuffer.quantize.quantize(gray, 2, dither))
+        assert abs(pixel.mean() - 100) < 4
+
+    with pytest.raises(ValueError, match="Unsupported levels"):
+        weather_display.framebuffer.quantize.quantize(img, 3)
+
+    assert len(weather_display.framebuffer.quantize.benchmark(img, 1)) == 10
+
+
+def test_create_image_quantize_effect(caplog, config):
+    import numpy as np
+    import PIL.Image
+
+    import create_image
+
+    width, height = 200, 100
+    img = PIL.Image.fromarray(np.tile(np.linspace(0, 255, width).astype(np.uint8), (height, 1))).convert(
+        "RGBA"
+    )
+    config = dict(config, panel=dict(config["panel"], device=dict(config["panel"]["device"], quantize={})))
+
+    # NOTE: デバッグモードの場合は、減色によるサイズとエンコード時間の変化を記録する
+    with caplog.at_level(logging.DEBUG):
+        quantized = create_image.quantize_image(config, img)
+
+    assert quantized.size == (width, height)
+    assert any(record.getMessage().startswith("quantize effect:") for record in caplog.records)
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        create_image.quantize_image(config, img)
+
+    assert not any(record.getMessage().startswith("quantize effect:") for record in caplog.records)
+
+
 ######################################################################
 @pytest.mark.xdist_group(name="Selenium")
 def test_display_image(mocker, config):
@@ -1318,3 +2422,224 @@ def test_display_image_error_unknown(mocker, config):
     # NOTE: 本来、create_image の中で通知されているので、上記の故障注入方法では通知はされない
     check_notify_slack(None)
     check_liveness(config, False)
+
+
+def test_display_image_connection(mocker, config):
+    import builtins
+
+    import display_image
+    import weather_display.display
+
+    ssh_mock = mocker.MagicMock()
+
+    stdin_mock = mocker.MagicMock()
+    stdout_mock = mocker.MagicMock()
+    stderr_mock = mocker.MagicMock()
+    stdout_mock.channel.recv_exit_status.return_value = 0
+
+    ssh_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
+    ssh_mock.get_transport.return_value.is_active.return_value = True
+
+    mocker.patch("paramiko.RSAKey.from_private_key")
+    ssh_client_mock = mocker.patch("paramiko.SSHClient", return_value=ssh_mock)
+
+    orig_open = builtins.open
+
+    def open_mock(  # noqa: PLR0913
+        file,
+        mode="r",
+        buffering=-1,
+        encoding=None,
+        errors=None,
+        newline=None,
+        closefd=True,
+        opener=None,
+    ):
+        if file == "TEST":
+            return mocker.MagicMock()
+        else:
+            return orig_open(file, mode, buffering, encoding, errors, newline, closefd, opener)
+
+    mocker.patch("builtins.open", side_effect=open_mock)
+
+    render_client = mocker.MagicMock()
+    render_client.render.return_value = {"image": b"PNG", "status": 0, "elapsed": 1.0, "latency": 1.5}
+
+    connection = weather_display.display.SSHConnection("TEST", "TEST")
+    for _ in range(2):
+        display_image.execute(
+            config,
+            "TEST",
+            "TEST",
+            CONFIG_FILE,
+            small_mode=False,
+            test_mode=True,
+            is_one_time=True,
+            render_client=render_client,
+            connection=connection,
+        )
+
+    # NOTE: 接続は維持され、フレームごとにコマンドを実行する
+    ssh_client_mock.assert_called_once()
+    assert ssh_mock.exec_command.call_count == 2
+
+    # NOTE: 切断されていたら接続し直す
+    ssh_mock.get_transport.return_value.is_active.return_value = False
+    connection.get()
+    assert ssh_client_mock.call_count == 2
+
+    connection.close()
+
+    check_notify_slack(None)
+    check_liveness(config, True)
+
+
+def test_display_image_fanout(mocker, config):
+    import builtins
+
+    import display_image
+
+    ssh_mock = mocker.MagicMock()
+
+    stdin_mock = mocker.MagicMock()
+    stdout_mock = mocker.MagicMock()
+    stderr_mock = mocker.MagicMock()
+    stdout_mock.channel.recv_exit_status.return_value = 0
+
+    ssh_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
+    ssh_mock.get_transport.return_value.is_active.return_value = True
+
+    mocker.patch("paramiko.RSAKey.from_private_key")
+    mocker.patch("paramiko.SSHClient", return_value=ssh_mock)
+
+    orig_open = builtins.open
+
+    def open_mock(  # noqa: PLR0913
+        file,
+        mode="r",
+        buffering=-1,
+        encoding=None,
+        errors=None,
+        newline=None,
+        closefd=True,
+        opener=None,
+    ):
+        if file == "TEST":
+            return mocker.MagicMock()
+        else:
+            return orig_open(file, mode, buffering, encoding, errors, newline, closefd, opener)
+
+    mocker.patch("builtins.open", side_effect=open_mock)
+
+    render_client = mocker.MagicMock()
+    render_client.render.return_value = {"image": b"PNG", "status": 0, "elapsed": 1.0, "latency": 1.5}
+
+    target_list = display_image.parse_target(["HOST1", "HOST2:normal"], False, "TEST")
+
+    display_image.execute_fanout(
+        {False: config},
+        {False: CONFIG_FILE},
+        target_list,
+        test_mode=True,
+        is_one_time=True,
+        render_client=render_client,
+    )
+
+    # NOTE: 表示先が複数あっても、画像の生成は 1 回だけ
+    render_client.render.assert_called_once()
+    assert ssh_mock.exec_command.call_count == 2
+
+    # NOTE: 1 台が失敗しても、他の表示先には表示される
+    mocker.patch.object(target_list[1]["connection"], "get", side_effect=RuntimeError("TEST"))
+    display_image.execute_fanout(
+        {False: config},
+        {False: CONFIG_FILE},
+        target_list,
+        test_mode=True,
+        is_one_time=True,
+        render_client=render_client,
+    )
+
+    assert render_client.render.call_count == 2
+    assert ssh_mock.exec_command.call_count == 3
+
+    # NOTE: 画像の生成に失敗しても、プロセスは終了せずに表示先ごとの失敗として扱う
+    render_client.render.return_value = {"image": b"PNG", "status": 1, "elapsed": 1.0, "latency": 1.5}
+    with pytest.raises(RuntimeError, match="Failed to display on all hosts"):
+        display_image.execute_fanout(
+            {False: config},
+            {False: CONFIG_FILE},
+            target_list,
+            test_mode=True,
+            is_one_time=True,
+            render_client=render_client,
+        )
+
+    assert render_client.render.call_count == 3
+
+    for target in target_list:
+        target["connection"].close()
+
+    check_notify_slack(None)
+    check_liveness(config, True)
+
+
+def test_display_image_render_client(mocker, config):
+    import builtins
+
+    import display_image
+
+    ssh_mock = mocker.MagicMock()
+
+    stdin_mock = mocker.MagicMock()
+    stdout_mock = mocker.MagicMock()
+    stderr_mock = mocker.MagicMock()
+    stdout_mock.channel.recv_exit_status.return_value = 0
+
+    ssh_mock.exec_command.return_value = (stdin_mock, stdout_mock, stderr_mock)
+
+    mocker.patch("paramiko.RSAKey.from_private_key")
+    mocker.patch("paramiko.SSHClient", return_value=ssh_mock)
+
+    orig_open = builtins.open
+
+    def open_mock(  # noqa: PLR0913
+        file,
+        mode="r",
+        buffering=-1,
+        encoding=None,
+        errors=None,
+        newline=None,
+        closefd=True,
+        opener=None,
+    ):
+        if file == "TEST":
+            return mocker.MagicMock()
+        else:
+            return orig_open(file, mode, buffering, encoding, errors, newline, closefd, opener)
+
+    mocker.patch("builtins.open", side_effect=open_mock)
+
+    render_client = mocker.MagicMock()
+    render_client.render.return_value = {"image": b"PNG", "status": 0, "elapsed": 1.0, "latency": 1.5}
+    popen_mock = mocker.patch("subprocess.Popen")
+
+    display_image.execute(
+        config,
+        "TEST",
+        "TEST",
+        CONFIG_FILE,
+        small_mode=False,
+        test_mode=True,
+        is_one_time=True,
+        render_client=render_client,
+    )
+
+    # NOTE: 常駐サーバを使う場合は create_image.py を起動しない
+    popen_mock.assert_not_called()
+    render_client.render.assert_called_once()
+    # NOTE: 画像は常駐サーバから届いたそばから SSH に書き込む
+    assert render_client.render.call_args.kwargs["output"] is stdin_mock
+
+    check_notify_slack(None)
+    check_liveness(config, True)